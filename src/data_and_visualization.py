@@ -1,12 +1,60 @@
 #define function
+# Function to resolve species names to Wikidata Q codes with batched SPARQL queries
+def resolve_species_qcodes(species_names, endpoint_url="https://query.wikidata.org/sparql", batch_size=200, requests_per_minute=30):
+    """
+    Resolves species names to Wikidata Q codes, packing many names in one VALUES block per query.
+
+    Parameters:
+    species_names (list): Species names (English labels) to resolve.
+    endpoint_url (str): Wikidata Query Service endpoint URL.
+    batch_size (int): Number of names sent in each SPARQL query.
+    requests_per_minute (int): Rate limit applied between queries.
+
+    Returns:
+    dict: The Q code hyperlink (e.g. 'http://www.wikidata.org/entity/Q42') of each resolved name.
+    """
+    # Unique names, in the order they first appear
+    names = list(dict.fromkeys(name for name in species_names if isinstance(name, str)))
+
+    q_codes = {}
+    for start in range(0, len(names), batch_size):
+        batch = names[start:start + batch_size]
+
+        # Escape the names as SPARQL string literals
+        values = " ".join('"{}"@en'.format(name.replace('\\', '\\\\').replace('"', '\\"')) for name in batch)
+        sparql_query = f"""
+        SELECT ?name ?species WHERE {{
+            VALUES ?name {{ {values} }}
+            ?species rdfs:label ?name.
+        }}
+        """
+
+        # POST keeps long VALUES blocks out of the URL
+        response = cached_post(endpoint_url, headers={'Accept': 'text/csv'}, data={'query': sparql_query})
+
+        if response.status_code == 200:
+            df_qcode = pd.read_csv(StringIO(response.text), dtype=str, keep_default_na=False)
+            for name, q_code in zip(df_qcode['name'], df_qcode['species']):
+                q_codes.setdefault(name, q_code)  # Keep the first match of each name
+        else:
+            print(f"Failed to retrieve Q codes for {len(batch)} species. Status code: {response.status_code}")
+
+        # Implement rate limiting by waiting between requests (cached answers did not reach the endpoint)
+        if start + batch_size < len(names) and not response.from_cache:
+            time.sleep(60 / requests_per_minute)
+
+    return q_codes
+
 # Function to process a single CSV file and retrieve Q codes
-def process_csv_file(input_file, output_folder):
+def process_csv_file(input_file, output_folder, batch_size=200, name_resolver=None, fuzzy_threshold=None,
+                     endpoint_url="https://query.wikidata.org/sparql"):
+    # Names known to the local resolver (name_resolver.NameResolver) are not sent to Wikidata;
+    # fuzzy_threshold also accepts close spellings (trigram score between 0 and 1).
+    # endpoint_url is the Wikidata Query Service endpoint URL
+
     # Read the original CSV file containing the species names
     df_species = pd.read_csv(input_file)
     
-    # Define the Wikidata Query Service endpoint URL
-    endpoint_url = "https://query.wikidata.org/sparql"
-    
     # Initialize an empty list to store the Q codes
     q_codes = []
     
@@ -16,40 +64,28 @@ def process_csv_file(input_file, output_folder):
     # Define the number of requests allowed per minute (adjust according to Wikidata's rate limits)
     requests_per_minute = 30
     
-    # Iterate through the species names in the CSV file
-    for index, row in df_species.iterrows():
-        species_name = row[species_header]
+    # Resolve the names locally first, then query Wikidata for the remaining ones, batch_size names per request
+    species_names = df_species[species_header].tolist()
+    resolved = {}
+    if name_resolver is not None:
+        resolved, fuzzy, species_names = name_resolver.resolve(species_names, fuzzy_threshold)
+        for species_name, (matched_name, score) in fuzzy.items():
+            print(f"⚠️ Matched species {species_name} to {matched_name} (score {score:.2f})")
+        print(f"✅ Resolved {len(resolved)} species locally, {len(species_names)} left for Wikidata")
+    if species_names:
+        resolved.update(resolve_species_qcodes(species_names, endpoint_url, batch_size, requests_per_minute))
     
+    # Map the Q codes back to the species rows
+    for species_name in df_species[species_header]:
         # Check if the species_name is a valid string
         if isinstance(species_name, str):
-            # Query Wikidata to retrieve the corresponding Q code for the species
-            sparql_query = f"""
-            SELECT ?species ?speciesLabel WHERE {{
-                
-                ?species rdfs:label "{species_name}"@en.
-                SERVICE wikibase:label {{ bd:serviceParam wikibase:language "[AUTO_LANGUAGE],en". }}
-            }}
-            """
-    
-            response = requests.get(endpoint_url, headers={'Accept': 'text/csv'}, params={'query': sparql_query})
-    
-            if response.status_code == 200:
-                csv_data = response.text
-                df_qcode = pd.read_csv(StringIO(csv_data))
-    
-                if not df_qcode.empty:
-                    q_code = df_qcode['species'].values[0]  # Extract the Q code
-                    q_codes.append(q_code)  # Append the Q code to the list
-                    print(f"Retrieved Q code {q_code} for species: {species_name}")
-                else:
-                    q_codes.append(placeholder_value)  # Add a placeholder value
-                    print(f"No Q code found for species: {species_name}")
+            if species_name in resolved:
+                q_code = resolved[species_name]
+                q_codes.append(q_code)  # Append the Q code to the list
+                print(f"Retrieved Q code {q_code} for species: {species_name}")
             else:
-                q_codes.append(placeholder_value)  # Add a placeholder value for failed requests
-                print(f"Failed to retrieve Q code for species: {species_name}. Status code: {response.status_code}")
-    
-            # Implement rate limiting by waiting between requests
-            time.sleep(60 / requests_per_minute)  # Wait for one minute divided by the allowed requests per minute
+                q_codes.append(placeholder_value)  # Add a placeholder value
+                print(f"No Q code found for species: {species_name}")
         else:
             q_codes.append(placeholder_value)  # Add a placeholder value for invalid species names
     
@@ -92,8 +128,8 @@ def fetch_species_from_qcode(qcode):
         "User-Agent": "Wikidata Species Fetcher/0.1 (https://www.wikidata.org/wiki/Wikidata:Data_access)"
     }
 
-    # Perform the request
-    response = requests.get(url, headers=headers, params={'query': query, 'format': 'json'})
+    # Perform the request (served from the HTTP cache when the same query was answered before)
+    response = cached_get(url, headers=headers, params={'query': query, 'format': 'json'})
 
     if response.status_code != 200:
         raise Exception("Failed to fetch data: HTTP status code {}".format(response.status_code))
@@ -127,39 +163,7 @@ def recover_LOTUS_data(input_file, output_folder):
         filtered_lotusdb = lotusdb_df[lotusdb_df['wikidata_Qcode'] == q_code]  # Ensure this column name matches your LOTUSDB CSV
 
         # Group and aggregate the data
-        grouped_df = filtered_lotusdb.groupby("structure_inchikey").agg({
-            # Add all the aggregation rules here
-            # Example:
-            "structure_wikidata": "first",
-            "structure_inchi": "first",
-            "structure_smiles": "first",
-            "structure_molecular_formula": "first",
-            "structure_exact_mass": "first",
-            "structure_xlogp": "first",
-            "structure_smiles_2D": "first",
-            "structure_cid": "first",
-            "structure_nameIupac": "first",
-            "structure_nameTraditional": "first",
-            "structure_taxonomy_npclassifier_01pathway": "first",
-            "structure_taxonomy_npclassifier_02superclass": "first",
-            "structure_taxonomy_npclassifier_03class": "first",
-            "organism_wikidata": "first",
-            "organism_taxonomy_gbifid": "first",
-            "organism_taxonomy_ncbiid": "first",
-            "organism_taxonomy_ottid": "first",
-            "organism_taxonomy_01domain": "first",
-            "organism_taxonomy_02kingdom": "first",
-            "organism_taxonomy_03phylum": "first",
-            "organism_taxonomy_04class": "first",
-            "organism_taxonomy_05order": "first",
-            "organism_taxonomy_06family": "first",
-            "organism_taxonomy_07tribe": "first",
-            "organism_taxonomy_08genus": "first",
-            "organism_taxonomy_09species": "first",
-            "organism_taxonomy_10varietas": "first",
-            "reference_wikidata": lambda x: "|".join(map(str, x)),
-            "reference_doi": lambda x: "|".join(map(str, x))
-        }).reset_index()
+        grouped_df = aggregate_lotus(filtered_lotusdb, "structure_inchikey").reset_index()
         
         # Create 'chemical_superclass' and 'chemical_class' columns
         grouped_df['chemical_superclass'] = grouped_df['structure_taxonomy_npclassifier_01pathway'] + '-' + grouped_df['structure_taxonomy_npclassifier_02superclass']
@@ -308,14 +312,13 @@ def barplot_sclass_species(output_folder):
     Process data from .tsv files in the output folder and visualize it with a stacked barplot.
 
     Parameters:
-    output_folder (str): Path to the folder containing .tsv files.
+    output_folder (str): Path to the folder containing .tsv files, or a species_dataset folder.
 
     Returns:
     None
     """
-    # Step 1: Read data from all .tsv files in the output_folder
-    all_data = pd.concat([pd.read_csv(os.path.join(output_folder, filename), sep='\t') 
-                          for filename in os.listdir(output_folder) if filename.endswith(".tsv")])
+    # Step 1: Read data from all .tsv files in the output_folder (or from the taxon dataset it holds)
+    all_data = read_taxon_tables(output_folder)
 
     # Step 2: Rename the "organism_taxonomy_09species" column to "species"
     all_data.rename(columns={'organism_taxonomy_09species': 'species'}, inplace=True)
@@ -373,7 +376,7 @@ def barplot_sclass_species(output_folder):
     fig.update_layout(width=1500, height=1500)
 
     # Save the figure as an HTML file
-    fig.write_html(f'{output_folder}Wikidata_superclass_barplot_species.html')
+    write_figure(fig, f'{output_folder}Wikidata_superclass_barplot_species.html')
 
     # Show the figure
     fig.show()
@@ -384,14 +387,13 @@ def barplot_sclass_species_normalized(output_folder):
     Process data from .tsv files in the output folder and visualize it with a normalized stacked barplot.
 
     Parameters:
-    output_folder (str): Path to the folder containing .tsv files.
+    output_folder (str): Path to the folder containing .tsv files, or a species_dataset folder.
 
     Returns:
     None
     """
-    # Step 1: Read data from all .tsv files in the output_folder
-    all_data = pd.concat([pd.read_csv(os.path.join(output_folder, filename), sep='\t') 
-                          for filename in os.listdir(output_folder) if filename.endswith(".tsv")])
+    # Step 1: Read data from all .tsv files in the output_folder (or from the taxon dataset it holds)
+    all_data = read_taxon_tables(output_folder)
 
     # Step 2: Rename the "organism_taxonomy_09species" column to "species"
     all_data.rename(columns={'organism_taxonomy_09species': 'species'}, inplace=True)
@@ -475,7 +477,7 @@ def barplot_sclass_species_normalized(output_folder):
     fig.update_layout(width=1500, height=1500)
 
     # Save the figure as an HTML file
-    fig.write_html(f'{output_folder}Wikidata_superclass_barplot_species_normalized.html')
+    write_figure(fig, f'{output_folder}Wikidata_superclass_barplot_species_normalized.html')
 
     # Show the figure
     fig.show()
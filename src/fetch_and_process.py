@@ -1,17 +1,155 @@
 import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-import requests
+from http_cache import cached_get
+from lotus_store import load_lotus
+from rollup import CompoundRollup, ROLLUP_FILENAME
+from taxon_dataset import taxon_dataset_path, taxon_tables, write_taxon_dataset, read_dataset_manifest
+
+# LOTUS columns taking the first non-null value of each structure (InChIKey) of a taxon
+LOTUS_FIRST_COLUMNS = [
+    "structure_wikidata",
+    "structure_inchi",
+    "structure_smiles",
+    "structure_molecular_formula",
+    "structure_exact_mass",
+    "structure_xlogp",
+    "structure_smiles_2D",
+    "structure_cid",
+    "structure_nameIupac",
+    "structure_nameTraditional",
+    "structure_taxonomy_npclassifier_01pathway",
+    "structure_taxonomy_npclassifier_02superclass",
+    "structure_taxonomy_npclassifier_03class",
+    "organism_wikidata",
+    "organism_taxonomy_gbifid",
+    "organism_taxonomy_ncbiid",
+    "organism_taxonomy_ottid",
+    "organism_taxonomy_01domain",
+    "organism_taxonomy_02kingdom",
+    "organism_taxonomy_03phylum",
+    "organism_taxonomy_04class",
+    "organism_taxonomy_05order",
+    "organism_taxonomy_06family",
+    "organism_taxonomy_07tribe",
+    "organism_taxonomy_08genus",
+    "organism_taxonomy_09species",
+    "organism_taxonomy_10varietas"
+]
+
+# LOTUS columns whose values are joined with '|' over each structure of a taxon
+LOTUS_JOIN_COLUMNS = ["reference_wikidata", "reference_doi"]
+
+# LOTUS columns read by the extraction functions
+LOTUS_COLUMNS = ["wikidata_Qcode", "structure_inchikey"] + LOTUS_FIRST_COLUMNS + LOTUS_JOIN_COLUMNS
+
+# Version of the aggregation spec, recorded in the manifests; bump it whenever the output of aggregate_lotus changes
+AGGREGATION_SPEC_VERSION = 1
+
+# Manifest written next to the per-taxon TSV files of 'species_data' and 'genus_data'
+MANIFEST_FILENAME = 'manifest.json'
+
+# Cache of the chemical class counts computed by process_species_data for each species TSV
+CLASS_SUMMARY_FILENAME = 'class_summary.json'
+
+# Taxon levels of the outputs: LOTUS column of the taxa, label and plural used in the messages
+TAXON_LEVELS = {
+    'species': ('wikidata_Qcode', 'Q code', 'species'),
+    'genus': ('organism_taxonomy_08genus', 'genus', 'genera')
+}
+
+
+def _join_per_group(values, group_ids, n_groups):
+    # Join the string form of the values of each group with '|', keeping the row order inside groups
+    if not n_groups:
+        return np.empty(0, dtype=object)
+    order = np.argsort(group_ids, kind='mergesort')
+    sorted_ids = group_ids[order]
+    strings = np.array(list(map(str, values[order])), dtype=object)
+
+    # Prefix every value but the first of its group with the separator, then concatenate each group
+    not_first = np.r_[False, sorted_ids[1:] == sorted_ids[:-1]]
+    strings[not_first] = '|' + strings[not_first]
+    starts = np.flatnonzero(~not_first)
+    return np.add.reduceat(strings, starts)
+
+
+def aggregate_lotus(lotusdb_df, keys):
+    """
+    Aggregates LOTUS rows per group of keys (e.g. per structure_inchikey of a taxon).
+
+    Structure and organism columns keep their first non-null value and reference columns are joined
+    with '|' in row order, like groupby(keys).agg({...: "first", ...: lambda x: "|".join(map(str, x))})
+    but without calling Python code for every group.
+
+    Parameters:
+    - lotusdb_df: LOTUS rows holding the key columns and LOTUS_FIRST_COLUMNS + LOTUS_JOIN_COLUMNS.
+    - keys: Column name or list of column names to group by.
 
-def fetch_species_from_qcode(qcode):
+    Returns:
+    pd.DataFrame: One row per group, indexed by the keys, sorted by the keys.
+    """
+    grouped = lotusdb_df.groupby(keys)
+
+    # Step 1: Group number of every row, sorted by the keys (rows with a missing key are dropped)
+    group_ids = grouped.ngroup().to_numpy(dtype=float)
+    valid = group_ids >= 0
+    group_ids = group_ids[valid].astype(np.int64)
+    rows = np.flatnonzero(valid)
+
+    # Step 2: 'first' for the structure and organism columns, as integer takes of the first non-null row
+    # of every group (the rows are stably sorted by group once, then each column is a linear scan)
+    order = np.argsort(group_ids, kind='mergesort')
+    sorted_ids, sorted_rows = group_ids[order], rows[order]
+    n_groups = grouped.ngroups
+    key_rows = sorted_rows[np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]] if n_groups else sorted_rows
+    key_values = lotusdb_df[keys].iloc[key_rows]
+    if isinstance(key_values, pd.DataFrame) and key_values.shape[1] > 1:
+        index = pd.MultiIndex.from_frame(key_values)
+    else:
+        index = pd.Index(key_values.squeeze(axis=1) if isinstance(key_values, pd.DataFrame) else key_values)
+    grouped_df = pd.DataFrame(index=index)
+    for column in LOTUS_FIRST_COLUMNS:
+        values = lotusdb_df[column]
+        not_null = values.notna().to_numpy()[sorted_rows]
+        column_ids, column_rows = sorted_ids[not_null], sorted_rows[not_null]
+        first = np.r_[True, column_ids[1:] != column_ids[:-1]] if len(column_ids) else np.zeros(0, dtype=bool)
+        taken = values.iloc[column_rows[first]].set_axis(column_ids[first])
+        if len(taken) != n_groups:
+            taken = taken.reindex(np.arange(n_groups))  # Groups without a non-null value get a missing value
+        grouped_df[column] = taken.set_axis(index)
+
+    # Step 3: Vectorized '|' join for the reference columns
+    for column in LOTUS_JOIN_COLUMNS:
+        values = lotusdb_df[column].to_numpy(dtype=object)[valid]
+        grouped_df[column] = _join_per_group(values, group_ids, len(grouped_df))
+
+    return grouped_df
+
+
+def fetch_species_from_qcode(qcode, taxonomy_index=None):
     """
     Fetches all species under a given genus using the Wikidata SPARQL endpoint.
 
+    With a local taxonomy index (taxonomy_index.get_taxonomy_index) the species are read from its
+    nested-set intervals instead of the transitive P171* query, which times out for large families.
+    The SPARQL query is still used when the taxon is not in the index.
+
     Parameters:
     genus_qcode (str): The Wikidata Q-code for the genus.
+    taxonomy_index (TaxonomyIndex): Optional local taxonomy index.
 
     Returns:
     pd.DataFrame: A DataFrame containing the species and their corresponding Q-codes.
     """
+    if taxonomy_index is not None:
+        species_df = taxonomy_index.descendant_species(qcode)
+        if species_df is not None:
+            return species_df
+        print(f"⚠️ {qcode} is not in the taxonomy index, querying Wikidata instead.")
 
     # SPARQL query to fetch species under a given genus
     query = """
@@ -30,8 +168,8 @@ def fetch_species_from_qcode(qcode):
         "User-Agent": "Wikidata Species Fetcher/0.1 (https://www.wikidata.org/wiki/Wikidata:Data_access)"
     }
 
-    # Perform the request
-    response = requests.get(url, headers=headers, params={'query': query, 'format': 'json'})
+    # Perform the request (served from the HTTP cache when the same query was answered before)
+    response = cached_get(url, headers=headers, params={'query': query, 'format': 'json'})
 
     if response.status_code != 200:
         raise Exception("Failed to fetch data: HTTP status code {}".format(response.status_code))
@@ -49,178 +187,369 @@ def fetch_species_from_qcode(qcode):
 
     return pd.DataFrame(species)
 
-def recover_LOTUS_data_sp(input_file, lotusdb_path, output_folder):
-    # Load the LOTUSDB CSV
-    lotusdb_df = pd.read_csv(lotusdb_path, low_memory=False)
+def _add_chemical_columns(grouped_df):
+    # Create 'chemical_superclass' and 'chemical_class' columns
+    grouped_df['chemical_superclass'] = grouped_df['structure_taxonomy_npclassifier_01pathway'] + '-' + grouped_df['structure_taxonomy_npclassifier_02superclass']
+    grouped_df['chemical_class'] = grouped_df['structure_taxonomy_npclassifier_01pathway'] + '-' + grouped_df['structure_taxonomy_npclassifier_03class']
+    return grouped_df
+
+
+def _split_per_taxon(grouped_all, taxon_column, taxa):
+    # Split the grouped result per taxon; taxa without LOTUS entries get an empty table
+    grouped_by_taxon = {taxon: group for taxon, group in grouped_all.groupby(level=taxon_column, sort=False)}
+    empty_df = grouped_all.iloc[0:0]
+    return {taxon: grouped_by_taxon.get(taxon, empty_df) for taxon in taxa}
+
+
+def _write_taxon_tsv(output_filename, grouped_df):
+    # Write to a temporary file first and rename it, so readers never see a half-written TSV
+    tmp_filename = output_filename + '.tmp'
+    grouped_df.to_csv(tmp_filename, index=False, sep='\t')
+    with open(tmp_filename, 'rb') as handle:
+        checksum = hashlib.sha256(handle.read()).hexdigest()
+    os.replace(tmp_filename, output_filename)
+    return {'file': os.path.basename(output_filename), 'rows': len(grouped_df), 'sha256': checksum}
+
+
+def _write_taxon_shard(subfolder, shard):
+    # Runs in a worker process: write every table of the shard
+    return {taxon: _write_taxon_tsv(os.path.join(subfolder, f"{taxon}.tsv"), grouped_df) for taxon, grouped_df in shard}
+
+
+def _canonical_rows(lotusdb_df):
+    # Form of the rows that does not depend on the column types a reader inferred: every value is split
+    # into its number (486746 and '486746' both give 486746.0) and its text when it is not a number
+    columns = {}
+    for column in lotusdb_df.columns:
+        values = lotusdb_df[column]
+        numbers = pd.to_numeric(values, errors='coerce').astype(float)
+        columns[column + '#number'] = numbers
+        columns[column + '#text'] = values.astype(object).where(values.notna() & numbers.isna(), '').astype(str)
+    return pd.DataFrame(columns)
+
+
+def hash_taxon_rows(lotusdb_df, taxon_column, taxa):
+    """
+    Hashes the LOTUS input rows of every taxon together with the aggregation spec version.
+
+    The values are hashed in a type-independent form, so a column read as text by one reader and as
+    numbers by another (e.g. the full and the chunked CSV readers) gives the same hashes.
+
+    Parameters:
+    - lotusdb_df: LOTUS rows holding LOTUS_COLUMNS.
+    - taxon_column: Column identifying the taxon ('wikidata_Qcode' or 'organism_taxonomy_08genus').
+    - taxa: Taxa to hash; taxa without rows get the hash of an empty input.
+
+    Returns:
+    dict: Hex digest of the input rows per taxon.
+    """
+    spec = f"{AGGREGATION_SPEC_VERSION}|{'|'.join(LOTUS_COLUMNS)}".encode()
+    row_hashes = pd.util.hash_pandas_object(_canonical_rows(lotusdb_df[LOTUS_COLUMNS]), index=False).to_numpy()
+
+    # Group the row hashes per taxon, keeping the row order inside each taxon
+    codes, uniques = pd.factorize(lotusdb_df[taxon_column].to_numpy(dtype=object))
+    order = np.argsort(codes, kind='mergesort')
+    bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+
+    hashes = {}
+    for code, taxon in enumerate(uniques):
+        rows = row_hashes[order[bounds[code]:bounds[code + 1]]]
+        hashes[taxon] = hashlib.sha256(spec + rows.tobytes()).hexdigest()
+    empty_hash = hashlib.sha256(spec).hexdigest()
+    return {taxon: hashes.get(taxon, empty_hash) for taxon in taxa}
+
+
+def unchanged_taxa(subfolder, input_hashes):
+    """
+    Finds the taxa whose TSV file was written from the same LOTUS rows and aggregation spec.
+
+    Parameters:
+    - subfolder: Folder holding the per-taxon TSV files and their manifest.
+    - input_hashes: Hash of the current input rows per taxon (see hash_taxon_rows).
+
+    Returns:
+    set: Taxa whose existing TSV file is up to date.
+    """
+    manifest = read_manifest(subfolder)
+    return {taxon for taxon, input_hash in input_hashes.items()
+            if manifest.get(taxon, {}).get('input_hash') == input_hash
+            and (manifest[taxon]['file'] is None or os.path.exists(os.path.join(subfolder, manifest[taxon]['file'])))}
+
+
+def read_manifest(subfolder):
+    """
+    Reads the manifest of a 'species_data' or 'genus_data' folder.
+
+    Parameters:
+    - subfolder: Path to the folder holding the per-taxon TSV files.
+
+    Returns:
+    dict: Manifest entries per taxon ({'file', 'rows', 'sha256'}), empty when there is no manifest.
+    """
+    manifest_path = os.path.join(subfolder, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as handle:
+        return json.load(handle)['taxa']
+
+
+def write_taxon_tables(tables, subfolder, label, workers=None, input_hashes=None):
+    """
+    Writes one TSV file per taxon and updates the manifest of the folder.
+
+    Every file is written to a temporary name and renamed once complete. With workers, the tables
+    are sharded over a process pool and written concurrently.
+
+    Parameters:
+    - tables: Dictionary mapping the taxon (Q code or genus) to its grouped DataFrame.
+    - subfolder: Folder receiving the '{taxon}.tsv' files.
+    - label: Name of the taxon level used in the messages (e.g. 'Q code', 'genus').
+    - workers: Number of worker processes. None or 1 writes the files one by one.
+    - input_hashes: Hash of the LOTUS input rows per taxon, recorded in the manifest for incremental reruns.
+
+    Returns:
+    dict: Manifest entries ({'file', 'rows', 'sha256'}) of the files written.
+    """
+    entries = {}
+    if workers is None or workers <= 1:
+        for taxon, grouped_df in tables.items():
+            output_filename = os.path.join(subfolder, f"{taxon}.tsv")
+            entries[taxon] = _write_taxon_tsv(output_filename, grouped_df)
+            print(f"Saved grouped data for {label} {taxon} to {output_filename}")
+    else:
+        # Balance the shards by number of rows, largest tables first
+        shards = [[] for _ in range(workers)]
+        shard_rows = [0] * workers
+        for taxon, grouped_df in sorted(tables.items(), key=lambda item: -len(item[1])):
+            smallest = shard_rows.index(min(shard_rows))
+            shards[smallest].append((taxon, grouped_df))
+            shard_rows[smallest] += len(grouped_df) + 1
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for shard_entries in executor.map(_write_taxon_shard, [subfolder] * workers, shards):
+                entries.update(shard_entries)
+        print(f"Saved grouped data for {len(entries)} {label} values to {subfolder} using {workers} workers")
+
+    if input_hashes is not None:
+        for taxon, entry in entries.items():
+            entry['input_hash'] = input_hashes[taxon]
+            entry['spec_version'] = AGGREGATION_SPEC_VERSION
+
+    # Record row counts and checksums next to the files
+    manifest = read_manifest(subfolder)
+    manifest.update(entries)
+    manifest_path = os.path.join(subfolder, MANIFEST_FILENAME)
+    with open(manifest_path + '.tmp', 'w') as handle:
+        json.dump({'taxa': manifest}, handle, indent=1)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    return entries
+
+
+def _recover_taxon_tables(lotusdb_df, taxa, output_folder, level, workers, incremental, layout):
+    # Aggregate the LOTUS rows of the taxa per InChIKey and write one TSV per taxon, or one dataset
+    taxon_column, label, plural = TAXON_LEVELS[level]
+    subfolder = os.path.join(output_folder, f'{level}_data') if layout == 'tsv' else taxon_dataset_path(output_folder, level)
+    os.makedirs(subfolder, exist_ok=True)
+
+    # Skip the taxa whose LOTUS rows did not change since their TSV was written
+    input_hashes = hash_taxon_rows(lotusdb_df, taxon_column, taxa)
+    if incremental:
+        skipped = unchanged_taxa(subfolder, input_hashes)
+        taxa = [taxon for taxon in input_hashes if taxon not in skipped]
+        lotusdb_df = lotusdb_df[lotusdb_df[taxon_column].isin(taxa)]
+        print(f"{len(skipped)} {plural} unchanged since the last run, {len(taxa)} to process")
+
+    # Group and aggregate the data for all taxa in a single pass
+    grouped_all = aggregate_lotus(lotusdb_df, [taxon_column, "structure_inchikey"]).reset_index(level="structure_inchikey")
+    grouped_all = _add_chemical_columns(grouped_all)
+
+    # Save the grouped data as TSV files with the taxon as the filename, or as one dataset keyed by taxon
+    tables = _split_per_taxon(grouped_all, taxon_column, taxa)
+    if layout == 'tsv':
+        write_taxon_tables(tables, subfolder, label, workers, input_hashes)
+    else:
+        write_taxon_dataset(tables, subfolder, input_hashes, AGGREGATION_SPEC_VERSION)
+        print(f"Saved grouped data for {len(tables)} {label} values to {subfolder}")
+
+
+def _input_taxa(df_species):
+    # Q codes in the order of the species CSV and unique genera, skipping the 'Not Found' placeholders
+    q_codes = [q_code for q_code in df_species['wikidata_Qcode'] if q_code != 'Not Found']  # Ensure this column name matches your species CSV
+    unique_genus = [genus for genus in df_species['Genus'].unique() if genus != 'Not Found']
+    return q_codes, unique_genus
+
+
+def recover_LOTUS_data_sp(input_file, lotusdb_path, output_folder, workers=None, incremental=True, chunksize=None, layout='tsv'):
     # Load the CSV file with Q codes
     df_species = pd.read_csv(input_file)
+    q_codes, _ = _input_taxa(df_species)
 
-    # Create a subfolder for species data
-    sp_subfolder = os.path.join(output_folder, 'species_data')
-    os.makedirs(sp_subfolder, exist_ok=True)
-
-    # Iterate through the Q codes in the species CSV
-    for q_code in df_species['wikidata_Qcode']:  # Ensure this column name matches your species CSV
-        # Skip processing if Q code is 'Not Found'
-        if q_code == 'Not Found':
-            continue
-
-        # Filter LOTUSDB data for the current Q code
-        filtered_lotusdb = lotusdb_df[lotusdb_df['wikidata_Qcode'] == q_code]  # Ensure this column name matches your LOTUSDB CSV
-
-        # Group and aggregate the data
-        grouped_df = filtered_lotusdb.groupby("structure_inchikey").agg({
-            # Add all the aggregation rules here
-            # Example:
-            "structure_wikidata": "first",
-            "structure_inchi": "first",
-            "structure_smiles": "first",
-            "structure_molecular_formula": "first",
-            "structure_exact_mass": "first",
-            "structure_xlogp": "first",
-            "structure_smiles_2D": "first",
-            "structure_cid": "first",
-            "structure_nameIupac": "first",
-            "structure_nameTraditional": "first",
-            "structure_taxonomy_npclassifier_01pathway": "first",
-            "structure_taxonomy_npclassifier_02superclass": "first",
-            "structure_taxonomy_npclassifier_03class": "first",
-            "organism_wikidata": "first",
-            "organism_taxonomy_gbifid": "first",
-            "organism_taxonomy_ncbiid": "first",
-            "organism_taxonomy_ottid": "first",
-            "organism_taxonomy_01domain": "first",
-            "organism_taxonomy_02kingdom": "first",
-            "organism_taxonomy_03phylum": "first",
-            "organism_taxonomy_04class": "first",
-            "organism_taxonomy_05order": "first",
-            "organism_taxonomy_06family": "first",
-            "organism_taxonomy_07tribe": "first",
-            "organism_taxonomy_08genus": "first",
-            "organism_taxonomy_09species": "first",
-            "organism_taxonomy_10varietas": "first",
-            "reference_wikidata": lambda x: "|".join(map(str, x)),
-            "reference_doi": lambda x: "|".join(map(str, x))
-        }).reset_index()
-        
-        # Create 'chemical_superclass' and 'chemical_class' columns
-        grouped_df['chemical_superclass'] = grouped_df['structure_taxonomy_npclassifier_01pathway'] + '-' + grouped_df['structure_taxonomy_npclassifier_02superclass']
-        grouped_df['chemical_class'] = grouped_df['structure_taxonomy_npclassifier_01pathway'] + '-' + grouped_df['structure_taxonomy_npclassifier_03class']
-        
-        # Save the grouped data as a TSV file with the Q code as the filename
-        #output_subfolder = os.path.join(output_folder, 'species_data')
-        #os.makedirs(output_subfolder, exist_ok=True)
-
-        output_filename = os.path.join(sp_subfolder, f"{q_code}.tsv")
-        grouped_df.to_csv(output_filename, index=False, sep='\t')
-
-        print(f"Saved grouped data for Q code {q_code} to {output_filename}")
-   
-def recover_LOTUS_data_g(input_file, lotusdb_path, output_folder):
-    # Load the LOTUSDB CSV
-    lotusdb_df = pd.read_csv(lotusdb_path, low_memory=False)
-    # Load the CSV file with Q codes
+    # Load the LOTUSDB rows of these Q codes only
+    filtered_lotusdb = load_lotus(lotusdb_path, columns=LOTUS_COLUMNS, qcodes=q_codes, chunksize=chunksize)
+
+    # Save the grouped data as TSV files in the species_data subfolder, with the Q code as the filename
+    # (or in the species_dataset folder with layout='dataset')
+    _recover_taxon_tables(filtered_lotusdb, q_codes, output_folder, 'species', workers, incremental, layout)
+
+
+def recover_LOTUS_data_g(input_file, lotusdb_path, output_folder, workers=None, incremental=True, chunksize=None, layout='tsv'):
+    # Load the CSV file with Q codes and extract the unique genus values from the 'Genus' column
     df_species = pd.read_csv(input_file)
+    _, unique_genus = _input_taxa(df_species)
+
+    # Load the LOTUSDB rows of these genera only
+    lotusdb_df = load_lotus(lotusdb_path, columns=LOTUS_COLUMNS, genera=unique_genus, chunksize=chunksize)
+
+    # Save the grouped data as TSV files in the genus_data subfolder (or in the genus_dataset folder with layout='dataset')
+    _recover_taxon_tables(lotusdb_df, unique_genus, output_folder, 'genus', workers, incremental, layout)
+
+
+def recover_LOTUS_data(input_file, lotusdb_path, output_folder, workers=None, incremental=True, chunksize=None, layout='tsv'):
+    """
+    Recovers the species_data and genus_data tables from one load of the LOTUS rows, and rolls the
+    compounds up the taxonomy.
+
+    Equivalent to recover_LOTUS_data_sp followed by recover_LOTUS_data_g, but the LOTUS rows of the
+    Q codes and of the genera are loaded and filtered once. The CompoundRollup of these rows (distinct
+    compounds per species, genus, tribe, family and order) is saved as taxonomy_rollup.tsv.
+
+    Parameters:
+    - input_file: CSV file with the 'wikidata_Qcode' and 'Genus' columns.
+    - lotusdb_path: Path to the LOTUSDB CSV file, or a shared LotusDB handle.
+    - output_folder: Folder receiving 'species_data', 'genus_data' and taxonomy_rollup.tsv.
+    - workers: Number of worker processes writing the TSV files.
+    - incremental: Skip the taxa whose LOTUS rows did not change since the last run.
+    - chunksize: Stream the LOTUSDB CSV by chunks of this many rows (see load_lotus).
+    - layout: 'tsv' writes one TSV per taxon in 'species_data' and 'genus_data'; 'dataset' writes one
+      Parquet dataset per level in 'species_dataset' and 'genus_dataset' (see taxon_dataset), from
+      which export_taxon_tsv writes the TSV files on demand.
 
-    # Create a subfolder for genus data
-    genus_subfolder = os.path.join(output_folder, 'genus_data')
-    os.makedirs(genus_subfolder, exist_ok=True)
-
-    # Extract unique genus values from the 'Genus' column
-    unique_genus = df_species['Genus'].unique()
-
-    # Iterate through unique genus values
-    for genus in unique_genus:
-        # Skip processing if Q code is 'Not Found'
-        if genus == 'Not Found':
-            continue
-
-        # Filter LOTUSDB data for the current Q code
-        filtered_lotusdb = lotusdb_df[lotusdb_df['organism_taxonomy_08genus'] == genus]  # Ensure this column name matches your LOTUSDB CSV
-
-        # Group and aggregate the data
-        grouped_df = filtered_lotusdb.groupby("structure_inchikey").agg({
-            # Add all the aggregation rules here
-            # Example:
-            "structure_wikidata": "first",
-            "structure_inchi": "first",
-            "structure_smiles": "first",
-            "structure_molecular_formula": "first",
-            "structure_exact_mass": "first",
-            "structure_xlogp": "first",
-            "structure_smiles_2D": "first",
-            "structure_cid": "first",
-            "structure_nameIupac": "first",
-            "structure_nameTraditional": "first",
-            "structure_taxonomy_npclassifier_01pathway": "first",
-            "structure_taxonomy_npclassifier_02superclass": "first",
-            "structure_taxonomy_npclassifier_03class": "first",
-            "organism_wikidata": "first",
-            "organism_taxonomy_gbifid": "first",
-            "organism_taxonomy_ncbiid": "first",
-            "organism_taxonomy_ottid": "first",
-            "organism_taxonomy_01domain": "first",
-            "organism_taxonomy_02kingdom": "first",
-            "organism_taxonomy_03phylum": "first",
-            "organism_taxonomy_04class": "first",
-            "organism_taxonomy_05order": "first",
-            "organism_taxonomy_06family": "first",
-            "organism_taxonomy_07tribe": "first",
-            "organism_taxonomy_08genus": "first",
-            "organism_taxonomy_09species": "first",
-            "organism_taxonomy_10varietas": "first",
-            "reference_wikidata": lambda x: "|".join(map(str, x)),
-            "reference_doi": lambda x: "|".join(map(str, x))
-        }).reset_index()
-        
-        # Create 'chemical_superclass' and 'chemical_class' columns
-        grouped_df['chemical_superclass'] = grouped_df['structure_taxonomy_npclassifier_01pathway'] + '-' + grouped_df['structure_taxonomy_npclassifier_02superclass']
-        grouped_df['chemical_class'] = grouped_df['structure_taxonomy_npclassifier_01pathway'] + '-' + grouped_df['structure_taxonomy_npclassifier_03class']
-        
-        # Save the grouped data as a TSV file in the genus_data subfolder
-        output_filename = os.path.join(genus_subfolder, f"{genus}.tsv")
-        grouped_df.to_csv(output_filename, index=False, sep='\t')
-
-        print(f"Saved grouped data for genus {genus} to {output_filename}")
-
-
-def process_species_data(input_folder, output_folder, lotusdb_path):
-    """
-    Processes species-level data from .tsv files, calculates frequency of chemical classes and superclasses,
+    Returns:
+    - CompoundRollup: The rollup of the loaded rows.
+    """
+    # Step 1: Load the LOTUSDB rows of the Q codes and of the genera at once
+    q_codes, unique_genus = _input_taxa(pd.read_csv(input_file))
+    lotusdb_df = load_lotus(lotusdb_path, columns=LOTUS_COLUMNS, qcodes=q_codes, genera=unique_genus, chunksize=chunksize)
+
+    # Step 2: Species and genus tables, each from its slice of the loaded rows
+    _recover_taxon_tables(lotusdb_df[lotusdb_df['wikidata_Qcode'].isin(q_codes)], q_codes, output_folder, 'species',
+                          workers, incremental, layout)
+    _recover_taxon_tables(lotusdb_df[lotusdb_df['organism_taxonomy_08genus'].isin(unique_genus)], unique_genus, output_folder,
+                          'genus', workers, incremental, layout)
+
+    # Step 3: Distinct compounds of every taxon, from the species compound sets
+    rollup = CompoundRollup(lotusdb_df)
+    rollup_path = os.path.join(output_folder, ROLLUP_FILENAME)
+    rollup.summary().to_csv(rollup_path, index=False, sep='\t')
+    print(f"✅ Taxonomy rollup saved to {rollup_path}")
+    return rollup
+
+
+def export_taxon_tsv(output_folder, level='species', taxa=None, workers=None):
+    """
+    Writes the legacy per-taxon TSV files ('species_data' or 'genus_data') from the dataset of a level.
+
+    The manifest of the TSV folder gets the input hashes of the dataset, so incremental TSV runs
+    recognize the exported files.
+
+    Parameters:
+    - output_folder: Folder holding the '{level}_dataset' folder; the TSV files go to '{level}_data'.
+    - level: 'species' or 'genus'.
+    - taxa: Taxa to export. Defaults to all taxa of the dataset.
+    - workers: Number of worker processes writing the TSV files.
+
+    Returns:
+    dict: Manifest entries ({'file', 'rows', 'sha256'}) of the files written.
+    """
+    dataset_folder = taxon_dataset_path(output_folder, level)
+    manifest = read_dataset_manifest(dataset_folder)
+    if manifest is None:
+        print(f"Error: {dataset_folder} is not a taxon dataset.")
+        return {}
+
+    subfolder = os.path.join(output_folder, f'{level}_data')
+    os.makedirs(subfolder, exist_ok=True)
+    tables = taxon_tables(dataset_folder, taxa)
+    input_hashes = {taxon: manifest['taxa'][taxon].get('input_hash') for taxon in tables}
+    return write_taxon_tables(tables, subfolder, TAXON_LEVELS[level][1], workers,
+                              input_hashes if None not in input_hashes.values() else None)
+
+
+def process_species_data(input_folder, output_folder, lotusdb_path, chunksize=None):
+    """
+    Processes species-level data from .tsv files (or the species dataset), calculates frequency of chemical classes and superclasses,
     merges with general species information, and adds reported compound counts.
 
     Parameters:
     - input_folder: Path to the folder containing species general info CSV file.
     - output_folder: Path where processed results will be saved.
-    - LOTUSDB_path: Path to the LOTUSDB CSV file.
+    - LOTUSDB_path: Path to the LOTUSDB CSV file, or a shared LotusDB handle.
+    - chunksize: Stream the LOTUSDB CSV by chunks of this many rows to bound memory (see load_lotus).
     """
 
     # Step 1: Initialize dictionaries to store data
     chemical_classes = {}
     chemical_superclasses = {}
 
-    # Step 2: Iterate through .tsv files in the folder
+    # Step 2: Iterate through the species tables: the .tsv files of the folder, or the species dataset
     species_data_folder = os.path.join(output_folder, 'species_data')
-    if not os.path.exists(species_data_folder):
+    species_dataset = taxon_dataset_path(output_folder, 'species')
+    use_dataset = read_dataset_manifest(species_dataset) is not None
+    if use_dataset:
+        species_data_folder = species_dataset
+    elif not os.path.exists(species_data_folder):
         print(f"Error: {species_data_folder} does not exist.")
         return
 
-    for filename in os.listdir(species_data_folder):
-        if filename.endswith(".tsv"):
-            qcode = filename.split(".")[0]  # Extract Qcode from the filename
-
-            # Load the .tsv file into a DataFrame
-            df_compounds = pd.read_csv(os.path.join(species_data_folder, filename), sep='\t')
+    # Class counts of the previous run, reused for the tables whose checksum did not change
+    manifest = read_manifest(species_data_folder)
+    summary_path = os.path.join(species_data_folder, CLASS_SUMMARY_FILENAME)
+    previous_summaries = {}
+    if os.path.exists(summary_path):
+        with open(summary_path) as handle:
+            previous_summaries = json.load(handle)
+    summaries = {}
+
+    if use_dataset:
+        # The rows of a dataset taxon are identified by the hash of their LOTUS input; only the taxa
+        # without a reusable summary are read, with the taxon filter pushed down to the dataset
+        checksums = {qcode: entry.get('input_hash') for qcode, entry in manifest.items()}
+        stale = [qcode for qcode, checksum in checksums.items()
+                 if checksum is None or previous_summaries.get(qcode, {}).get('sha256') != checksum]
+        tables = taxon_tables(species_dataset, stale) if stale else {}
+    else:
+        files = {filename.split(".")[0]: filename for filename in os.listdir(species_data_folder) if filename.endswith(".tsv")}  # Extract Qcode from the filename
+        checksums = {qcode: manifest.get(qcode, {}).get('sha256') for qcode in files}
+
+    for qcode, checksum in checksums.items():
+        summary = previous_summaries.get(qcode)
+        if checksum is None or summary is None or summary['sha256'] != checksum:
+            # Load the table of the species into a DataFrame
+            if use_dataset:
+                df_compounds = tables[qcode]
+            else:
+                df_compounds = pd.read_csv(os.path.join(species_data_folder, files[qcode]), sep='\t')
+            summary = {'sha256': checksum, 'chemical_class': None, 'chemical_superclass': None}
 
             # Step 3: Calculate frequencies of chemical classes
             if 'chemical_class' in df_compounds.columns:
                 class_counts = df_compounds['chemical_class'].value_counts()
-                chemical_classes[qcode] = "|".join([f"{count} {cls}" for cls, count in class_counts.items()])
+                summary['chemical_class'] = "|".join([f"{count} {cls}" for cls, count in class_counts.items()])
 
             # Step 4: Calculate frequencies of chemical superclasses
             if 'chemical_superclass' in df_compounds.columns:
                 superclass_counts = df_compounds['chemical_superclass'].value_counts()
-                chemical_superclasses[qcode] = "|".join([f"{count} {scls}" for scls, count in superclass_counts.items()])
+                summary['chemical_superclass'] = "|".join([f"{count} {scls}" for scls, count in superclass_counts.items()])
+
+        summaries[qcode] = summary
+        if summary['chemical_class'] is not None:
+            chemical_classes[qcode] = summary['chemical_class']
+        if summary['chemical_superclass'] is not None:
+            chemical_superclasses[qcode] = summary['chemical_superclass']
+
+    with open(summary_path, 'w') as handle:
+        json.dump(summaries, handle)
 
     # Step 5: Load the general info CSV file
     csv_file = None
@@ -239,12 +568,12 @@ def process_species_data(input_folder, output_folder, lotusdb_path):
     df_general_info['predicted_class'] = df_general_info['wikidata_Qcode'].map(chemical_classes)
     df_general_info['predicted_superclass'] = df_general_info['wikidata_Qcode'].map(chemical_superclasses)
 
-    # Step 7: Load the LOTUSDB CSV
-    LOTUSDB = pd.read_csv(lotusdb_path, low_memory=False)
+    # Step 7: Load the LOTUSDB columns needed for the reported compounds of these Q codes
+    LOTUSDB = load_lotus(lotusdb_path, columns=['wikidata_Qcode', 'Reported_comp_Species', 'Reported_comp_Genus'],
+                         qcodes=df_general_info['wikidata_Qcode'].dropna().unique(), chunksize=chunksize)
 
     # Step 8: Merge LOTUSDB data to add reported compounds for each Q code
-    df = pd.merge(df_general_info, LOTUSDB[['wikidata_Qcode', 'Reported_comp_Species', 'Reported_comp_Genus' ]],
-                  how='left', left_on='wikidata_Qcode', right_on='wikidata_Qcode')
+    df = pd.merge(df_general_info, LOTUSDB[['wikidata_Qcode', 'Reported_comp_Species', 'Reported_comp_Genus' ]], how='left', left_on='wikidata_Qcode', right_on='wikidata_Qcode')
 
     # Step 9: Save the updated DataFrame to a CSV file
     output_csv_file = os.path.join(output_folder, 'Full_results.csv')
@@ -0,0 +1,203 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+from urllib.parse import urlsplit
+import requests
+
+# Default location of the cache database (override with the YGGDRASIL_HTTP_CACHE environment variable)
+DEFAULT_CACHE_PATH = os.environ.get(
+    'YGGDRASIL_HTTP_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'yggdrasil', 'http_cache.sqlite'))
+
+# Time to live of cached responses per endpoint host, in seconds
+DEFAULT_TTLS = {
+    'query.wikidata.org': 7 * 24 * 3600,      # Wikidata SPARQL answers change slowly
+    'api.opentreeoflife.org': 30 * 24 * 3600  # OpenTree TNRS and synthetic tree releases are rare
+}
+
+# Time to live of endpoints missing from the TTL table
+DEFAULT_TTL = 24 * 3600
+
+# Maximum size of the cached bodies before the least recently used responses are evicted
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+
+
+class CachedResponse:
+    """Minimal stand-in for requests.Response, returned for responses served by the cache."""
+
+    def __init__(self, status_code, text, from_cache=True):
+        self.status_code = status_code
+        self.text = text
+        self.from_cache = from_cache
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(f"HTTP status code {self.status_code}", response=self)
+
+
+def _normalize(value):
+    # Collapse whitespace so reformatted SPARQL queries share their cache entry
+    if isinstance(value, str):
+        return re.sub(r'\s+', ' ', value).strip()
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+class HTTPCache:
+    """
+    SQLite-backed cache of HTTP responses from the SPARQL and REST services used by Yggdrasil.
+
+    Entries are keyed on the method, the endpoint URL and the normalized query (parameters, form data
+    or JSON body). They expire after the TTL of their endpoint, and the least recently used entries
+    are evicted once the cached bodies exceed max_bytes. In offline mode only the cache is consulted.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttls=None, default_ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES, offline=False):
+        """
+        Parameters:
+        - path: Path of the SQLite database.
+        - ttls: Time to live in seconds per endpoint host (defaults to DEFAULT_TTLS).
+        - default_ttl: Time to live of the hosts missing from ttls.
+        - max_bytes: Maximum total size of the cached bodies.
+        - offline: Serve only from the cache and never touch the network.
+        """
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.stats = {'hits': 0, 'misses': 0, 'network': 0, 'evictions': 0}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Not bound to the creating thread: the TNRS resolver may run its event loop in a worker thread
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, endpoint TEXT, status INTEGER, body TEXT,"
+            " size INTEGER, created REAL, accessed REAL)")
+        self._connection.commit()
+
+    @staticmethod
+    def make_key(method, url, params=None, data=None, json_body=None):
+        """Returns the cache key of a request."""
+        payload = json.dumps([method.upper(), url, _normalize(params), _normalize(data), _normalize(json_body)], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def ttl_for(self, url):
+        """Returns the time to live of the responses of an endpoint."""
+        return self.ttls.get(urlsplit(url).hostname, self.default_ttl)
+
+    def get(self, key, url):
+        """Returns the cached response of a key, or None when missing or expired."""
+        row = self._connection.execute("SELECT status, body, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() - row[2] > self.ttl_for(url):
+            return None
+        self._connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+        self._connection.commit()
+        return CachedResponse(row[0], row[1])
+
+    def put(self, key, url, status_code, text):
+        """Stores a response and evicts the least recently used ones beyond max_bytes."""
+        now = time.time()
+        self._connection.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, urlsplit(url).hostname, status_code, text, len(text.encode('utf-8')), now, now))
+        self._evict(keep=key)
+        self._connection.commit()
+
+    def _evict(self, keep=None):
+        total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._connection.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.stats['evictions'] += 1
+
+    def request(self, method, url, params=None, data=None, json=None, headers=None, **kwargs):
+        """
+        Performs an HTTP request through the cache.
+
+        Takes the same arguments as requests.request. Only successful (HTTP 200) responses are cached.
+        In offline mode a cache miss returns a response with status code 504 instead of calling the network.
+
+        Returns:
+        requests.Response or CachedResponse: The response, with a from_cache attribute.
+        """
+        key = self.make_key(method, url, params, data, json)
+        cached = self.get(key, url)
+        if cached is not None:
+            self.stats['hits'] += 1
+            return cached
+
+        self.stats['misses'] += 1
+        if self.offline:
+            return CachedResponse(504, f"Offline mode: no cached response for {url}", from_cache=False)
+
+        self.stats['network'] += 1
+        response = requests.request(method, url, params=params, data=data, json=json, headers=headers, **kwargs)
+        response.from_cache = False
+        if response.status_code == 200:
+            self.put(key, url, response.status_code, response.text)
+        return response
+
+    def get_url(self, url, **kwargs):
+        """Cached equivalent of requests.get."""
+        return self.request('GET', url, **kwargs)
+
+    def post_url(self, url, **kwargs):
+        """Cached equivalent of requests.post."""
+        return self.request('POST', url, **kwargs)
+
+    def clear(self):
+        """Removes every cached response."""
+        self._connection.execute("DELETE FROM responses")
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+
+# Cache shared by the functions of the session, created on first use
+_DEFAULT_CACHE = None
+
+
+def get_http_cache():
+    """Returns the shared HTTPCache, creating it at DEFAULT_CACHE_PATH on first use."""
+    global _DEFAULT_CACHE
+    if _DEFAULT_CACHE is None:
+        _DEFAULT_CACHE = HTTPCache()
+    return _DEFAULT_CACHE
+
+
+def set_http_cache(cache):
+    """Replaces the shared HTTPCache (e.g. to change its path, TTLs or switch to offline mode)."""
+    global _DEFAULT_CACHE
+    _DEFAULT_CACHE = cache
+
+
+def cached_get(url, **kwargs):
+    """requests.get through the shared HTTP cache."""
+    return get_http_cache().get_url(url, **kwargs)
+
+
+def cached_post(url, **kwargs):
+    """requests.post through the shared HTTP cache."""
+    return get_http_cache().post_url(url, **kwargs)
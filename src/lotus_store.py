@@ -0,0 +1,412 @@
+import os
+import sys
+import io
+import json
+from collections import OrderedDict
+from urllib.parse import quote
+import numpy as np
+import pandas as pd
+
+# Name of the sidecar index written next to the partition files
+STORE_INDEX_FILENAME = 'index.json'
+
+# Column used to split the store into one Parquet file per family
+PARTITION_COLUMN = 'organism_taxonomy_06family'
+
+# Column keeping the position of each row in the original CSV, so loaders return rows in CSV order
+ROW_ID_COLUMN = '_lotus_row'
+
+# Number of rows per Parquet row group (the unit of row pruning)
+ROW_GROUP_SIZE = 20000
+
+
+def lotus_store_path(lotusdb_path):
+    """
+    Returns the folder of the columnar store belonging to a LOTUS metadata CSV.
+
+    Parameters:
+    - lotusdb_path: Path to the LOTUSDB CSV file.
+
+    Returns:
+    str: Path of the store folder (e.g. 'LotusDB_inhouse_metadata_store').
+    """
+    return os.path.splitext(lotusdb_path)[0] + '_store'
+
+
+def convert_lotus_to_store(lotusdb_path, store_path=None, row_group_size=ROW_GROUP_SIZE):
+    """
+    Converts the LOTUS metadata CSV into a columnar store, once.
+
+    The rows are written as one Parquet file per family, sorted by genus and Q code and with
+    dictionary-encoded string columns. A sidecar index maps every 'wikidata_Qcode' and
+    'organism_taxonomy_08genus' value to its row ranges, so loaders only read the row groups they need.
+
+    Parameters:
+    - lotusdb_path: Path to the LOTUSDB CSV file.
+    - store_path: Folder for the store. Defaults to lotus_store_path(lotusdb_path).
+    - row_group_size: Number of rows per Parquet row group.
+
+    Returns:
+    str: Path of the store folder.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if store_path is None:
+        store_path = lotus_store_path(lotusdb_path)
+    os.makedirs(store_path, exist_ok=True)
+
+    # Step 1: Load the LOTUSDB CSV and remember the original row order
+    lotusdb_df = pd.read_csv(lotusdb_path, low_memory=False)
+    lotusdb_df[ROW_ID_COLUMN] = np.arange(len(lotusdb_df), dtype=np.int64)
+
+    # Mixed-type text columns cannot be written to Parquet, store their values as strings
+    for column in lotusdb_df.columns[lotusdb_df.dtypes == object]:
+        values = lotusdb_df[column]
+        lotusdb_df[column] = values.where(values.isna(), values.astype(str))
+
+    # Step 2: Sort by family, genus and Q code so each taxon is a contiguous row range
+    family_keys = lotusdb_df[PARTITION_COLUMN].fillna('__null__').astype(str)
+    lotusdb_df = lotusdb_df.assign(_family=family_keys).sort_values(
+        ['_family', 'organism_taxonomy_08genus', 'wikidata_Qcode'], kind='mergesort', na_position='last')
+
+    # Step 3: Write one Parquet file per family and record the row ranges of every taxon
+    schema = pa.Schema.from_pandas(lotusdb_df.drop(columns='_family'), preserve_index=False)
+    files = []
+    index = {'wikidata_Qcode': {}, 'organism_taxonomy_08genus': {}}
+    for family, part in lotusdb_df.groupby('_family', sort=True):
+        part = part.drop(columns='_family').reset_index(drop=True)
+        filename = f"{PARTITION_COLUMN}={quote(family, safe='')}.parquet"
+        table = pa.Table.from_pandas(part, schema=schema, preserve_index=False)
+        pq.write_table(table, os.path.join(store_path, filename), row_group_size=row_group_size, use_dictionary=True)
+
+        file_id = len(files)
+        files.append(filename)
+        for key_column, key_index in index.items():
+            keys = part[key_column].to_numpy(dtype=object)
+            starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            stops = np.r_[starts[1:], len(part)]
+            for key, start, stop in zip(keys[starts], starts, stops):
+                if isinstance(key, str):
+                    key_index.setdefault(key, []).append([file_id, int(start), int(stop)])
+
+    # Step 4: Save the sidecar index with the state of the source CSV
+    source = os.stat(lotusdb_path)
+    with open(os.path.join(store_path, STORE_INDEX_FILENAME), 'w') as handle:
+        json.dump({
+            'source': {'path': os.path.abspath(lotusdb_path), 'mtime': source.st_mtime, 'size': source.st_size},
+            'columns': [column for column in lotusdb_df.columns if column not in (ROW_ID_COLUMN, '_family')],
+            'files': files,
+            'index': index
+        }, handle)
+
+    print(f"✅ LOTUS store written to {store_path} ({len(files)} partitions)")
+    return store_path
+
+
+def read_store_index(store_path):
+    """Reads the sidecar index of a LOTUS store."""
+    with open(os.path.join(store_path, STORE_INDEX_FILENAME)) as handle:
+        return json.load(handle)
+
+
+def _store_is_current(store_index, lotusdb_path):
+    # A store is used as long as the CSV it was built from has not changed (or is not around anymore)
+    if not os.path.exists(lotusdb_path):
+        return True
+    source = os.stat(lotusdb_path)
+    return store_index['source']['size'] == source.st_size and store_index['source']['mtime'] == source.st_mtime
+
+
+def _read_row_ranges(path, ranges, columns):
+    # Read only the row groups overlapping the requested ranges, then keep the requested rows
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(path)
+    metadata = parquet_file.metadata
+    bounds = np.cumsum([0] + [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)])
+
+    rows = np.concatenate([np.arange(start, stop) for start, stop in ranges])
+    row_groups = np.searchsorted(bounds, rows, side='right') - 1
+    selected = np.unique(row_groups)
+
+    # Position of each requested row inside the concatenation of the selected row groups
+    offsets = np.zeros(len(bounds), dtype=np.int64)
+    offsets[selected] = np.cumsum(np.r_[0, np.diff(bounds)[selected][:-1]])
+    local_rows = rows - bounds[row_groups] + offsets[row_groups]
+
+    table = parquet_file.read_row_groups(selected.tolist(), columns=columns)
+    return table.take(local_rows)
+
+
+def _load_from_store(store_path, store_index, columns, qcodes, genera):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    read_columns = None if columns is None else list(columns) + [ROW_ID_COLUMN]
+
+    if qcodes is None and genera is None:
+        # No row selection: read every partition with column pruning only
+        tables = [pq.read_table(os.path.join(store_path, filename), columns=read_columns)
+                  for filename in store_index['files']]
+    else:
+        # Collect the row ranges of the requested taxa per partition file
+        ranges_per_file = {}
+        for key_column, keys in (('wikidata_Qcode', qcodes), ('organism_taxonomy_08genus', genera)):
+            if keys is None:
+                continue
+            key_index = store_index['index'][key_column]
+            for key in set(keys):
+                for file_id, start, stop in key_index.get(key, []) if isinstance(key, str) else []:
+                    ranges_per_file.setdefault(file_id, set()).add((start, stop))
+
+        tables = [_read_row_ranges(os.path.join(store_path, store_index['files'][file_id]), sorted(ranges), read_columns)
+                  for file_id, ranges in sorted(ranges_per_file.items())]
+
+    if not tables:
+        schema_columns = store_index['columns'] if columns is None else list(columns)
+        return pd.DataFrame(columns=schema_columns)
+
+    lotusdb_df = pa.concat_tables(tables).to_pandas()
+
+    # Restore the row order of the original CSV (rows of a genus requested both ways are read twice)
+    lotusdb_df = lotusdb_df.drop_duplicates(ROW_ID_COLUMN).sort_values(ROW_ID_COLUMN, kind='mergesort')
+    return lotusdb_df.drop(columns=ROW_ID_COLUMN).reset_index(drop=True)
+
+
+def _row_mask(lotusdb_df, qcodes, genera):
+    # Mask of the rows of the requested Q codes or genera (None when neither is given)
+    if qcodes is None and genera is None:
+        return None
+    mask = np.zeros(len(lotusdb_df), dtype=bool)
+    if qcodes is not None:
+        mask |= lotusdb_df['wikidata_Qcode'].isin(list(qcodes)).values
+    if genera is not None:
+        mask |= lotusdb_df['organism_taxonomy_08genus'].isin(list(genera)).values
+    return mask
+
+
+class LotusDB:
+    """
+    Handle on a LOTUS metadata file, shared by all the functions of a session.
+
+    Columns are loaded lazily the first time a caller asks for them and kept in memory for the next
+    callers. When a memory budget is set, the columns used least recently are evicted to stay under it.
+    The cache is dropped when the file changes on disk.
+
+    Use get_lotus_db() to obtain the shared handle of a path.
+    """
+
+    def __init__(self, lotusdb_path, memory_budget=None):
+        """
+        Parameters:
+        - lotusdb_path: Path to the LOTUSDB CSV file (its columnar store is used when present).
+        - memory_budget: Maximum number of bytes of cached columns. None keeps every loaded column.
+        """
+        self.path = lotusdb_path
+        self.memory_budget = memory_budget
+        self.signature = self.file_signature(lotusdb_path)
+        self._columns = OrderedDict()
+        self._column_bytes = {}
+
+    @staticmethod
+    def file_signature(lotusdb_path):
+        """Returns the (mtime, size) of the CSV, or of the store index when the CSV is not around."""
+        path = lotusdb_path
+        if not os.path.exists(path):
+            path = os.path.join(lotus_store_path(lotusdb_path), STORE_INDEX_FILENAME)
+        stat = os.stat(path)
+        return stat.st_mtime, stat.st_size
+
+    @property
+    def cached_columns(self):
+        """Names of the columns currently held in memory, least recently used first."""
+        return list(self._columns)
+
+    @property
+    def memory_usage(self):
+        """Number of bytes held by the cached columns."""
+        return sum(self._column_bytes.values())
+
+    def clear(self):
+        """Drops every cached column."""
+        self._columns.clear()
+        self._column_bytes.clear()
+
+    def _evict(self, keep):
+        # Drop the least recently used columns until the cache fits in the budget
+        if self.memory_budget is None:
+            return
+        for column in list(self._columns):
+            if self.memory_usage <= self.memory_budget:
+                break
+            if column not in keep:
+                del self._columns[column]
+                del self._column_bytes[column]
+
+    def select(self, columns=None, qcodes=None, genera=None):
+        """
+        Returns LOTUS rows, loading the missing columns from disk.
+
+        Parameters:
+        - columns: Columns to return. Defaults to all columns.
+        - qcodes: Only return rows whose 'wikidata_Qcode' is in this list.
+        - genera: Only return rows whose 'organism_taxonomy_08genus' is in this list.
+
+        Returns:
+        pd.DataFrame: The selected LOTUS rows, in the order of the CSV.
+        """
+        # Reload from scratch when the file changed since it was cached
+        signature = self.file_signature(self.path)
+        if signature != self.signature:
+            self.clear()
+            self.signature = signature
+
+        if columns is None:
+            columns = self._all_columns()
+        filter_columns = [column for column, keys in (('wikidata_Qcode', qcodes), ('organism_taxonomy_08genus', genera))
+                          if keys is not None]
+        needed = list(dict.fromkeys(list(columns) + filter_columns))
+
+        # Step 1: Load the columns that are not cached yet, all rows at once
+        missing = [column for column in needed if column not in self._columns]
+        if missing:
+            loaded = load_lotus(self.path, columns=missing).reset_index(drop=True)
+            for column in missing:
+                self._columns[column] = loaded[column]
+                self._column_bytes[column] = int(loaded[column].memory_usage(index=False, deep=True))
+
+        # Step 2: Mark the columns as recently used and make room for them
+        for column in needed:
+            self._columns.move_to_end(column)
+        self._evict(keep=set(needed))
+
+        # Step 3: Assemble the requested rows and columns
+        mask = _row_mask(pd.DataFrame({column: self._columns[column] for column in filter_columns}), qcodes, genera)
+        if mask is None:
+            return pd.DataFrame({column: self._columns[column] for column in columns})
+        return pd.DataFrame({column: self._columns[column][mask] for column in columns})
+
+    def _all_columns(self):
+        store_path = lotus_store_path(self.path)
+        if os.path.exists(os.path.join(store_path, STORE_INDEX_FILENAME)):
+            return read_store_index(store_path)['columns']
+        return list(pd.read_csv(self.path, nrows=0).columns)
+
+
+# Shared handles, keyed by path, modification time and size of the LOTUS file
+_LOTUS_HANDLES = {}
+
+
+def get_lotus_db(lotusdb_path, memory_budget=None):
+    """
+    Returns the shared LotusDB handle of a LOTUS file, creating it on first use.
+
+    Parameters:
+    - lotusdb_path: Path to the LOTUSDB CSV file.
+    - memory_budget: Maximum number of bytes of cached columns (applied to the shared handle).
+
+    Returns:
+    LotusDB: The handle, reused as long as the file is unchanged.
+    """
+    path = os.path.abspath(lotusdb_path)
+    key = (path,) + LotusDB.file_signature(path)
+    handle = _LOTUS_HANDLES.get(key)
+    if handle is None:
+        # Forget the handles of older versions of this file
+        for old_key in [old_key for old_key in _LOTUS_HANDLES if old_key[0] == path]:
+            del _LOTUS_HANDLES[old_key]
+        handle = _LOTUS_HANDLES[key] = LotusDB(path, memory_budget)
+    elif memory_budget is not None:
+        handle.memory_budget = memory_budget
+    return handle
+
+
+def _column_kinds(chunk, text_columns, float_columns):
+    # Record how a full-file read_csv would type each column: text as soon as one value is not a
+    # number, float as soon as one value is missing or not an integer, int otherwise
+    for column in chunk.columns:
+        values = chunk[column].dropna()
+        if chunk[column].isna().any():
+            float_columns.add(column)
+        if column in text_columns or not len(values):
+            continue
+        if pd.to_numeric(values, errors='coerce').isna().any():
+            text_columns.add(column)
+        elif not values.str.fullmatch(r'\s*[+-]?\d+\s*').all():
+            float_columns.add(column)
+
+
+def _read_csv_chunked(lotusdb_path, usecols, qcodes, genera, chunksize):
+    # Stream the CSV and keep only the selected rows of each chunk as text, so memory follows the selection
+    buffer = io.BytesIO()
+    index = []
+    text_columns, float_columns = set(), set()
+    for chunk_number, chunk in enumerate(pd.read_csv(lotusdb_path, usecols=usecols, dtype=str, chunksize=chunksize)):
+        _column_kinds(chunk, text_columns, float_columns)
+        mask = _row_mask(chunk, qcodes, genera)
+        selected = chunk if mask is None else chunk[mask]
+        buffer.write(selected.to_csv(index=False, header=chunk_number == 0).encode('utf-8'))
+        index.append(selected.index.values)
+
+    # Parse the kept rows once with the column types of the whole file, so the rows come back exactly
+    # as a plain read_csv of the file would return them (a column mixing numbers and text stays text)
+    buffer.seek(0)
+    columns = pd.read_csv(buffer, nrows=0).columns
+    buffer.seek(0)
+    dtypes = {column: str if column in text_columns else float if column in float_columns else np.int64
+              for column in columns}
+    lotusdb_df = pd.read_csv(buffer, dtype=dtypes, low_memory=False)
+    lotusdb_df.index = np.concatenate(index)
+    return lotusdb_df
+
+
+def load_lotus(lotusdb_path, columns=None, qcodes=None, genera=None, chunksize=None):
+    """
+    Loads LOTUS metadata rows with column and row pruning.
+
+    Reads from the columnar store written by convert_lotus_to_store when one exists for this CSV,
+    and falls back to reading the CSV itself otherwise. A LotusDB handle can be given instead of
+    a path to reuse the columns it already holds.
+
+    Parameters:
+    - lotusdb_path: Path to the LOTUSDB CSV file, or a LotusDB handle.
+    - columns: Columns to load. Defaults to all columns.
+    - qcodes: Only load rows whose 'wikidata_Qcode' is in this list.
+    - genera: Only load rows whose 'organism_taxonomy_08genus' is in this list.
+    - chunksize: When reading the CSV, stream it by chunks of this many rows and keep only the
+      selected rows, so memory is bounded by the selection rather than by the file size.
+
+    Returns:
+    pd.DataFrame: The selected LOTUS rows, in the order of the CSV.
+    """
+    if isinstance(lotusdb_path, LotusDB):
+        return lotusdb_path.select(columns, qcodes, genera)
+
+    store_path = lotus_store_path(lotusdb_path)
+    if os.path.exists(os.path.join(store_path, STORE_INDEX_FILENAME)):
+        store_index = read_store_index(store_path)
+        if _store_is_current(store_index, lotusdb_path):
+            return _load_from_store(store_path, store_index, columns, qcodes, genera)
+        print(f"⚠️ {lotusdb_path} changed since {store_path} was built, reading the CSV instead.")
+
+    # Fall back to the CSV, loading the filter columns along with the requested ones
+    filter_columns = [column for column, keys in (('wikidata_Qcode', qcodes), ('organism_taxonomy_08genus', genera))
+                      if keys is not None]
+    usecols = None if columns is None else list(dict.fromkeys(list(columns) + filter_columns))
+    if chunksize is not None:
+        lotusdb_df = _read_csv_chunked(lotusdb_path, usecols, qcodes, genera, chunksize)
+    else:
+        lotusdb_df = pd.read_csv(lotusdb_path, usecols=usecols, low_memory=False)
+        mask = _row_mask(lotusdb_df, qcodes, genera)
+        if mask is not None:
+            lotusdb_df = lotusdb_df[mask]
+
+    if columns is not None:
+        lotusdb_df = lotusdb_df[list(columns)]
+    return lotusdb_df
+
+
+if __name__ == "__main__":
+    # One-time conversion: python lotus_store.py LotusDB_inhouse_metadata.csv
+    convert_lotus_to_store(sys.argv[1])
@@ -0,0 +1,135 @@
+import re
+import numpy as np
+import pandas as pd
+from taxonomy_index import get_taxonomy_index
+
+# Prefix of the Q code hyperlinks written by process_csv_file
+WIKIDATA_ENTITY_URL = 'http://www.wikidata.org/entity/'
+
+
+def normalize_name(name):
+    """Normalizes a taxon name for matching: case folded, underscores read as spaces, single spaces."""
+    return re.sub(r'\s+', ' ', name.replace('_', ' ')).strip().casefold()
+
+
+def trigrams(name):
+    """Returns the distinct character trigrams of a normalized name, padded so word starts and ends count."""
+    padded = f'  {name} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameResolver:
+    """
+    Local species name → Wikidata Q code resolver.
+
+    Exact matches come from a hash index on the normalized names. Misspelled names get fuzzy candidates
+    from a trigram inverted index, scored with the Dice coefficient of their trigram sets (1.0 for
+    identical sets); a candidate is only accepted as a match above an explicit threshold.
+    """
+
+    def __init__(self, names, qcodes):
+        """
+        Parameters:
+        - names: Taxon names.
+        - qcodes: Q code (e.g. 'Q42') or Q code hyperlink of each name.
+        """
+        table = pd.DataFrame({'name': list(names), 'qcode': list(qcodes)}).dropna()
+        table['qcode'] = table['qcode'].astype(str).str.rsplit('/', n=1).str[-1]
+        table['key'] = table['name'].astype(str).map(normalize_name)
+        table = table.drop_duplicates('key').reset_index(drop=True)
+        self.names = table['name'].to_numpy(dtype=object)
+        self.qcodes = table['qcode'].to_numpy(dtype=object)
+
+        # Exact index
+        self._exact = dict(zip(table['key'], range(len(table))))
+
+        # Trigram inverted index: trigram id → names containing it (CSR layout)
+        trigram_ids = {}
+        name_ids, gram_ids = [], []
+        self._sizes = np.zeros(len(table), dtype=np.int32)
+        for name_id, key in enumerate(table['key']):
+            grams = trigrams(key)
+            self._sizes[name_id] = len(grams)
+            for gram in grams:
+                name_ids.append(name_id)
+                gram_ids.append(trigram_ids.setdefault(gram, len(trigram_ids)))
+        name_ids = np.asarray(name_ids, dtype=np.int32)
+        gram_ids = np.asarray(gram_ids, dtype=np.int32)
+        order = np.argsort(gram_ids, kind='stable')
+        self._postings = name_ids[order]
+        self._offsets = np.zeros(len(trigram_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(gram_ids, minlength=len(trigram_ids)), out=self._offsets[1:])
+        self._trigram_ids = trigram_ids
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_lotus(cls, lotusdb_path, labels_path=None):
+        """
+        Builds the resolver from the LOTUS organisms (the names and Q codes of the taxonomy index) and,
+        optionally, a CSV of Wikidata labels with 'name' and 'qcode' columns.
+        """
+        nodes = get_taxonomy_index(lotusdb_path).nodes
+        nodes = nodes[nodes['qcode'].notna()]
+        names, qcodes = list(nodes['name']), list(nodes['qcode'])
+        if labels_path is not None:
+            labels = pd.read_csv(labels_path, usecols=['name', 'qcode'], dtype=str)
+            names += list(labels['name'])
+            qcodes += list(labels['qcode'])
+        return cls(names, qcodes)
+
+    def lookup(self, name):
+        """Returns the Q code of an exact (normalized) match, or None."""
+        name_id = self._exact.get(normalize_name(name))
+        return None if name_id is None else self.qcodes[name_id]
+
+    def candidates(self, name, limit=5, min_score=0.0):
+        """
+        Returns the fuzzy candidates of a name.
+
+        Returns:
+        - pd.DataFrame: 'name', 'qcode' and 'score' (Dice coefficient of the trigram sets) of the best
+          candidates, best first.
+        """
+        query = trigrams(normalize_name(name))
+        grams = [self._trigram_ids[gram] for gram in query if gram in self._trigram_ids]
+        if not grams:
+            return pd.DataFrame({'name': [], 'qcode': [], 'score': []})
+
+        # Count the shared trigrams of every name sharing at least one
+        postings = np.concatenate([self._postings[self._offsets[gram]:self._offsets[gram + 1]] for gram in grams])
+        matched, shared = np.unique(postings, return_counts=True)
+        scores = 2 * shared / (self._sizes[matched] + len(query))
+        keep = scores >= min_score
+        matched, scores = matched[keep], scores[keep]
+        best = np.argsort(-scores, kind='stable')[:limit]
+        return pd.DataFrame({'name': self.names[matched[best]], 'qcode': self.qcodes[matched[best]], 'score': scores[best]})
+
+    def resolve(self, species_names, fuzzy_threshold=None):
+        """
+        Resolves names locally.
+
+        Parameters:
+        - species_names: Names to resolve.
+        - fuzzy_threshold: Minimum score of a fuzzy candidate to accept it when there is no exact match.
+          None (the default) only accepts exact matches.
+
+        Returns:
+        - tuple: The Q code hyperlink of each resolved name (like resolve_species_qcodes), the fuzzy
+          matches used ({name: (matched name, score)}) and the list of unresolved names.
+        """
+        names = list(dict.fromkeys(name for name in species_names if isinstance(name, str)))
+        q_codes, fuzzy, missing = {}, {}, []
+        for name in names:
+            q_code = self.lookup(name)
+            if q_code is None and fuzzy_threshold is not None:
+                best = self.candidates(name, limit=1, min_score=fuzzy_threshold)
+                if len(best):
+                    q_code = best['qcode'].iat[0]
+                    fuzzy[name] = (best['name'].iat[0], float(best['score'].iat[0]))
+            if q_code is None:
+                missing.append(name)
+            else:
+                q_codes[name] = WIKIDATA_ENTITY_URL + q_code
+        return q_codes, fuzzy, missing
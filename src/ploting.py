@@ -1,8 +1,14 @@
 import os
+import json
+import gzip
+import time
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 import plotly.express as px
 import matplotlib.colors as mcolors
+from taxon_dataset import DATASET_MANIFEST_FILENAME, TAXON_COLUMN, is_taxon_dataset, read_taxon_dataset, taxon_dataset_path
 
 # Define base colors for each Pathway
 pathway_shades= {
@@ -26,21 +32,386 @@ pathway_colors = {
     'Carbohydrates': '#65451F' # Brown start and lighter purple end
 }
 
+# Figure export settings used by write_figure (see configure_figure_export)
+FIGURE_EXPORT = {'shared_plotlyjs': False, 'compress': False, 'image_formats': ()}
+
+# (path, seconds) of every file written by write_figure, read by render_all_figures
+_WRITE_TIMINGS = []
+
+
+def configure_figure_export(shared_plotlyjs=True, compress=False, image_formats=()):
+    """
+    Configures how write_figure saves the figures (batch export mode).
+
+    Parameters:
+    - shared_plotlyjs: Write plotly.min.js once next to the figures and reference it, instead of
+      embedding the ~4.5 MB bundle in every HTML file.
+    - compress: Write gzip-compressed '<name>.html.gz' files (for serving with Content-Encoding: gzip).
+    - image_formats: Static formats also exported next to each HTML file, e.g. ('png', 'svg').
+      Requires the kaleido package, which renders the images in a local browser process.
+    """
+    FIGURE_EXPORT['shared_plotlyjs'] = shared_plotlyjs
+    FIGURE_EXPORT['compress'] = compress
+    FIGURE_EXPORT['image_formats'] = tuple(image_formats)
+
+
+def write_plotlyjs(folder):
+    """Writes plotly.min.js in a folder (once), for the figures saved with a shared plotly.js."""
+    plotlyjs_path = os.path.join(folder, 'plotly.min.js')
+    if not os.path.exists(plotlyjs_path):
+        from plotly.offline import get_plotlyjs
+        with open(plotlyjs_path + '.tmp', 'w', encoding='utf-8') as file:
+            file.write(get_plotlyjs())
+        os.replace(plotlyjs_path + '.tmp', plotlyjs_path)
+    return plotlyjs_path
+
+
+def write_figure(fig, output_html_file):
+    """
+    Saves a figure as HTML with the current export settings (see configure_figure_export).
+
+    The figure JSON is written compactly by plotly, with numeric arrays binary-encoded (plotly >= 6).
+
+    Returns:
+    - str: Path of the written file ('.gz' appended when compressed).
+    """
+    start = time.perf_counter()
+    if not FIGURE_EXPORT['shared_plotlyjs']:
+        include_plotlyjs = True
+    else:
+        include_plotlyjs = 'directory'
+        write_plotlyjs(os.path.dirname(output_html_file))
+
+    html = fig.to_html(include_plotlyjs=include_plotlyjs, validate=False)
+    root = os.path.splitext(output_html_file)[0]
+    if FIGURE_EXPORT['compress']:
+        output_html_file += '.gz'
+        with gzip.open(output_html_file, 'wt', encoding='utf-8', compresslevel=6) as file:
+            file.write(html)
+    else:
+        with open(output_html_file, 'w', encoding='utf-8') as file:
+            file.write(html)
+    _WRITE_TIMINGS.append((output_html_file, time.perf_counter() - start))
+
+    # Static images (PNG/SVG/PDF) through kaleido
+    for image_format in FIGURE_EXPORT['image_formats']:
+        start = time.perf_counter()
+        image_file = f"{root}.{image_format}"
+        fig.write_image(image_file, validate=False)
+        _WRITE_TIMINGS.append((image_file, time.perf_counter() - start))
+    return output_html_file
+
+
 def interpolate_color(color1, color2, factor: float):
     """Interpolate between two colors"""
     color1 = np.array(mcolors.to_rgb(color1))
     color2 = np.array(mcolors.to_rgb(color2))
     return mcolors.to_hex((1 - factor) * color1 + factor * color2)
 
-def generate_shades(pathway, num_shades):
+@lru_cache(maxsize=None)
+def shade_ramp(pathway, num_shades):
+    """
+    Returns `num_shades` colors evenly spaced from the base to the end color of a pathway (memoized).
+
+    The factors are the linspace grid i / (num_shades - 1), computed as in interpolate_color so the
+    hex colors are identical to interpolating each shade separately.
+    """
     base_color, end_color = pathway_shades.get(pathway, ('gray', 'lightgray'))
     if num_shades == 1:
-        return [base_color]  # Return the base color if only one shade is requested
-    shades = []
-    for i in range(num_shades):
-        factor = i / (num_shades - 1)
-        shades.append(interpolate_color(base_color, end_color, factor))
-    return shades
+        return (base_color,)  # Return the base color if only one shade is requested
+    factors = (np.arange(num_shades) / (num_shades - 1))[:, np.newaxis]
+    rgb = (1 - factors) * np.array(mcolors.to_rgb(base_color)) + factors * np.array(mcolors.to_rgb(end_color))
+    return tuple(mcolors.to_hex(color) for color in rgb)
+
+
+def generate_shades(pathway, num_shades):
+    return list(shade_ramp(pathway, num_shades))
+
+
+# Persisted superclass → color table shared by all families (override with YGGDRASIL_COLOR_TABLE)
+SUPERCLASS_COLORS_PATH = os.environ.get(
+    'YGGDRASIL_COLOR_TABLE', os.path.join(os.path.expanduser('~'), '.cache', 'yggdrasil', 'superclass_colors.json'))
+
+
+def _ramp_position(rank):
+    # Van der Corput sequence (0, 1/2, 1/4, 3/4, 1/8, ...): every new superclass of a pathway gets a
+    # shade between the existing ones, without moving the shades already assigned
+    position, denominator = 0.0, 1
+    while rank:
+        denominator *= 2
+        rank, bit = divmod(rank, 2)
+        position += bit / denominator
+    return position
+
+
+class SuperclassPalette:
+    """
+    Stable 'Pathway-superclass' → color table, persisted as JSON and shared by figures and families.
+
+    Each pathway keeps the list of its superclasses in the order they were registered; the n-th one
+    gets the shade at _ramp_position(n) of the pathway ramp (pathway_shades). Colors never change
+    once assigned, so a superclass has the same color in every figure of every family.
+    """
+
+    def __init__(self, path=SUPERCLASS_COLORS_PATH):
+        self.path = path
+        self.order = {}
+        self.colors = {}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as file:
+                table = json.load(file)
+            self.order, self.colors = table['order'], table['colors']
+
+    def _assign(self, pathway, superclass):
+        superclasses = self.order.setdefault(pathway, [])
+        base_color, end_color = pathway_shades.get(pathway, ('gray', 'lightgray'))
+        self.colors[f"{pathway}-{superclass}"] = interpolate_color(base_color, end_color, _ramp_position(len(superclasses)))
+        superclasses.append(superclass)
+
+    def color_map(self, pairs):
+        """
+        Returns the color of each (pathway, superclass) pair, registering (and persisting) new pairs.
+        New pairs are registered in alphabetical order so the table does not depend on row order.
+        """
+        pairs = list(dict.fromkeys(pairs))
+        new_pairs = sorted(pair for pair in pairs if f"{pair[0]}-{pair[1]}" not in self.colors)
+        if new_pairs:
+            for pathway, superclass in new_pairs:
+                self._assign(pathway, superclass)
+            self.save()
+        return {f"{pathway}-{superclass}": self.colors[f"{pathway}-{superclass}"] for pathway, superclass in pairs}
+
+    def save(self):
+        if not self.path:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({'order': self.order, 'colors': self.colors}, file, indent=1, sort_keys=True)
+        os.replace(self.path + '.tmp', self.path)
+
+
+# Palette shared by the functions of the session, created on first use
+_PALETTE = None
+
+
+def get_superclass_palette():
+    """Returns the shared SuperclassPalette, loaded from SUPERCLASS_COLORS_PATH on first use."""
+    global _PALETTE
+    if _PALETTE is None:
+        _PALETTE = SuperclassPalette()
+    return _PALETTE
+
+
+def set_superclass_palette(palette):
+    """Replaces the shared SuperclassPalette (e.g. to use another table, or SuperclassPalette(None) for no persistence)."""
+    global _PALETTE
+    _PALETTE = palette
+
+
+# Columns of the species_data/genus_data tables used by the figures
+CORPUS_COLUMNS = {
+    'species': ['organism_taxonomy_09species', 'structure_taxonomy_npclassifier_01pathway', 'chemical_superclass', 'chemical_class'],
+    'genus': ['organism_taxonomy_08genus', 'structure_taxonomy_npclassifier_01pathway', 'chemical_superclass', 'chemical_class']
+}
+
+# Values left out of the superclass and pathway figures
+EXCLUDED_SUPERCLASSES = ['API Error-API Error', 'Not Classified-Not Classified']
+EXCLUDED_PATHWAYS = ['API Error', 'Not Classified']
+
+# Label and color of the merged rare superclasses in large mode
+OTHER_LABEL = 'Other'
+OTHER_COLOR = '#D3D3D3'
+
+# Count cube persisted next to Full_results.csv
+COUNT_CUBE_FILENAME = 'count_cube.parquet'
+
+# NPClassifier levels of the count cube, from coarsest to finest
+CUBE_CHEMICAL_COLUMNS = ['Pathway', 'chemical_superclass', 'chemical_class']
+
+# Bump when the layout of the count cube changes, so persisted cubes are rebuilt
+CUBE_VERSION = 1
+
+
+class SpeciesCorpus:
+    """
+    The species_data/ and genus_data/ tables of an output folder, loaded once and shared by all figures.
+
+    Only the columns in CORPUS_COLUMNS are read, stored as categoricals. When the output folder holds
+    a species_dataset/ or genus_dataset/ (see taxon_dataset) it is read instead of the TSV files. A table
+    is reloaded when the modification time of its folder (or of the dataset manifest) changes.
+
+    The figures are drawn from the count cube: the number of compounds of each taxon (species or genus)
+    and each (Pathway, chemical_superclass, chemical_class) combination. It is built once, persisted as
+    count_cube.parquet in the output folder and every figure is a slice of it.
+    """
+
+    def __init__(self, output_folder):
+        """
+        Parameters:
+        - output_folder: Path to the folder containing the 'species_data' and 'genus_data' subfolders.
+        """
+        self.output_folder = output_folder
+        self._tables = {}
+        self._cube = None
+
+    def folder(self, level):
+        dataset_folder = taxon_dataset_path(self.output_folder, level)
+        if is_taxon_dataset(dataset_folder):
+            return dataset_folder
+        return os.path.join(self.output_folder, f'{level}_data')
+
+    def _mtime(self, level):
+        # The manifest of a dataset is rewritten on every write, the folder of TSV files changes with its files
+        folder = self.folder(level)
+        if is_taxon_dataset(folder):
+            return os.stat(os.path.join(folder, DATASET_MANIFEST_FILENAME)).st_mtime_ns
+        return os.stat(folder).st_mtime_ns
+
+    def load(self, level='species'):
+        """
+        Returns the concatenated tables of a taxon level ('species' or 'genus').
+
+        The returned DataFrame is a copy, so callers may rename or add columns freely.
+        """
+        folder = self.folder(level)
+        mtime = self._mtime(level)
+        cached = self._tables.get(level)
+        if cached is None or cached[0] != mtime:
+            if is_taxon_dataset(folder):
+                # Taxa in the order they were written, the figures use the order of first appearance of the taxa
+                all_data = read_taxon_dataset(folder, columns=CORPUS_COLUMNS[level]).drop(columns=TAXON_COLUMN)
+            else:
+                # Keep os.listdir order, the figures use the order of first appearance of the taxa
+                frames = [
+                    pd.read_csv(os.path.join(folder, filename), sep='\t', usecols=CORPUS_COLUMNS[level], dtype=str)
+                    for filename in os.listdir(folder) if filename.endswith(".tsv")
+                ]
+                all_data = pd.concat(frames, ignore_index=True)
+            all_data = all_data[CORPUS_COLUMNS[level]].astype('category')
+            cached = self._tables[level] = (mtime, all_data)
+        return cached[1].copy()
+
+    def signature(self):
+        """Returns the state of the species_data/genus_data folders the count cube was built from."""
+        return {
+            'version': CUBE_VERSION,
+            'mtimes': {level: self._mtime(level) for level in CORPUS_COLUMNS if os.path.isdir(self.folder(level))}
+        }
+
+    def count_cube(self):
+        """
+        Returns the count cube, from memory, from count_cube.parquet when it matches the current
+        species_data/genus_data folders, or rebuilt (and persisted) otherwise.
+
+        Returns:
+        - pd.DataFrame: Columns 'level', 'taxon', 'Pathway', 'chemical_superclass', 'chemical_class',
+          'recurrence' and 'first_row' (position of the first compound of the combination in the
+          concatenated tables, which keeps the order of first appearance used by the color maps).
+        """
+        signature = self.signature()
+        if self._cube is not None and self._cube[0] == signature:
+            return self._cube[1]
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        cube_path = os.path.join(self.output_folder, COUNT_CUBE_FILENAME)
+        cube = None
+        if os.path.exists(cube_path):
+            table = pq.read_table(cube_path)
+            metadata = table.schema.metadata or {}
+            if json.loads(metadata.get(b'yggdrasil', b'null')) == signature:
+                cube = table.to_pandas()
+
+        if cube is None:
+            cube = build_count_cube(self, levels=list(signature['mtimes']))
+            table = pa.Table.from_pandas(cube, preserve_index=False)
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), 'yggdrasil': json.dumps(signature)})
+            pq.write_table(table, cube_path + '.tmp')
+            os.replace(cube_path + '.tmp', cube_path)
+
+        self._cube = (signature, cube)
+        return cube
+
+    def _slice(self, level, exclude):
+        cube = self.count_cube()
+        cube = cube[cube['level'] == level]
+        for column, values in (exclude or {}).items():
+            cube = cube[~cube[column].isin(values)]
+        return cube
+
+    def recurrence(self, level, keys, exclude=None):
+        """
+        Counts the compounds of each taxon of a level and each combination of chemical keys.
+
+        Parameters:
+        - level: 'species' or 'genus'.
+        - keys: Chemical columns of the cube, e.g. ['Pathway'] or ['chemical_superclass'].
+        - exclude: Optional {column: values} of compounds left out (e.g. {'Pathway': ['API Error']}).
+
+        Returns:
+        - pd.DataFrame: Columns level, *keys and 'recurrence', sorted like a groupby on [level, *keys]
+          (combinations with a missing taxon or key are dropped, as groupby does).
+        """
+        agg_data = self._slice(level, exclude).groupby(['taxon'] + keys)['recurrence'].sum().reset_index()
+        return agg_data.rename(columns={'taxon': level})
+
+    def first_seen(self, level, key, exclude=None):
+        """
+        Returns the distinct values of a chemical column of a level (missing values included),
+        in order of first appearance in the concatenated tables.
+        """
+        first_rows = self._slice(level, exclude).groupby(key, dropna=False)['first_row'].min()
+        return pd.Series(first_rows.sort_values(kind='stable').index)
+
+
+def build_count_cube(corpus, levels=('species', 'genus')):
+    """
+    Builds the count cube of a SpeciesCorpus (see SpeciesCorpus.count_cube) from its TSV tables.
+
+    Parameters:
+    - corpus: SpeciesCorpus to aggregate.
+    - levels: Taxon levels to include.
+
+    Returns:
+    - pd.DataFrame: The count cube.
+    """
+    cubes = []
+    for level in levels:
+        all_data = corpus.load(level)
+        all_data.columns = ['taxon'] + CUBE_CHEMICAL_COLUMNS
+        all_data['first_row'] = np.arange(len(all_data))
+
+        # Missing taxa and chemical levels are kept, every slice then drops them like a plain groupby
+        cube = all_data.groupby(['taxon'] + CUBE_CHEMICAL_COLUMNS, observed=True, dropna=False)['first_row'].agg(['size', 'min'])
+        cube = cube.reset_index().rename(columns={'size': 'recurrence', 'min': 'first_row'})
+        for column in ['taxon'] + CUBE_CHEMICAL_COLUMNS:
+            cube[column] = cube[column].astype(cube[column].cat.categories.dtype)
+        cube.insert(0, 'level', level)
+        cubes.append(cube)
+
+    return pd.concat(cubes, ignore_index=True)
+
+
+# Corpora shared across calls, keyed by output folder
+_CORPORA = {}
+
+
+def get_species_corpus(source):
+    """
+    Returns the SpeciesCorpus of an output folder, reusing the one already loaded in this session.
+
+    Parameters:
+    - source: Output folder path, or a SpeciesCorpus (returned unchanged).
+    """
+    if isinstance(source, SpeciesCorpus):
+        return source
+    key = os.path.abspath(source)
+    if key not in _CORPORA:
+        _CORPORA[key] = SpeciesCorpus(source)
+    return _CORPORA[key]
+
 
 def split_chemical_superclass(row):
     # Check if the value is a string before splitting
@@ -53,207 +424,289 @@ def split_chemical_superclass(row):
     else:
         # Return default values if the entry is NaN or not a string
         return 'Unknown', 'Unknown'
- 
- 
-def plot_species_superclass(output_folder, split_chemical_superclass, generate_shades):
+
+
+def split_chemical_superclass_column(values, split_chemical_superclass=split_chemical_superclass):
     """
-    Reads .tsv files, processes species and superclass data, and generates a stacked bar plot.
+    Splits a 'chemical_superclass' column into 'Pathway' and 'superclass' columns.
+
+    The row splitter is applied once per distinct value and the results are broadcast back with the
+    factorized codes, so the 'Unknown' rules of the splitter are kept exactly (NaN included).
 
     Parameters:
-    - output_folder: Path to the folder containing 'species_data' subfolder.
-    - split_chemical_superclass: Function to split 'chemical_superclass' into 'Pathway' and 'Superclass'.
-    - generate_shades: Function to generate color shades for pathways.
-    
-    Saves the plot as an HTML file in the output folder.
+    - values: Series of 'Pathway-Superclass' strings.
+    - split_chemical_superclass: Function splitting a row (any mapping with a 'chemical_superclass' key).
+
+    Returns:
+    - pd.DataFrame: 'Pathway' and 'superclass' columns, aligned on the index of values.
     """
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    parts = [tuple(split_chemical_superclass({'chemical_superclass': value})) for value in uniques]
+    parts = np.array(parts, dtype=object).reshape(len(parts), 2)[codes]
+    return pd.DataFrame({'Pathway': parts[:, 0], 'superclass': parts[:, 1]}, index=values.index)
 
-    species_data_folder = os.path.join(output_folder, 'species_data')
 
-    # Step 1: Read data from all .tsv files
-    all_data = pd.concat([
-        pd.read_csv(os.path.join(species_data_folder, filename), sep='\t')
-        for filename in os.listdir(species_data_folder) if filename.endswith(".tsv")
-    ], ignore_index=True)
+def superclass_color_map(superclasses, generate_shades, split_chemical_superclass=split_chemical_superclass, palette=None):
+    """
+    Builds the 'Pathway-superclass' → color map of the superclass figures.
 
-    # Step 2: Rename 'organism_taxonomy_09species' to 'species'
-    all_data.rename(columns={'organism_taxonomy_09species': 'species'}, inplace=True)
+    With a palette the colors come from that SuperclassPalette, so they are the same in every figure
+    and family. Without one, generate_shades is applied per figure: the superclasses of a pathway get
+    its shades in order of appearance.
+
+    Parameters:
+    - superclasses: 'chemical_superclass' values, in order of first appearance (SpeciesCorpus.first_seen).
+    - generate_shades: Function to generate color shades for pathways (used when palette is None).
+    - split_chemical_superclass: Function to split 'chemical_superclass' into 'Pathway' and 'Superclass'.
+    - palette: SuperclassPalette giving the colors (e.g. get_superclass_palette()), or None.
 
-    # Step 3: Apply the function to split 'chemical_superclass'
-    all_data[['Pathway', 'superclass']] = all_data.apply(lambda row: split_chemical_superclass(row), axis=1, result_type='expand')
+    Returns:
+    - dict: The color of each superclass.
+    """
+    split = split_chemical_superclass_column(superclasses, split_chemical_superclass)
+    if palette is not None:
+        return palette.color_map(zip(split['Pathway'], split['superclass']))
 
-    # Step 4: Process data for color mapping
     color_map = {}
-    for pathway, superclasses in all_data.groupby('Pathway')['superclass'].unique().items():
+    for pathway, superclasses in split.groupby('Pathway')['superclass'].unique().items():
         shades = generate_shades(pathway, len(superclasses))
         for superclass, shade in zip(superclasses, shades):
             color_map[f"{pathway}-{superclass}"] = shade
+    return color_map
 
-    # Step 5: Group and aggregate data to calculate recurrence
-    agg_data = all_data.groupby(['species', 'chemical_superclass']).size().reset_index(name='recurrence')
-
-    # Convert 'species' column to categorical data
-    agg_data['species'] = pd.Categorical(agg_data['species'], categories=agg_data['species'].unique(), ordered=True)
-
-    # Get unique species names and superclasses
-    unique_species = agg_data['species'].unique()
-    unique_superclasses = sorted(agg_data['chemical_superclass'].unique())
-
-    # Step 6: Create the stacked barplot
-    fig = px.bar(
-        agg_data, y='species', x='recurrence',
-        title='Stacked Barplot of Predicted Superclasses Occurrence for Species',
-        labels={'recurrence': 'Recurrence'},
-        color='chemical_superclass',
-        color_discrete_map=color_map,
-        category_orders={'species': unique_species, 'chemical_superclass': unique_superclasses},
-        orientation='h'
-    )
 
-    # Modify the y-axis label
-    fig.update_yaxes(title_text='<i>Species<i>')
-
-    # Set species labels in italics
-    fig.update_layout(yaxis=dict(
-        tickmode='array',
-        tickvals=list(range(len(unique_species))),
-        ticktext=[f'<i>{species}</i>' for species in unique_species]
-    ))
-
-    # Set a white background
-    fig.update_layout(plot_bgcolor='white')
-
-    # Modify the figure size
-    fig.update_layout(width=1500, height=1500)
+def aggregate_tail(agg_data, taxon_column, color_column, max_categories):
+    """
+    Keeps the `max_categories` most frequent values of color_column (by total recurrence) and merges
+    the others into one OTHER_LABEL bar per taxon, so large figures have a bounded number of traces.
+    """
+    totals = agg_data.groupby(color_column)['recurrence'].sum().sort_values(ascending=False, kind='stable')
+    if len(totals) <= max_categories:
+        return agg_data
+    tail = ~agg_data[color_column].isin(totals.index[:max_categories])
+    other = agg_data[tail].groupby(taxon_column, sort=False)['recurrence'].sum().reset_index()
+    other[color_column] = OTHER_LABEL
+    agg_data = pd.concat([agg_data[~tail], other], ignore_index=True)
+    return agg_data.sort_values([taxon_column, color_column], kind='stable', ignore_index=True)
 
-    # Save the figure as an HTML file
-    output_html_file = os.path.join(output_folder, 'Wikidata_superclass_barplot_species.html')
-    fig.write_html(output_html_file)
 
-    # Show the figure
-    fig.show()
+def figure_pages(agg_data, taxon_column, page_size, output_html_file):
+    """
+    Splits the taxa axis of a figure into pages of `page_size` taxa for large families.
 
-    print(f"✅ Process completed! Visualization saved to {output_html_file}")
+    Yields:
+    - tuple: (HTML path, data of the page). Without paging (page_size None or not exceeded) the whole
+      data is yielded once with the original path, otherwise '_pageN' is appended to the file name.
+    """
+    taxa = agg_data[taxon_column].unique()
+    if page_size is None or len(taxa) <= page_size:
+        yield output_html_file, agg_data
+        return
 
+    root, extension = os.path.splitext(output_html_file)
+    n_pages = -(-len(taxa) // page_size)
+    for page in range(n_pages):
+        page_taxa = taxa[page * page_size:(page + 1) * page_size]
+        page_data = agg_data[agg_data[taxon_column].isin(page_taxa)].reset_index(drop=True)
+        yield f"{root}_page{page + 1:0{len(str(n_pages))}d}{extension}", page_data
 
 
-def plot_species_superclass_norm(output_folder, split_chemical_superclass, generate_shades):
+def plot_species_superclass(output_folder, split_chemical_superclass, generate_shades, max_superclasses=None, species_per_page=None, use_palette=True, show=True):
     """
-    Reads .tsv files, processes species and superclass data, normalizes recurrence values, and generates a stacked bar plot.
+    Reads .tsv files, processes species and superclass data, and generates a stacked bar plot.
 
     Parameters:
-    - output_folder: Path to the folder containing 'species_data' subfolder.
+    - output_folder: Path to the folder containing 'species_data' subfolder, or a SpeciesCorpus.
     - split_chemical_superclass: Function to split 'chemical_superclass' into 'Pathway' and 'Superclass'.
     - generate_shades: Function to generate color shades for pathways.
+    - max_superclasses: Large mode, keep the most frequent superclasses and merge the rest into 'Other'.
+    - species_per_page: Large mode, split the species axis into HTML pages of this many species.
+    - use_palette: Take the colors from the shared SuperclassPalette, so they match the other figures
+      (set to False to apply generate_shades to this figure only).
+    - show (bool): Display the figure (set to False for headless batch runs).
 
     Saves the plot as an HTML file in the output folder.
     """
 
-    species_data_folder = os.path.join(output_folder, 'species_data')
+    corpus = get_species_corpus(output_folder)
+    output_folder = corpus.output_folder
 
-    # Step 1: Read data from all .tsv files
-    all_data = pd.concat([
-        pd.read_csv(os.path.join(species_data_folder, filename), sep='\t')
-        for filename in os.listdir(species_data_folder) if filename.endswith(".tsv")
-    ], ignore_index=True)
+    # Step 1: Count the compounds of each species and superclass (slice of the shared count cube)
+    agg_data = corpus.recurrence('species', ['chemical_superclass'])
 
-    # Step 2: Rename 'organism_taxonomy_09species' to 'species'
-    all_data.rename(columns={'organism_taxonomy_09species': 'species'}, inplace=True)
+    # Step 2: Process data for color mapping
+    color_map = superclass_color_map(corpus.first_seen('species', 'chemical_superclass'), generate_shades, split_chemical_superclass, palette=get_superclass_palette() if use_palette else None)
 
-    # Step 3: Remove specific values
-    all_data = all_data[~all_data['chemical_superclass'].isin(['API Error-API Error', 'Not Classified-Not Classified'])]
+    # Step 3: In large mode, merge the rarest superclasses into 'Other'
+    if max_superclasses is not None:
+        agg_data = aggregate_tail(agg_data, 'species', 'chemical_superclass', max_superclasses)
+        color_map[OTHER_LABEL] = OTHER_COLOR
 
-    # Step 4: Apply function to split 'chemical_superclass'
-    all_data[['Pathway', 'superclass']] = all_data.apply(lambda row: split_chemical_superclass(row), axis=1, result_type='expand')
+    # Build the figure of the species of one page (all species unless species_per_page is set)
+    def build_figure(agg_data):
+        # Convert 'species' column to categorical data
+        agg_data['species'] = pd.Categorical(agg_data['species'], categories=agg_data['species'].unique(), ordered=True)
 
-    # Step 5: Process data for color mapping
-    color_map = {}
-    for pathway, superclasses in all_data.groupby('Pathway')['superclass'].unique().items():
-        shades = generate_shades(pathway, len(superclasses))
-        for superclass, shade in zip(superclasses, shades):
-            color_map[f"{pathway}-{superclass}"] = shade
+        # Get unique species names and superclasses
+        unique_species = agg_data['species'].unique()
+        unique_superclasses = sorted(agg_data['chemical_superclass'].unique())
 
-    # Step 6: Group and aggregate data to calculate recurrence
-    agg_data = all_data.groupby(['species', 'chemical_superclass']).size().reset_index(name='recurrence')
+        # Step 4: Create the stacked barplot
+        fig = px.bar(
+            agg_data, y='species', x='recurrence',
+            title='Stacked Barplot of Predicted Superclasses Occurrence for Species',
+            labels={'recurrence': 'Recurrence'},
+            color='chemical_superclass',
+            color_discrete_map=color_map,
+            category_orders={'species': unique_species, 'chemical_superclass': unique_superclasses},
+            orientation='h'
+        )
 
-    # Step 7: Normalize the recurrence values within each species group
-    agg_data['recurrence_normalized'] = agg_data.groupby('species')['recurrence'].transform(lambda x: x / x.sum()) * 100
+        # Modify the y-axis label
+        fig.update_yaxes(title_text='<i>Species<i>')
 
-    # Convert 'species' column to categorical data
-    agg_data['species'] = pd.Categorical(agg_data['species'], categories=agg_data['species'].unique(), ordered=True)
+        # Set species labels in italics
+        fig.update_layout(yaxis=dict(
+            tickmode='array',
+            tickvals=list(range(len(unique_species))),
+            ticktext=[f'<i>{species}</i>' for species in unique_species]
+        ))
 
-    # Get unique species names and superclasses
-    unique_species = agg_data['species'].unique()
-    unique_superclasses = sorted(agg_data['chemical_superclass'].unique())
+        # Set a white background
+        fig.update_layout(plot_bgcolor='white')
 
-    # Step 8: Calculate total recurrence for each species
-    total_recurrence_per_species = agg_data.groupby('species')['recurrence'].sum()
+        # Modify the figure size
+        fig.update_layout(width=1500, height=1500)
 
-    # Step 9: Create the stacked barplot
-    fig = px.bar(
-        agg_data, y='species', x='recurrence_normalized',
-        title='Normalized Stacked Barplot of Predicted Superclasses Occurrence for Species',
-        labels={'recurrence_normalized': 'Normalized Recurrence (%)'},
-        color='chemical_superclass',
-        color_discrete_map=color_map,
-        category_orders={'species': unique_species, 'chemical_superclass': unique_superclasses},
-        orientation='h'
-    )
+        return fig
 
-    # Modify the y-axis label
-    fig.update_yaxes(title_text='<i>Species<i>')
+    # Save the figure(s) as HTML file(s)
+    for output_html_file, page_data in figure_pages(agg_data, 'species', species_per_page, os.path.join(output_folder, 'Wikidata_superclass_barplot_species.html')):
+        fig = build_figure(page_data)
+        output_html_file = write_figure(fig, output_html_file)
 
-    # Set species labels in italics
-    fig.update_layout(yaxis=dict(
-        tickmode='array',
-        tickvals=list(range(len(unique_species))),
-        ticktext=[f'<i>{species}</i>' for species in unique_species]
-    ))
+        # Show the figure
+        if show:
+            fig.show()
 
-    # Set a white background
-    fig.update_layout(plot_bgcolor='white')
+        print(f"✅ Process completed! Visualization saved to {output_html_file}")
 
-    # Step 10: Add annotations for total compounds per species
-    max_x = agg_data['recurrence_normalized'].max()
 
-    for species, total_recurrence in total_recurrence_per_species.items():
-        # Find the maximum recurrence for this species
-        max_recurrence = agg_data[agg_data['species'] == species]['recurrence_normalized'].max()
+def plot_species_superclass_norm(output_folder, split_chemical_superclass, generate_shades, max_superclasses=None, species_per_page=None, use_palette=True, show=True):
+    """
+    Reads .tsv files, processes species and superclass data, normalizes recurrence values, and generates a stacked bar plot.
 
-        # Position the annotation at the end of the bar with a slight offset
-        x_position = max_x + 2
-        if x_position > 100:  # Ensure the label is not outside the plot area
-            x_position = 100  # Set it to 100 if it exceeds the maximum x-axis value
+    Parameters:
+    - output_folder: Path to the folder containing 'species_data' subfolder, or a SpeciesCorpus.
+    - split_chemical_superclass: Function to split 'chemical_superclass' into 'Pathway' and 'Superclass'.
+    - generate_shades: Function to generate color shades for pathways.
+    - max_superclasses: Large mode, keep the most frequent superclasses and merge the rest into 'Other'.
+    - species_per_page: Large mode, split the species axis into HTML pages of this many species.
+    - use_palette: Take the colors from the shared SuperclassPalette, so they match the other figures
+      (set to False to apply generate_shades to this figure only).
+    - show (bool): Display the figure (set to False for headless batch runs).
 
-        # Add annotation to the plot
-        fig.add_annotation(
-            x=x_position,
-            y=species,
-            text=f'Total compounds: {total_recurrence}',
-            showarrow=False,
-            font=dict(size=10, color='black'),
-            xanchor='left',
-            yanchor='middle'
+    Saves the plot as an HTML file in the output folder.
+    """
+
+    corpus = get_species_corpus(output_folder)
+    output_folder = corpus.output_folder
+
+    # Step 1: Count the compounds of each species and superclass (slice of the shared count cube)
+    agg_data = corpus.recurrence('species', ['chemical_superclass'], exclude={'chemical_superclass': EXCLUDED_SUPERCLASSES})
+
+    # Step 2: Process data for color mapping
+    color_map = superclass_color_map(corpus.first_seen('species', 'chemical_superclass', exclude={'chemical_superclass': EXCLUDED_SUPERCLASSES}), generate_shades, split_chemical_superclass, palette=get_superclass_palette() if use_palette else None)
+
+    # Step 3: In large mode, merge the rarest superclasses into 'Other'
+    if max_superclasses is not None:
+        agg_data = aggregate_tail(agg_data, 'species', 'chemical_superclass', max_superclasses)
+        color_map[OTHER_LABEL] = OTHER_COLOR
+
+    # Step 4: Normalize the recurrence values within each species group
+    agg_data['recurrence_normalized'] = agg_data['recurrence'] / agg_data.groupby('species', observed=True)['recurrence'].transform('sum') * 100
+
+    # Build the figure of the species of one page (all species unless species_per_page is set)
+    def build_figure(agg_data):
+        # Convert 'species' column to categorical data
+        agg_data['species'] = pd.Categorical(agg_data['species'], categories=agg_data['species'].unique(), ordered=True)
+
+        # Get unique species names and superclasses
+        unique_species = agg_data['species'].unique()
+        unique_superclasses = sorted(agg_data['chemical_superclass'].unique())
+
+        # Step 5: Calculate total recurrence for each species
+        total_recurrence_per_species = agg_data.groupby('species', observed=True)['recurrence'].sum()
+
+        # Step 6: Create the stacked barplot
+        fig = px.bar(
+            agg_data, y='species', x='recurrence_normalized',
+            title='Normalized Stacked Barplot of Predicted Superclasses Occurrence for Species',
+            labels={'recurrence_normalized': 'Normalized Recurrence (%)'},
+            color='chemical_superclass',
+            color_discrete_map=color_map,
+            category_orders={'species': unique_species, 'chemical_superclass': unique_superclasses},
+            orientation='h'
         )
 
-    # Step 11: Modify figure size
-    fig.update_layout(width=1500, height=1500)
+        # Modify the y-axis label
+        fig.update_yaxes(title_text='<i>Species<i>')
 
-    # Save the figure as an HTML file
-    output_html_file = os.path.join(output_folder, 'Wikidata_superclass_barplot_species_normalized.html')
-    fig.write_html(output_html_file)
+        # Set species labels in italics
+        fig.update_layout(yaxis=dict(
+            tickmode='array',
+            tickvals=list(range(len(unique_species))),
+            ticktext=[f'<i>{species}</i>' for species in unique_species]
+        ))
 
-    # Show the figure
-    fig.show()
+        # Set a white background
+        fig.update_layout(plot_bgcolor='white')
+
+        # Step 7: Add annotations for total compounds per species
+        max_x = agg_data['recurrence_normalized'].max()
+
+        # Position the annotations at the end of the bars with a slight offset
+        x_position = min(max_x + 2, 100)  # Ensure the labels are not outside the plot area
+
+        # Add all annotations in one layout update (add_annotation revalidates the whole layout on every call)
+        fig.update_layout(annotations=[
+            dict(
+                x=x_position,
+                y=species,
+                text=f'Total compounds: {total_recurrence}',
+                showarrow=False,
+                font=dict(size=10, color='black'),
+                xanchor='left',
+                yanchor='middle'
+            )
+            for species, total_recurrence in total_recurrence_per_species.items()
+        ])
+
+        # Step 8: Modify figure size
+        fig.update_layout(width=1500, height=1500)
 
-    print(f"✅ Process completed! Visualization saved to {output_html_file}")
+        return fig
 
+    # Save the figure(s) as HTML file(s)
+    for output_html_file, page_data in figure_pages(agg_data, 'species', species_per_page, os.path.join(output_folder, 'Wikidata_superclass_barplot_species_normalized.html')):
+        fig = build_figure(page_data)
+        output_html_file = write_figure(fig, output_html_file)
 
-def plot_species_pathway(output_folder):
+        # Show the figure
+        if show:
+            fig.show()
+
+        print(f"✅ Process completed! Visualization saved to {output_html_file}")
+
+
+def plot_species_pathway(output_folder, species_per_page=None, show=True):
     """
     Process data from .tsv files in the output folder and visualize it with a stacked barplot.
 
     Parameters:
-    - output_folder (str): Path to the folder containing 'species_data' subfolder.
+    - output_folder (str or SpeciesCorpus): Path to the folder containing 'species_data' subfolder, or a SpeciesCorpus.
+    - species_per_page: Large mode, split the species axis into HTML pages of this many species.
+    - show (bool): Display the figure (set to False for headless batch runs).
 
     Saves the visualization as an HTML file.
     """
@@ -269,73 +722,70 @@ def plot_species_pathway(output_folder):
         'Carbohydrates': '#65451F'  # Brown
     }
 
-    species_data_folder = os.path.join(output_folder, 'species_data')
-
-    # Step 1: Read data from all .tsv files
-    all_data = pd.concat([
-        pd.read_csv(os.path.join(species_data_folder, filename), sep='\t')
-        for filename in os.listdir(species_data_folder) if filename.endswith(".tsv")
-    ], ignore_index=True)
+    corpus = get_species_corpus(output_folder)
+    output_folder = corpus.output_folder
 
-    # Step 2: Rename columns
-    all_data.rename(columns={'organism_taxonomy_09species': 'species'}, inplace=True)
-    all_data.rename(columns={'structure_taxonomy_npclassifier_01pathway': 'Pathway'}, inplace=True)
+    # Step 1: Count the compounds of each species and pathway (slice of the shared count cube)
+    agg_data = corpus.recurrence('species', ['Pathway'], exclude={'Pathway': EXCLUDED_PATHWAYS})
 
-    # Step 3: Remove 'API Error' and 'Not Classified' from 'Pathway'
-    all_data = all_data[~all_data['Pathway'].isin(['API Error', 'Not Classified'])]
+    # Build the figure of the species of one page (all species unless species_per_page is set)
+    def build_figure(agg_data):
+        # Convert 'species' column to categorical data
+        agg_data['species'] = pd.Categorical(agg_data['species'], categories=agg_data['species'].unique(), ordered=True)
 
-    # Step 4: Group and aggregate data to calculate recurrence
-    agg_data = all_data.groupby(['species', 'Pathway']).size().reset_index(name='recurrence')
+        # Get unique species names and pathways
+        unique_species = agg_data['species'].unique()
+        unique_pathways = sorted(agg_data['Pathway'].unique())
 
-    # Convert 'species' column to categorical data
-    agg_data['species'] = pd.Categorical(agg_data['species'], categories=agg_data['species'].unique(), ordered=True)
+        # Step 2: Create the stacked barplot with custom colors
+        fig = px.bar(
+            agg_data, y='species', x='recurrence',
+            title='Stacked Barplot of Predicted Pathways Occurrence for Species',
+            labels={'recurrence': 'Recurrence'},
+            color='Pathway',
+            color_discrete_map=pathway_colors,  # Use custom colors
+            category_orders={'species': unique_species, 'Pathway': unique_pathways},
+            orientation='h'
+        )
 
-    # Get unique species names and pathways
-    unique_species = agg_data['species'].unique()
-    unique_pathways = sorted(agg_data['Pathway'].unique())
+        # Modify the y-axis label
+        fig.update_yaxes(title_text='<i>Species<i>')
 
-    # Step 5: Create the stacked barplot with custom colors
-    fig = px.bar(
-        agg_data, y='species', x='recurrence',
-        title='Stacked Barplot of Predicted Pathways Occurrence for Species',
-        labels={'recurrence': 'Recurrence'},
-        color='Pathway',
-        color_discrete_map=pathway_colors,  # Use custom colors
-        category_orders={'species': unique_species, 'Pathway': unique_pathways},
-        orientation='h'
-    )
+        # Set species labels in italics
+        fig.update_layout(yaxis=dict(
+            tickmode='array',
+            tickvals=list(range(len(unique_species))),
+            ticktext=[f'<i>{species}</i>' for species in unique_species]
+        ))
 
-    # Modify the y-axis label
-    fig.update_yaxes(title_text='<i>Species<i>')
+        # Set a white background
+        fig.update_layout(plot_bgcolor='white')
 
-    # Set species labels in italics
-    fig.update_layout(yaxis=dict(
-        tickmode='array',
-        tickvals=list(range(len(unique_species))),
-        ticktext=[f'<i>{species}</i>' for species in unique_species]
-    ))
+        # Modify the figure size
+        fig.update_layout(width=1500, height=1500)
 
-    # Set a white background
-    fig.update_layout(plot_bgcolor='white')
+        return fig
 
-    # Modify the figure size
-    fig.update_layout(width=1500, height=1500)
+    # Save the figure(s) as HTML file(s)
+    for output_html_path, page_data in figure_pages(agg_data, 'species', species_per_page, os.path.join(output_folder, 'Wikidata_pathway_barplot_species.html')):
+        fig = build_figure(page_data)
+        output_html_path = write_figure(fig, output_html_path)
 
-    # Save the figure as an HTML file
-    output_html_path = os.path.join(output_folder, 'Wikidata_pathway_barplot_species.html')
-    fig.write_html(output_html_path)
+        # Show the figure
+        if show:
+            fig.show()
 
-    # Show the figure
-    fig.show()
+        print(f"✅ Process completed! Visualization saved to {output_html_path}")
 
-    print(f"✅ Process completed! Visualization saved to {output_html_path}")
 
-def plot_species_pathway_norm(output_folder):
+def plot_species_pathway_norm(output_folder, species_per_page=None, show=True):
     """
     Reads .tsv files, processes species and pathway data, normalizes recurrence values, and generates a stacked bar plot.
 
     Parameters:
-    - output_folder (str): Path to the folder containing 'species_data' subfolder.
+    - output_folder (str or SpeciesCorpus): Path to the folder containing 'species_data' subfolder, or a SpeciesCorpus.
+    - species_per_page: Large mode, split the species axis into HTML pages of this many species.
+    - show (bool): Display the figure (set to False for headless batch runs).
 
     Saves the plot as an HTML file in the output folder.
     """
@@ -351,138 +801,110 @@ def plot_species_pathway_norm(output_folder):
         'Carbohydrates': '#65451F'  
     } 
 
-    species_data_folder = os.path.join(output_folder, 'species_data')
-
-    # Step 1: Read data from all .tsv files
-    all_data = pd.concat([
-        pd.read_csv(os.path.join(species_data_folder, filename), sep='\t')
-        for filename in os.listdir(species_data_folder) if filename.endswith(".tsv")
-    ], ignore_index=True)
-
-    # Step 2: Rename columns
-    all_data.rename(columns={'organism_taxonomy_09species': 'species'}, inplace=True)
-    all_data.rename(columns={'structure_taxonomy_npclassifier_01pathway': 'Pathway'}, inplace=True)
+    corpus = get_species_corpus(output_folder)
+    output_folder = corpus.output_folder
 
-    # Step 3: Remove 'API Error' and 'Not Classified' from 'Pathway'
-    all_data = all_data[~all_data['Pathway'].isin(['API Error', 'Not Classified'])]
+    # Step 1: Count the compounds of each species and pathway (slice of the shared count cube)
+    agg_data = corpus.recurrence('species', ['Pathway'], exclude={'Pathway': EXCLUDED_PATHWAYS})
 
-    # Step 4: Group and aggregate data to calculate recurrence
-    agg_data = all_data.groupby(['species', 'Pathway']).size().reset_index(name='recurrence')
+    # Step 2: Normalize the recurrence values within each species group
+    agg_data['recurrence_normalized'] = agg_data['recurrence'] / agg_data.groupby('species', observed=True)['recurrence'].transform('sum') * 100
 
-    # Step 5: Normalize the recurrence values within each species group
-    agg_data['recurrence_normalized'] = agg_data.groupby('species')['recurrence'].transform(lambda x: x / x.sum()) * 100
-
-    # Convert 'species' column to categorical data
-    agg_data['species'] = pd.Categorical(agg_data['species'], categories=agg_data['species'].unique(), ordered=True)
-
-    # Get unique species names and pathways
-    unique_species = agg_data['species'].unique()
-    unique_pathways = sorted(agg_data['Pathway'].unique())
+    # Build the figure of the species of one page (all species unless species_per_page is set)
+    def build_figure(agg_data):
+        # Convert 'species' column to categorical data
+        agg_data['species'] = pd.Categorical(agg_data['species'], categories=agg_data['species'].unique(), ordered=True)
 
-    # Step 6: Calculate total recurrence for each species
-    total_recurrence_per_species = agg_data.groupby('species')['recurrence'].sum()
+        # Get unique species names and pathways
+        unique_species = agg_data['species'].unique()
+        unique_pathways = sorted(agg_data['Pathway'].unique())
 
-    # Step 7: Create the stacked barplot with custom colors
-    fig = px.bar(
-        agg_data, y='species', x='recurrence_normalized',
-        title='Normalized Stacked Barplot of Predicted Pathways Occurrence for Species',
-        labels={'recurrence_normalized': 'Normalized Recurrence (%)'},
-        color='Pathway',
-        color_discrete_map=pathway_colors,  # Use custom colors
-        category_orders={'species': unique_species, 'Pathway': unique_pathways},
-        orientation='h'
-    )
+        # Step 3: Calculate total recurrence for each species
+        total_recurrence_per_species = agg_data.groupby('species', observed=True)['recurrence'].sum()
 
-    # Modify the y-axis label
-    fig.update_yaxes(title_text='<i>Species<i>')
+        # Step 4: Create the stacked barplot with custom colors
+        fig = px.bar(
+            agg_data, y='species', x='recurrence_normalized',
+            title='Normalized Stacked Barplot of Predicted Pathways Occurrence for Species',
+            labels={'recurrence_normalized': 'Normalized Recurrence (%)'},
+            color='Pathway',
+            color_discrete_map=pathway_colors,  # Use custom colors
+            category_orders={'species': unique_species, 'Pathway': unique_pathways},
+            orientation='h'
+        )
 
-    # Set species labels in italics
-    fig.update_layout(yaxis=dict(
-        tickmode='array',
-        tickvals=list(range(len(unique_species))),
-        ticktext=[f'<i>{species}</i>' for species in unique_species]
-    ))
+        # Modify the y-axis label
+        fig.update_yaxes(title_text='<i>Species<i>')
 
-    # Step 8: Add annotations for total compounds per species
-    max_x = agg_data['recurrence_normalized'].max()
+        # Set species labels in italics
+        fig.update_layout(yaxis=dict(
+            tickmode='array',
+            tickvals=list(range(len(unique_species))),
+            ticktext=[f'<i>{species}</i>' for species in unique_species]
+        ))
 
-    for species, total_recurrence in total_recurrence_per_species.items():
-        # Position the annotation at the end of the bar with a slight offset
-        x_position = max_x + 2
-        if x_position > 100:  # Ensure the label is not outside the plot area
-            x_position = 100  # Set it to 100 if it exceeds the maximum x-axis value
+        # Step 5: Add annotations for total compounds per species
+        max_x = agg_data['recurrence_normalized'].max()
+
+        # Position the annotations at the end of the bars with a slight offset
+        x_position = min(max_x + 2, 100)  # Ensure the labels are not outside the plot area
+
+        # Add all annotations in one layout update (add_annotation revalidates the whole layout on every call)
+        fig.update_layout(annotations=[
+            dict(
+                x=x_position,
+                y=species,
+                text=f'Total compounds: {total_recurrence}',
+                showarrow=False,
+                font=dict(size=10, color='black'),
+                xanchor='left',
+                yanchor='middle'
+            )
+            for species, total_recurrence in total_recurrence_per_species.items()
+        ])
 
-        # Add annotation to the plot
-        fig.add_annotation(
-            x=x_position,
-            y=species,
-            text=f'Total compounds: {total_recurrence}',
-            showarrow=False,
-            font=dict(size=10, color='black'),
-            xanchor='left',
-            yanchor='middle'
-        )
+        # Set a white background
+        fig.update_layout(plot_bgcolor='white')
 
-    # Set a white background
-    fig.update_layout(plot_bgcolor='white')
+        # Modify the figure size
+        fig.update_layout(width=1500, height=1500)
 
-    # Modify the figure size
-    fig.update_layout(width=1500, height=1500)
+        return fig
 
-    # Save the figure as an HTML file
-    output_html_path = os.path.join(output_folder, 'Wikidata_pathway_barplot_normalized.html')
-    fig.write_html(output_html_path)
+    # Save the figure(s) as HTML file(s)
+    for output_html_path, page_data in figure_pages(agg_data, 'species', species_per_page, os.path.join(output_folder, 'Wikidata_pathway_barplot_normalized.html')):
+        fig = build_figure(page_data)
+        output_html_path = write_figure(fig, output_html_path)
 
-    # Show the figure
-    fig.show()
+        # Show the figure
+        if show:
+            fig.show()
 
-    print(f"✅ Process completed! Visualization saved to {output_html_path}")
+        print(f"✅ Process completed! Visualization saved to {output_html_path}")
 
 
-def plot_genus_superclass(output_folder, generate_shades):
+def plot_genus_superclass(output_folder, generate_shades, use_palette=True, show=True):
     """
     Reads .tsv files, processes genus and superclass data, and generates a stacked bar plot.
 
     Parameters:
-    - output_folder (str): Path to the folder containing 'genus_data' subfolder.
+    - output_folder (str or SpeciesCorpus): Path to the folder containing 'genus_data' subfolder, or a SpeciesCorpus.
     - generate_shades: Function to generate color shades for pathways.
+    - use_palette: Take the colors from the shared SuperclassPalette, so they match the other figures
+      (set to False to apply generate_shades to this figure only).
+    - show (bool): Display the figure (set to False for headless batch runs).
 
     Saves the plot as an HTML file in the output folder.
     """
 
-    genus_data_folder = os.path.join(output_folder, 'genus_data')
-
-    # Step 1: Read data from all .tsv files
-    all_data = pd.concat([
-        pd.read_csv(os.path.join(genus_data_folder, filename), sep='\t')
-        for filename in os.listdir(genus_data_folder) if filename.endswith(".tsv")
-    ], ignore_index=True)
-
-    # Step 2: Rename columns
-    all_data.rename(columns={'organism_taxonomy_08genus': 'genus'}, inplace=True)
+    corpus = get_species_corpus(output_folder)
+    output_folder = corpus.output_folder
 
-    # Step 3: Remove 'API Error' and 'Not Classified' from 'chemical_superclass'
-    all_data = all_data[~all_data['chemical_superclass'].isin(['API Error-API Error', 'Not Classified-Not Classified'])]
-
-    # Function to split 'chemical_superclass' into pathway and superclass
-    def split_chemical_superclass(row):
-        if isinstance(row['chemical_superclass'], str):
-            parts = row['chemical_superclass'].split('-')
-            return parts if len(parts) == 2 else [parts[0], 'Unknown']
-        return ['Unknown', 'Unknown']
-
-    # Step 4: Apply the function to split chemical superclass
-    all_data[['Pathway', 'superclass']] = all_data.apply(lambda row: split_chemical_superclass(row), axis=1, result_type='expand')
-
-    # Step 5: Process data for color mapping
-    color_map = {}
-    for pathway, superclasses in all_data.groupby('Pathway')['superclass'].unique().items():
-        shades = generate_shades(pathway, len(superclasses))
-        for superclass, shade in zip(superclasses, shades):
-            color_map[f"{pathway}-{superclass}"] = shade
+    # Step 1: Count the compounds of each genus and superclass (slice of the shared count cube)
+    agg_data = corpus.recurrence('genus', ['chemical_superclass'], exclude={'chemical_superclass': EXCLUDED_SUPERCLASSES})
 
-    # Step 6: Group and aggregate data to calculate recurrence
-    agg_data = all_data.groupby(['genus', 'chemical_superclass']).size().reset_index(name='recurrence')
+    # Step 2: Process data for color mapping
+    color_map = superclass_color_map(corpus.first_seen('genus', 'chemical_superclass', exclude={'chemical_superclass': EXCLUDED_SUPERCLASSES}), generate_shades, palette=get_superclass_palette() if use_palette else None)
 
     # Convert 'genus' column to categorical data
     agg_data['genus'] = pd.Categorical(agg_data['genus'], categories=agg_data['genus'].unique(), ordered=True)
@@ -491,7 +913,7 @@ def plot_genus_superclass(output_folder, generate_shades):
     unique_genera = agg_data['genus'].unique()
     unique_superclasses = sorted(agg_data['chemical_superclass'].unique())
 
-    # Step 7: Create the stacked barplot with the custom color palette
+    # Step 3: Create the stacked barplot with the custom color palette
     fig = px.bar(
         agg_data, y='genus', x='recurrence',
         title='Stacked Barplot of Predicted Superclasses Occurrence for Genus',
@@ -520,60 +942,39 @@ def plot_genus_superclass(output_folder, generate_shades):
 
     # Save the figure as an HTML file
     output_html_path = os.path.join(output_folder, 'Wikidata_superclass_barplot_genus.html')
-    fig.write_html(output_html_path)
+    output_html_path = write_figure(fig, output_html_path)
 
     # Show the figure
-    fig.show()
+    if show:
+        fig.show()
 
     print(f"✅ Process completed! Visualization saved to {output_html_path}")
 
-def plot_genus_superclass_norm(output_folder, generate_shades):
+def plot_genus_superclass_norm(output_folder, generate_shades, use_palette=True, show=True):
     """
     Reads .tsv files, processes genus and superclass data, normalizes recurrence values, and generates a stacked bar plot.
 
     Parameters:
-    - output_folder (str): Path to the folder containing 'genus_data' subfolder.
+    - output_folder (str or SpeciesCorpus): Path to the folder containing 'genus_data' subfolder, or a SpeciesCorpus.
     - generate_shades: Function to generate color shades for pathways.
+    - use_palette: Take the colors from the shared SuperclassPalette, so they match the other figures
+      (set to False to apply generate_shades to this figure only).
+    - show (bool): Display the figure (set to False for headless batch runs).
 
     Saves the plot as an HTML file in the output folder.
     """
 
-    genus_data_folder = os.path.join(output_folder, 'genus_data')
-
-    # Step 1: Read data from all .tsv files
-    all_data = pd.concat([
-        pd.read_csv(os.path.join(genus_data_folder, filename), sep='\t')
-        for filename in os.listdir(genus_data_folder) if filename.endswith(".tsv")
-    ], ignore_index=True)
-
-    # Step 2: Rename columns
-    all_data.rename(columns={'organism_taxonomy_08genus': 'genus'}, inplace=True)
-
-    # Step 3: Remove 'API Error' and 'Not Classified' from 'chemical_superclass'
-    all_data = all_data[~all_data['chemical_superclass'].isin(['API Error-API Error', 'Not Classified-Not Classified'])]
+    corpus = get_species_corpus(output_folder)
+    output_folder = corpus.output_folder
 
-    # Function to split 'chemical_superclass' into pathway and superclass
-    def split_chemical_superclass(row):
-        if isinstance(row['chemical_superclass'], str):
-            parts = row['chemical_superclass'].split('-')
-            return parts if len(parts) == 2 else [parts[0], 'Unknown']
-        return ['Unknown', 'Unknown']
+    # Step 1: Count the compounds of each genus and superclass (slice of the shared count cube)
+    agg_data = corpus.recurrence('genus', ['chemical_superclass'], exclude={'chemical_superclass': EXCLUDED_SUPERCLASSES})
 
-    # Step 4: Apply the function to split chemical superclass
-    all_data[['Pathway', 'superclass']] = all_data.apply(lambda row: split_chemical_superclass(row), axis=1, result_type='expand')
-
-    # Step 5: Process data for color mapping
-    color_map = {}
-    for pathway, superclasses in all_data.groupby('Pathway')['superclass'].unique().items():
-        shades = generate_shades(pathway, len(superclasses))
-        for superclass, shade in zip(superclasses, shades):
-            color_map[f"{pathway}-{superclass}"] = shade
+    # Step 2: Process data for color mapping
+    color_map = superclass_color_map(corpus.first_seen('genus', 'chemical_superclass', exclude={'chemical_superclass': EXCLUDED_SUPERCLASSES}), generate_shades, palette=get_superclass_palette() if use_palette else None)
 
-    # Step 6: Group and aggregate data to calculate recurrence
-    agg_data = all_data.groupby(['genus', 'chemical_superclass']).size().reset_index(name='recurrence')
-
-    # Step 7: Normalize the recurrence values within each genus group
-    agg_data['recurrence_normalized'] = agg_data.groupby('genus')['recurrence'].transform(lambda x: x / x.sum()) * 100
+    # Step 3: Normalize the recurrence values within each genus group
+    agg_data['recurrence_normalized'] = agg_data['recurrence'] / agg_data.groupby('genus', observed=True)['recurrence'].transform('sum') * 100
 
     # Convert 'genus' column to categorical data
     agg_data['genus'] = pd.Categorical(agg_data['genus'], categories=agg_data['genus'].unique(), ordered=True)
@@ -582,10 +983,10 @@ def plot_genus_superclass_norm(output_folder, generate_shades):
     unique_genera = agg_data['genus'].unique()
     unique_superclasses = sorted(agg_data['chemical_superclass'].unique())
 
-    # Step 8: Calculate total recurrence for each genus
-    total_recurrence_per_genus = agg_data.groupby('genus')['recurrence'].sum()
+    # Step 4: Calculate total recurrence for each genus
+    total_recurrence_per_genus = agg_data.groupby('genus', observed=True)['recurrence'].sum()
 
-    # Step 9: Create the stacked barplot with the custom color palette
+    # Step 5: Create the stacked barplot with the custom color palette
     fig = px.bar(
         agg_data, y='genus', x='recurrence_normalized',
         title='Normalized Stacked Barplot of Predicted Superclasses Occurrence for Genus',
@@ -606,17 +1007,15 @@ def plot_genus_superclass_norm(output_folder, generate_shades):
         ticktext=[f'<i>{genus}</i>' for genus in unique_genera]
     ))
 
-    # Step 10: Add annotations for total compounds per genus
+    # Step 6: Add annotations for total compounds per genus
     max_x = agg_data['recurrence_normalized'].max()
 
-    for genus, total_recurrence in total_recurrence_per_genus.items():
-        # Position the annotation at the end of the bar with a slight offset
-        x_position = max_x + 2
-        if x_position > 100:  # Ensure the label is not outside the plot area
-            x_position = 100  # Set it to 100 if it exceeds the maximum x-axis value
+    # Position the annotations at the end of the bars with a slight offset
+    x_position = min(max_x + 2, 100)  # Ensure the labels are not outside the plot area
 
-        # Add annotation to the plot
-        fig.add_annotation(
+    # Add all annotations in one layout update (add_annotation revalidates the whole layout on every call)
+    fig.update_layout(annotations=[
+        dict(
             x=x_position,
             y=genus,
             text=f'Total compounds: {total_recurrence}',
@@ -625,6 +1024,8 @@ def plot_genus_superclass_norm(output_folder, generate_shades):
             xanchor='left',
             yanchor='middle'
         )
+        for genus, total_recurrence in total_recurrence_per_genus.items()
+    ])
 
     # Set a white background
     fig.update_layout(plot_bgcolor='white')
@@ -634,20 +1035,22 @@ def plot_genus_superclass_norm(output_folder, generate_shades):
 
     # Save the figure as an HTML file
     output_html_path = os.path.join(output_folder, 'Wikidata_superclass_barplot_genus_normalized.html')
-    fig.write_html(output_html_path)
+    output_html_path = write_figure(fig, output_html_path)
 
     # Show the figure
-    fig.show()
+    if show:
+        fig.show()
 
     print(f"✅ Process completed! Visualization saved to {output_html_path}")
 
-def plot_genus_pathway(output_folder):
+def plot_genus_pathway(output_folder, show=True):
     """
     Reads .tsv files, processes genus and pathway data, and generates a stacked bar plot.
 
     Parameters:
-    - output_folder (str): Path to the folder containing 'genus_data' subfolder.
+    - output_folder (str or SpeciesCorpus): Path to the folder containing 'genus_data' subfolder, or a SpeciesCorpus.
     - pathway_colors: Dictionary mapping pathways to specific colors.
+    - show (bool): Display the figure (set to False for headless batch runs).
 
     Saves the plot as an HTML file in the output folder.
     """
@@ -662,23 +1065,11 @@ def plot_genus_pathway(output_folder):
         'Carbohydrates': '#65451F'  
     } 
 
-    genus_data_folder = os.path.join(output_folder, 'genus_data')
-
-    # Step 1: Read data from all .tsv files
-    all_data = pd.concat([
-        pd.read_csv(os.path.join(genus_data_folder, filename), sep='\t')
-        for filename in os.listdir(genus_data_folder) if filename.endswith(".tsv")
-    ], ignore_index=True)
-
-    # Step 2: Rename columns
-    all_data.rename(columns={'organism_taxonomy_08genus': 'genus'}, inplace=True)
-    all_data.rename(columns={'structure_taxonomy_npclassifier_01pathway': 'Pathway'}, inplace=True)
-
-    # Step 3: Remove 'API Error' and 'Not Classified' from 'Pathway'
-    all_data = all_data[~all_data['Pathway'].isin(['API Error', 'Not Classified'])]
+    corpus = get_species_corpus(output_folder)
+    output_folder = corpus.output_folder
 
-    # Step 4: Group and aggregate data to calculate recurrence
-    agg_data = all_data.groupby(['genus', 'Pathway']).size().reset_index(name='recurrence')
+    # Step 1: Count the compounds of each genus and pathway (slice of the shared count cube)
+    agg_data = corpus.recurrence('genus', ['Pathway'], exclude={'Pathway': EXCLUDED_PATHWAYS})
 
     # Sort the DataFrame by 'genus' alphabetically
     agg_data = agg_data.sort_values(by='genus')
@@ -687,7 +1078,7 @@ def plot_genus_pathway(output_folder):
     unique_genera = sorted(agg_data['genus'].unique())
     unique_pathways = sorted(agg_data['Pathway'].unique())
 
-    # Step 5: Create the stacked barplot with custom colors
+    # Step 2: Create the stacked barplot with custom colors
     fig = px.bar(
         agg_data, y=agg_data['genus'].apply(lambda x: f"<i>{x}</i>"), x='recurrence',
         title='Stacked Barplot of Predicted Pathways Occurrence for Genus',
@@ -716,21 +1107,23 @@ def plot_genus_pathway(output_folder):
 
     # Save the figure as an HTML file
     output_html_path = os.path.join(output_folder, 'Wikidata_pathway_barplot_genus.html')
-    fig.write_html(output_html_path)
+    output_html_path = write_figure(fig, output_html_path)
 
     # Show the figure
-    fig.show()
+    if show:
+        fig.show()
 
     print(f"✅ Process completed! Visualization saved to {output_html_path}")
 
 
-def plot_genus_pathway_norm(output_folder):
+def plot_genus_pathway_norm(output_folder, show=True):
     """
     Reads .tsv files, processes genus and pathway data, normalizes recurrence values, and generates a stacked bar plot.
 
     Parameters:
-    - output_folder (str): Path to the folder containing 'genus_data' subfolder.
+    - output_folder (str or SpeciesCorpus): Path to the folder containing 'genus_data' subfolder, or a SpeciesCorpus.
     - pathway_colors: Dictionary mapping pathways to specific colors.
+    - show (bool): Display the figure (set to False for headless batch runs).
 
     Saves the plot as an HTML file in the output folder.
     """
@@ -744,26 +1137,14 @@ def plot_genus_pathway_norm(output_folder):
         'Amino acids and Peptides': '#F4E869',  
         'Carbohydrates': '#65451F'  
     } 
-    genus_data_folder = os.path.join(output_folder, 'genus_data')
-
-    # Step 1: Read data from all .tsv files
-    all_data = pd.concat([
-        pd.read_csv(os.path.join(genus_data_folder, filename), sep='\t')
-        for filename in os.listdir(genus_data_folder) if filename.endswith(".tsv")
-    ], ignore_index=True)
-
-    # Step 2: Rename columns
-    all_data.rename(columns={'organism_taxonomy_08genus': 'genus'}, inplace=True)
-    all_data.rename(columns={'structure_taxonomy_npclassifier_01pathway': 'Pathway'}, inplace=True)
+    corpus = get_species_corpus(output_folder)
+    output_folder = corpus.output_folder
 
-    # Step 3: Remove 'API Error' and 'Not Classified' from 'Pathway'
-    all_data = all_data[~all_data['Pathway'].isin(['API Error', 'Not Classified'])]
+    # Step 1: Count the compounds of each genus and pathway (slice of the shared count cube)
+    agg_data = corpus.recurrence('genus', ['Pathway'], exclude={'Pathway': EXCLUDED_PATHWAYS})
 
-    # Step 4: Group and aggregate data to calculate recurrence
-    agg_data = all_data.groupby(['genus', 'Pathway']).size().reset_index(name='recurrence')
-
-    # Step 5: Normalize the recurrence values within each genus group
-    agg_data['recurrence_normalized'] = agg_data.groupby('genus')['recurrence'].transform(lambda x: x / x.sum()) * 100
+    # Step 2: Normalize the recurrence values within each genus group
+    agg_data['recurrence_normalized'] = agg_data['recurrence'] / agg_data.groupby('genus', observed=True)['recurrence'].transform('sum') * 100
 
     # Sort the DataFrame by 'genus' alphabetically
     agg_data = agg_data.sort_values(by='genus')
@@ -772,10 +1153,10 @@ def plot_genus_pathway_norm(output_folder):
     unique_genera = sorted(agg_data['genus'].unique())
     unique_pathways = sorted(agg_data['Pathway'].unique())
 
-    # Step 6: Calculate total recurrence for each genus
-    total_recurrence_per_genus = agg_data.groupby('genus')['recurrence'].sum()
+    # Step 3: Calculate total recurrence for each genus
+    total_recurrence_per_genus = agg_data.groupby('genus', observed=True)['recurrence'].sum()
 
-    # Step 7: Create the stacked barplot with custom colors
+    # Step 4: Create the stacked barplot with custom colors
     fig = px.bar(
         agg_data, y=agg_data['genus'].apply(lambda x: f"<i>{x}</i>"), x='recurrence_normalized',
         title='Normalized Stacked Barplot of Predicted Pathways Occurrence for Genus',
@@ -796,17 +1177,15 @@ def plot_genus_pathway_norm(output_folder):
         ticktext=[f'<i>{genus}</i>' for genus in unique_genera]
     ))
 
-    # Step 8: Add annotations for total compounds per genus
+    # Step 5: Add annotations for total compounds per genus
     max_x = agg_data['recurrence_normalized'].max()
 
-    for genus, total_recurrence in total_recurrence_per_genus.items():
-        # Position the annotation at the end of the bar with a slight offset
-        x_position = max_x + 2
-        if x_position > 100:  # Ensure the label is not outside the plot area
-            x_position = 100  # Set it to 100 if it exceeds the maximum x-axis value
+    # Position the annotations at the end of the bars with a slight offset
+    x_position = min(max_x + 2, 100)  # Ensure the labels are not outside the plot area
 
-        # Add annotation to the plot
-        fig.add_annotation(
+    # Add all annotations in one layout update (add_annotation revalidates the whole layout on every call)
+    fig.update_layout(annotations=[
+        dict(
             x=x_position,
             y=genus,
             text=f'Total compounds: {total_recurrence}',
@@ -815,6 +1194,8 @@ def plot_genus_pathway_norm(output_folder):
             xanchor='left',
             yanchor='middle'
         )
+        for genus, total_recurrence in total_recurrence_per_genus.items()
+    ])
 
     # Set a white background
     fig.update_layout(plot_bgcolor='white')
@@ -824,20 +1205,22 @@ def plot_genus_pathway_norm(output_folder):
 
     # Save the figure as an HTML file
     output_html_path = os.path.join(output_folder, 'Wikidata_pathway_barplot_genus_normalized.html')
-    fig.write_html(output_html_path)
+    output_html_path = write_figure(fig, output_html_path)
 
     # Show the figure
-    fig.show()
+    if show:
+        fig.show()
 
     print(f"✅ Process completed! Visualization saved to {output_html_path}")
 
 
-def dotplot_species_superclass(output_folder):
+def dotplot_species_superclass(output_folder, show=True):
     """
     Reads .tsv files, processes species and superclass data, and generates a dot plot.
 
     Parameters:
-    - output_folder (str): Path to the folder containing 'species_data' subfolder.
+    - output_folder (str or SpeciesCorpus): Path to the folder containing 'species_data' subfolder, or a SpeciesCorpus.
+    - show (bool): Display the figure (set to False for headless batch runs).
 
     Saves the plot as an HTML file in the output folder.
     """
@@ -854,35 +1237,20 @@ def dotplot_species_superclass(output_folder):
             'Carbohydrates': '#65451F'
         }
 
-        species_data_folder = os.path.join(output_folder, 'species_data')
+        corpus = get_species_corpus(output_folder)
+        output_folder = corpus.output_folder
 
-        # Step 1: Read data from all .tsv files
-        all_data = pd.concat([
-            pd.read_csv(os.path.join(species_data_folder, filename), sep='\t')
-            for filename in os.listdir(species_data_folder) if filename.endswith(".tsv")
-        ], ignore_index=True)
+        # Step 1: Count the compounds of each species and superclass (slice of the shared count cube)
+        agg_data = corpus.recurrence('species', ['chemical_superclass'])
+        agg_data.insert(1, 'Pathway', split_chemical_superclass_column(agg_data['chemical_superclass'])['Pathway'])
+        agg_data = agg_data.sort_values(['species', 'Pathway', 'chemical_superclass'], ignore_index=True)
 
-        # Step 2: Rename columns
-        all_data.rename(columns={'organism_taxonomy_09species': 'species'}, inplace=True)
-
-        # Function to split 'chemical_superclass' into pathway and superclass
-        def split_chemical_superclass(row):
-            if isinstance(row['chemical_superclass'], str):
-                parts = row['chemical_superclass'].split('-')
-                return parts if len(parts) == 2 else [parts[0], 'Unknown']
-            return ['Unknown', 'Unknown']
-
-        # Step 3: Apply the function to split chemical superclass
-        all_data[['Pathway', 'superclass']] = all_data.apply(lambda row: split_chemical_superclass(row), axis=1, result_type='expand')
-
-        # Step 4: Process data for color mapping
+        # Step 2: Process data for color mapping
+        superclasses = corpus.first_seen('species', 'chemical_superclass')
+        pathways = split_chemical_superclass_column(superclasses)['Pathway']
         color_map = {}
-        for pathway, superclasses in all_data.groupby('Pathway')['chemical_superclass'].unique().items():
-            for superclass in superclasses:
-                color_map[f"{pathway}-{superclass}"] = pathway_shades.get(pathway, "#808080")  # Default to gray if missing
-
-        # Step 5: Group and aggregate data to calculate recurrence
-        agg_data = all_data.groupby(['species', 'Pathway', 'chemical_superclass']).size().reset_index(name='recurrence')
+        for pathway, superclass in zip(pathways, superclasses):
+            color_map[f"{pathway}-{superclass}"] = pathway_shades.get(pathway, "#808080")  # Default to gray if missing
 
         # Convert 'species' column to categorical data
         agg_data['species'] = pd.Categorical(agg_data['species'], categories=sorted(agg_data['species'].unique()), ordered=True)
@@ -891,7 +1259,7 @@ def dotplot_species_superclass(output_folder):
         unique_species = sorted(agg_data['species'].unique())
         unique_superclasses = sorted(agg_data['chemical_superclass'].unique())
 
-        # Step 6: Create a dot plot
+        # Step 3: Create a dot plot
         fig = px.scatter(
             agg_data, x='chemical_superclass', y='species', size='recurrence',
             labels={'chemical_superclass': 'Chemical Superclass', 'species': 'Species', 'recurrence': 'Recurrence'},
@@ -917,22 +1285,24 @@ def dotplot_species_superclass(output_folder):
 
         # Save the figure as an HTML file
         output_html_path = os.path.join(output_folder, 'Wikidata_sclass_dotplot_species.html')
-        fig.write_html(output_html_path)
+        output_html_path = write_figure(fig, output_html_path)
 
         # Show the figure
-        fig.show()
+        if show:
+            fig.show()
 
         print(f"✅ Dot plot successfully created and saved: {output_html_path}")
 
     except Exception as e:
         print(f"❌ An error occurred: {str(e)}")
 
-def dotplot_species_pathway(output_folder):
+def dotplot_species_pathway(output_folder, show=True):
     """
     Reads .tsv files, processes species and pathway data, and generates a dot plot.
 
     Parameters:
-    - output_folder (str): Path to the folder containing 'species_data' subfolder.
+    - output_folder (str or SpeciesCorpus): Path to the folder containing 'species_data' subfolder, or a SpeciesCorpus.
+    - show (bool): Display the figure (set to False for headless batch runs).
 
     Saves the plot as an HTML file in the output folder.
     """
@@ -949,23 +1319,11 @@ def dotplot_species_pathway(output_folder):
             'Carbohydrates': '#65451F'
         }
 
-        species_data_folder = os.path.join(output_folder, 'species_data')
-
-        # Step 1: Read data from all .tsv files
-        all_data = pd.concat([
-            pd.read_csv(os.path.join(species_data_folder, filename), sep='\t')
-            for filename in os.listdir(species_data_folder) if filename.endswith(".tsv")
-        ], ignore_index=True)
+        corpus = get_species_corpus(output_folder)
+        output_folder = corpus.output_folder
 
-        # Step 2: Rename columns
-        all_data.rename(columns={'organism_taxonomy_09species': 'species'}, inplace=True)
-        all_data.rename(columns={'structure_taxonomy_npclassifier_01pathway': 'Pathway'}, inplace=True)
-
-        # Step 3: Remove 'API Error' and 'Not Classified' from 'Pathway'
-        all_data = all_data[~all_data['Pathway'].isin(['API Error', 'Not Classified'])]
-
-        # Step 4: Group and aggregate data to calculate recurrence
-        agg_data = all_data.groupby(['species', 'Pathway']).size().reset_index(name='recurrence')
+        # Step 1: Count the compounds of each species and pathway (slice of the shared count cube)
+        agg_data = corpus.recurrence('species', ['Pathway'], exclude={'Pathway': EXCLUDED_PATHWAYS})
 
         # Convert 'species' column to categorical data
         agg_data['species'] = pd.Categorical(agg_data['species'], categories=sorted(agg_data['species'].unique()), ordered=True)
@@ -974,7 +1332,7 @@ def dotplot_species_pathway(output_folder):
         unique_species = sorted(agg_data['species'].unique())
         unique_pathways = sorted(agg_data['Pathway'].unique())
 
-        # Step 5: Create a dot plot
+        # Step 2: Create a dot plot
         fig = px.scatter(
             agg_data, x='Pathway', y='species', size='recurrence',
             labels={'Pathway': 'Pathway', 'species': 'Species', 'recurrence': 'Recurrence'},
@@ -999,10 +1357,11 @@ def dotplot_species_pathway(output_folder):
 
         # Save the figure as an HTML file
         output_html_path = os.path.join(output_folder, 'Wikidata_pathway_dotplot_species.html')
-        fig.write_html(output_html_path)
+        output_html_path = write_figure(fig, output_html_path)
 
         # Show the figure
-        fig.show()
+        if show:
+            fig.show()
 
         print(f"✅ Dot plot successfully created and saved: {output_html_path}")
 
@@ -1010,60 +1369,86 @@ def dotplot_species_pathway(output_folder):
         print(f"❌ An error occurred: {str(e)}")
 
 
-def heatmap_pathway_species(output_folder):
+def profile_matrix(agg_data, row_column, column_column, value_column):
     """
-    Reads .tsv files, processes species and pathway data, normalizes recurrence values, and generates a heatmap.
+    Builds a dense (rows x columns) matrix from long-format counts, using the factorized codes of the
+    row and column labels as indices. Missing combinations are 0.
+
+    Returns:
+    - tuple: (matrix, row labels, column labels), labels sorted alphabetically.
+    """
+    row_codes, rows = pd.factorize(agg_data[row_column], sort=True)
+    column_codes, columns = pd.factorize(agg_data[column_column], sort=True)
+    matrix = np.zeros((len(rows), len(columns)))
+    matrix[row_codes, column_codes] = agg_data[value_column].to_numpy(dtype=float)
+    return matrix, rows, columns
+
+
+def cluster_rows(matrix, decimals=0, method='average'):
+    """
+    Orders the rows of a profile matrix so that similar profiles are adjacent (hierarchical clustering).
+
+    Profiles are rounded to `decimals` and deduplicated before the linkage, so large families with many
+    identical (or nearly identical) profiles only cluster their distinct profiles. Requires scipy.
 
     Parameters:
-    - output_folder (str): Path to the folder containing 'species_data' subfolder.
+    - matrix: Profiles, one row per taxon.
+    - decimals: Rounding applied to the profiles before deduplication (0 = 1 % steps for percentages).
+    - method: Linkage method passed to scipy.cluster.hierarchy.linkage.
 
-    Saves the heatmap as an HTML file in the output folder.
+    Returns:
+    - np.ndarray: Row positions in clustered order.
     """
+    from scipy.cluster.hierarchy import linkage, leaves_list
 
-    try:
-        species_data_folder = os.path.join(output_folder, 'species_data')
+    profiles, inverse = np.unique(np.round(matrix, decimals), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    if len(profiles) < 2:
+        return np.arange(len(matrix))
 
-        # Step 1: Read data from all .tsv files
-        all_data = pd.concat([
-            pd.read_csv(os.path.join(species_data_folder, filename), sep='\t')
-            for filename in os.listdir(species_data_folder) if filename.endswith(".tsv")
-        ], ignore_index=True)
+    # Rank of each distinct profile in the dendrogram, rows sharing a profile stay in their original order
+    leaf_rank = np.empty(len(profiles), dtype=np.int64)
+    leaf_rank[leaves_list(linkage(profiles, method=method))] = np.arange(len(profiles))
+    return np.argsort(leaf_rank[inverse], kind='stable')
 
-        # Step 2: Rename columns
-        all_data.rename(columns={'organism_taxonomy_09species': 'species'}, inplace=True)
-        all_data.rename(columns={'structure_taxonomy_npclassifier_01pathway': 'Pathway'}, inplace=True)
 
-        # Step 3: Remove 'API Error' and 'Not Classified' from 'Pathway'
-        all_data = all_data[~all_data['Pathway'].isin(['API Error', 'Not Classified'])]
+def heatmap_pathway_species(output_folder, cluster=False, show=True):
+    """
+    Reads .tsv files, processes species and pathway data, normalizes recurrence values, and generates a heatmap.
 
-        # Step 4: Group and aggregate data to calculate recurrence
-        agg_data = all_data.groupby(['species', 'Pathway']).size().reset_index(name='recurrence')
+    Parameters:
+    - output_folder (str or SpeciesCorpus): Path to the folder containing 'species_data' subfolder, or a SpeciesCorpus.
+    - cluster (bool): Order the species by chemical profile similarity (hierarchical clustering, needs scipy)
+      instead of alphabetically.
+    - show (bool): Display the figure (set to False for headless batch runs).
 
-        # Step 5: Normalize the recurrence values within each species group
-        agg_data['recurrence_normalized'] = agg_data.groupby('species')['recurrence'].transform(lambda x: x / x.sum()) * 100
+    Saves the heatmap as an HTML file in the output folder.
+    """
 
-        # Convert 'species' column to categorical data
-        agg_data['species'] = pd.Categorical(agg_data['species'], categories=sorted(agg_data['species'].unique()), ordered=True)
+    try:
+        corpus = get_species_corpus(output_folder)
+        output_folder = corpus.output_folder
 
-        # Get unique species names and pathways
-        unique_species = sorted(agg_data['species'].unique())
-        unique_pathways = sorted(agg_data['Pathway'].unique())
+        # Step 1: Count the compounds of each species and pathway (slice of the shared count cube)
+        agg_data = corpus.recurrence('species', ['Pathway'], exclude={'Pathway': EXCLUDED_PATHWAYS})
 
-        # Step 6: Create a DataFrame with all possible combinations of species and pathways
-        all_combinations = pd.DataFrame([(species, pathway) for species in unique_species for pathway in unique_pathways],
-                                        columns=['species', 'Pathway'])
+        # Step 2: Normalize the recurrence values within each species group
+        agg_data['recurrence_normalized'] = agg_data['recurrence'] / agg_data.groupby('species', observed=True)['recurrence'].transform('sum') * 100
 
-        # Merge the all_combinations DataFrame with the aggregated data to include all species
-        merged_data = pd.merge(all_combinations, agg_data, on=['species', 'Pathway'], how='left')
+        # Step 3: Build the species x pathway matrix (missing combinations are 0)
+        matrix, unique_species, unique_pathways = profile_matrix(agg_data, 'species', 'Pathway', 'recurrence_normalized')
 
-        # Fill missing values (NaN) with 0 for recurrence and recurrence_normalized columns
-        merged_data['recurrence'].fillna(0, inplace=True)
-        merged_data['recurrence_normalized'].fillna(0, inplace=True)
+        # Step 4: Optionally order the species by similarity of their chemical profiles
+        if cluster:
+            try:
+                order = cluster_rows(matrix)
+                matrix, unique_species = matrix[order], unique_species[order]
+            except ImportError:
+                print("⚠️ scipy is not installed, species are kept in alphabetical order")
 
-        # Step 7: Pivot the merged data to have 'species' as rows and 'Pathway' as columns
-        pivot_data = merged_data.pivot_table(index='species', columns='Pathway', values='recurrence_normalized', fill_value=0)
+        pivot_data = pd.DataFrame(matrix, index=pd.Index(unique_species, name='species'), columns=pd.Index(unique_pathways, name='Pathway'))
 
-        # Step 8: Create the heatmap
+        # Step 5: Create the heatmap
         fig = px.imshow(
             pivot_data,
             labels=dict(x="Pathway", y="Species", color="Normalized Recurrence (%)"),
@@ -1088,13 +1473,97 @@ def heatmap_pathway_species(output_folder):
 
         # Save the figure as an HTML file
         output_html_path = os.path.join(output_folder, 'Wikidata_pathway_heatmap_species_normalized.html')
-        fig.write_html(output_html_path)
+        output_html_path = write_figure(fig, output_html_path)
 
         # Show the figure
-        fig.show()
+        if show:
+            fig.show()
 
         print(f"✅ Heatmap successfully created and saved: {output_html_path}")
 
     except Exception as e:
         print(f"❌ An error occurred: {str(e)}")
 
+
+# Figures built by render_all_figures: function name and the extra positional arguments it expects
+BATCH_FIGURES = [
+    ('plot_species_superclass', ('split_chemical_superclass', 'generate_shades')),
+    ('plot_species_superclass_norm', ('split_chemical_superclass', 'generate_shades')),
+    ('plot_species_pathway', ()),
+    ('plot_species_pathway_norm', ()),
+    ('plot_genus_superclass', ('generate_shades',)),
+    ('plot_genus_superclass_norm', ('generate_shades',)),
+    ('plot_genus_pathway', ()),
+    ('plot_genus_pathway_norm', ()),
+    ('dotplot_species_superclass', ()),
+    ('dotplot_species_pathway', ()),
+    ('heatmap_pathway_species', ()),
+]
+
+
+def _render_figure(output_folder, name, export):
+    # Build and save one figure without display, timing the build and the writes separately
+    configure_figure_export(**export)
+    del _WRITE_TIMINGS[:]
+    error = None
+    start = time.perf_counter()
+    try:
+        args = [globals()[arg] for arg in dict(BATCH_FIGURES)[name]]
+        globals()[name](output_folder, *args, show=False)
+    except Exception as e:
+        error = str(e)
+    total = time.perf_counter() - start
+    write = sum(seconds for _, seconds in _WRITE_TIMINGS)
+    return {'figure': name, 'build_s': total - write, 'write_s': write,
+            'files': [path for path, _ in _WRITE_TIMINGS], 'error': error}
+
+
+def render_all_figures(output_folder, workers=None, shared_plotlyjs=True, compress=False, image_formats=(), figures=None):
+    """
+    Builds and saves all figures of an output folder without displaying them (headless batch mode).
+
+    Parameters:
+    - output_folder: Path to the folder containing the 'species_data' and 'genus_data' subfolders.
+    - workers: Number of worker processes building the figures in parallel (None builds them in this process).
+    - shared_plotlyjs, compress, image_formats: Export settings, see configure_figure_export.
+      Static image export needs the kaleido package; without it image_formats is ignored.
+    - figures: Names of the figures to build (defaults to all of BATCH_FIGURES).
+
+    Returns:
+    - pd.DataFrame: Build and write time (s), written files and error of each figure.
+    """
+    if image_formats:
+        try:
+            import kaleido  # noqa: F401
+        except ImportError:
+            print("⚠️ kaleido is not installed, static images are skipped")
+            image_formats = ()
+    export = {'shared_plotlyjs': shared_plotlyjs, 'compress': compress, 'image_formats': tuple(image_formats)}
+    names = [name for name, _ in BATCH_FIGURES if figures is None or name in figures]
+
+    # Build (or refresh) the persisted count cube and the shared plotly.min.js once, before the workers start
+    cube = get_species_corpus(output_folder).count_cube()
+    if workers is not None and workers > 1:
+        # Register the new superclasses here, so the workers only read the persisted color table
+        split = split_chemical_superclass_column(cube['chemical_superclass'].drop_duplicates())
+        get_superclass_palette().color_map(zip(split['Pathway'], split['superclass']))
+    if shared_plotlyjs:
+        write_plotlyjs(output_folder)
+
+    start = time.perf_counter()
+    previous_export = dict(FIGURE_EXPORT)
+    try:
+        if workers is None or workers <= 1:
+            timings = [_render_figure(output_folder, name, export) for name in names]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                timings = list(executor.map(_render_figure, [output_folder] * len(names), names, [export] * len(names)))
+    finally:
+        configure_figure_export(**previous_export)
+
+    timings = pd.DataFrame(timings)
+    for row in timings.itertuples():
+        status = f"❌ {row.error}" if row.error else f"{len(row.files)} file(s)"
+        print(f"{row.figure:<30} build {row.build_s:6.2f}s  write {row.write_s:6.2f}s  {status}")
+    print(f"✅ {len(timings)} figures rendered in {time.perf_counter() - start:.1f}s ({output_folder})")
+    return timings
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+# Taxonomy levels of the rollup and the LOTUS column naming their taxa, from the species up
+ROLLUP_LEVELS = {
+    'species': 'wikidata_Qcode',
+    'genus': 'organism_taxonomy_08genus',
+    'tribe': 'organism_taxonomy_07tribe',
+    'family': 'organism_taxonomy_06family',
+    'order': 'organism_taxonomy_05order'
+}
+
+# Summary of the rollup written next to Full_results.csv
+ROLLUP_FILENAME = 'taxonomy_rollup.tsv'
+
+
+class CompoundRollup:
+    """
+    Distinct compounds of every taxon of the species, genus, tribe, family and order levels.
+
+    InChIKeys are mapped to integer compound ids once. The species compound sets are the distinct
+    (species, compound) pairs of the LOTUS rows; every higher level is the union of the sets of its
+    species, computed as the distinct (taxon, compound) pairs of the species pairs. Each set is stored
+    as a sorted run of compound ids, so counts are exact and no level goes back to the LOTUS rows.
+    """
+
+    def __init__(self, lotusdb_df, levels=ROLLUP_LEVELS):
+        """
+        Parameters:
+        - lotusdb_df: LOTUS rows holding 'structure_inchikey' and the columns of the levels.
+        - levels: Level name → LOTUS column, the first one being the species level.
+        """
+        species_level, species_column = next(iter(levels.items()))
+        rows = lotusdb_df.dropna(subset=[species_column, 'structure_inchikey'])
+
+        # Step 1: Integer ids of the compounds and the species
+        compound_ids, self.inchikeys = pd.factorize(rows['structure_inchikey'].to_numpy(dtype=object))
+        species_ids, species = pd.factorize(rows[species_column].to_numpy(dtype=object))
+        self.n_compounds = len(self.inchikeys)
+
+        # Step 2: Species compound sets, the one pass over the rows
+        pair_species, pair_compounds = self._distinct_pairs(species_ids, compound_ids)
+        self.levels = {species_level: (pd.Index(species), pair_species, pair_compounds, np.ones(len(species), dtype=np.int64))}
+
+        # Step 3: Union of the species sets for every higher level (lineage of each species taken from its first row)
+        _, first_rows = np.unique(species_ids, return_index=True)
+        for level, column in list(levels.items())[1:]:
+            taxon_of_species, taxa = pd.factorize(rows[column].to_numpy(dtype=object)[first_rows])
+            mapped = taxon_of_species[pair_species]
+            valid = mapped >= 0
+            pair_taxa, pair_taxon_compounds = self._distinct_pairs(mapped[valid], pair_compounds[valid])
+            n_species = np.bincount(taxon_of_species[taxon_of_species >= 0], minlength=len(taxa))
+            self.levels[level] = (pd.Index(taxa), pair_taxa, pair_taxon_compounds, n_species)
+
+        # NPClassifier categories of every compound (first non-null value)
+        self._compound_rows = rows.assign(_compound=compound_ids)
+
+    def _distinct_pairs(self, taxon_ids, compound_ids):
+        # Distinct (taxon, compound) pairs sorted by taxon then compound, via one int64 key per pair
+        keys = np.unique(taxon_ids.astype(np.int64) * max(self.n_compounds, 1) + compound_ids)
+        return keys // max(self.n_compounds, 1), keys % max(self.n_compounds, 1)
+
+    def compound_counts(self, level):
+        """Returns the number of distinct compounds of every taxon of a level."""
+        taxa, pair_taxa, _, _ = self.levels[level]
+        return pd.Series(np.bincount(pair_taxa, minlength=len(taxa)), index=taxa, name='compounds')
+
+    def compounds(self, level, taxon):
+        """Returns the InChIKeys of a taxon."""
+        taxa, pair_taxa, pair_compounds, _ = self.levels[level]
+        position = taxa.get_loc(taxon)
+        start, stop = np.searchsorted(pair_taxa, [position, position + 1])
+        return self.inchikeys[pair_compounds[start:stop]]
+
+    def class_counts(self, level, column='structure_taxonomy_npclassifier_01pathway'):
+        """
+        Counts the distinct compounds of every taxon of a level per chemical category.
+
+        Returns:
+        - pd.DataFrame: Columns level, column and 'recurrence'.
+        """
+        taxa, pair_taxa, pair_compounds, _ = self.levels[level]
+        categories = self._compound_rows.groupby('_compound')[column].first().reindex(np.arange(self.n_compounds))
+        counts = pd.DataFrame({level: taxa[pair_taxa], column: categories.to_numpy()[pair_compounds]})
+        return counts.groupby([level, column]).size().reset_index(name='recurrence')
+
+    def summary(self):
+        """
+        Returns the size of every taxon of every level.
+
+        Returns:
+        - pd.DataFrame: Columns 'level', 'taxon', 'species' (number of species with compounds) and
+          'compounds' (number of distinct compounds).
+        """
+        frames = []
+        for level, (taxa, pair_taxa, _, n_species) in self.levels.items():
+            frames.append(pd.DataFrame({'level': level, 'taxon': taxa, 'species': n_species,
+                                        'compounds': np.bincount(pair_taxa, minlength=len(taxa))}))
+        return pd.concat(frames, ignore_index=True)
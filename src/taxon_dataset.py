@@ -0,0 +1,216 @@
+import os
+import re
+import json
+import numpy as np
+import pandas as pd
+
+# Manifest of a dataset folder, same name and 'taxa' layout as the manifest of the per-taxon TSV folders
+DATASET_MANIFEST_FILENAME = 'manifest.json'
+
+# Column holding the taxon (Q code or genus) of every row of a dataset
+TAXON_COLUMN = 'taxon'
+
+# Number of rows per Parquet row group; parts are sorted by taxon, so a taxon filter skips the other groups
+DATASET_ROW_GROUP_SIZE = 10000
+
+# Name of the Parquet files of a dataset
+PART_PATTERN = re.compile(r'part-(\d+)\.parquet$')
+
+
+def taxon_dataset_path(output_folder, level='species'):
+    """
+    Returns the dataset folder of a taxon level of an output folder.
+
+    Parameters:
+    - output_folder: Folder receiving the results (the one holding 'species_data' and 'genus_data').
+    - level: 'species' or 'genus'.
+
+    Returns:
+    str: Path of the dataset folder (e.g. '<output_folder>/species_dataset').
+    """
+    return os.path.join(output_folder, f'{level}_dataset')
+
+
+def read_dataset_manifest(folder):
+    """Reads the manifest of a dataset folder, or returns None when the folder is not a dataset."""
+    manifest_path = os.path.join(folder, DATASET_MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as handle:
+        manifest = json.load(handle)
+    return manifest if manifest.get('format') == 'parquet' else None
+
+
+def is_taxon_dataset(folder):
+    """Tells whether a folder holds a taxon dataset (rather than per-taxon TSV files)."""
+    return read_dataset_manifest(folder) is not None
+
+
+def _write_part(folder, frame, part_number, row_group_size):
+    # Write the rows of one run as a new part, sorted by taxon so every row group covers a narrow taxon range
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    frame = frame.sort_values(TAXON_COLUMN, kind='mergesort').reset_index(drop=True)
+    filename = f'part-{part_number:05d}.parquet'
+    path = os.path.join(folder, filename)
+    pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), path + '.tmp',
+                   row_group_size=row_group_size, write_statistics=True)
+    os.replace(path + '.tmp', path)
+    return filename
+
+
+def _save_manifest(folder, manifest):
+    manifest_path = os.path.join(folder, DATASET_MANIFEST_FILENAME)
+    with open(manifest_path + '.tmp', 'w') as handle:
+        json.dump(manifest, handle, indent=1)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def write_taxon_dataset(tables, folder, input_hashes=None, spec_version=None, row_group_size=DATASET_ROW_GROUP_SIZE):
+    """
+    Writes the tables of many taxa as one columnar dataset and updates its manifest.
+
+    Every call writes a single Parquet part holding the rows of all its taxa, with a TAXON_COLUMN
+    column (no part when none of them has rows). The manifest points every taxon to the part holding
+    its current rows, or to no part ('file' None, 'rows' 0) when it has none, so rewriting a taxon
+    supersedes its older rows; parts without current rows are removed, and the dataset is
+    compacted into one part once most of its rows are superseded.
+
+    Parameters:
+    - tables: Dictionary mapping the taxon (Q code or genus) to its grouped DataFrame.
+    - folder: Dataset folder (see taxon_dataset_path).
+    - input_hashes: Hash of the LOTUS input rows per taxon, recorded in the manifest for incremental reruns.
+    - spec_version: Aggregation spec version recorded with the input hashes.
+    - row_group_size: Number of rows per Parquet row group.
+
+    Returns:
+    dict: Manifest entries ({'file', 'rows'}) of the taxa written.
+    """
+    os.makedirs(folder, exist_ok=True)
+    manifest = read_dataset_manifest(folder) or {'format': 'parquet', 'columns': None, 'parts': {}, 'taxa': {}}
+    if not tables:
+        return {}
+
+    # Step 1: One part with the rows of every taxon of this call (none when no taxon has rows)
+    columns = list(next(iter(tables.values())).columns)
+    frames = [grouped_df.assign(**{TAXON_COLUMN: taxon}) for taxon, grouped_df in tables.items() if len(grouped_df)]
+    numbers = [int(PART_PATTERN.match(name).group(1)) for name in os.listdir(folder) if PART_PATTERN.match(name)]
+    filename = None
+    if frames:
+        frame = pd.concat(frames, ignore_index=True)[[TAXON_COLUMN] + columns]
+        filename = _write_part(folder, frame, max(numbers, default=-1) + 1, row_group_size)
+        manifest['parts'][filename] = len(frame)
+
+    # Step 2: Point the taxa to the new part; taxa without rows point to no part
+    entries = {}
+    for taxon, grouped_df in tables.items():
+        entries[taxon] = {'file': filename if len(grouped_df) else None, 'rows': len(grouped_df)}
+        if input_hashes is not None:
+            entries[taxon].update(input_hash=input_hashes[taxon], spec_version=spec_version)
+    manifest['taxa'].update(entries)
+    manifest['columns'] = columns
+
+    # Step 3: Drop the parts whose rows were all superseded, compact when most rows are
+    # (the manifest is saved before any file is removed, so readers never see a missing part)
+    live = {}
+    for entry in manifest['taxa'].values():
+        if entry['file'] is not None:
+            live[entry['file']] = live.get(entry['file'], 0) + entry['rows']
+    superseded = [part for part in manifest['parts'] if part not in live]
+    for part in superseded:
+        del manifest['parts'][part]
+    _save_manifest(folder, manifest)
+    if len(manifest['parts']) > 1 and sum(manifest['parts'].values()) > 2 * sum(live.values()):
+        compacted = read_taxon_dataset(folder)
+        filename = _write_part(folder, compacted, max(numbers, default=-1) + 2, row_group_size)
+        superseded += list(manifest['parts'])
+        for entry in manifest['taxa'].values():
+            if entry['file'] is not None:
+                entry['file'] = filename
+        manifest['parts'] = {filename: len(compacted)}
+        _save_manifest(folder, manifest)
+    for part in superseded:
+        os.remove(os.path.join(folder, part))
+    return {taxon: manifest['taxa'][taxon] for taxon in entries}
+
+
+def read_taxon_dataset(folder, taxa=None, columns=None):
+    """
+    Reads the rows of some or all taxa of a dataset.
+
+    Only the requested columns are read, and a taxon filter is pushed down to the Parquet reader so
+    the row groups of other taxa are skipped.
+
+    Parameters:
+    - folder: Dataset folder.
+    - taxa: Taxa to read. Defaults to all taxa.
+    - columns: Columns to read besides TAXON_COLUMN. Defaults to all columns.
+
+    Returns:
+    pd.DataFrame: TAXON_COLUMN and the requested columns, taxa in manifest order (the order they were
+    first written) and rows in their original order within each taxon.
+    """
+    import pyarrow.parquet as pq
+
+    manifest = read_dataset_manifest(folder)
+    if manifest is None:
+        raise FileNotFoundError(f"{folder} is not a taxon dataset (no parquet manifest)")
+    columns = [TAXON_COLUMN] + list(manifest['columns'] if columns is None else columns)
+    order = list(manifest['taxa']) if taxa is None else [taxon for taxon in dict.fromkeys(taxa) if taxon in manifest['taxa']]
+
+    # Step 1: Current taxa of every part (taxa without rows are in no part)
+    taxa_per_part = {}
+    for taxon in order:
+        if manifest['taxa'][taxon]['rows']:
+            taxa_per_part.setdefault(manifest['taxa'][taxon]['file'], []).append(taxon)
+
+    # Step 2: Read each part with the taxon filter pushed down
+    frames = [
+        pq.read_table(os.path.join(folder, part), columns=columns, filters=[(TAXON_COLUMN, 'in', part_taxa)]).to_pandas()
+        for part, part_taxa in taxa_per_part.items()
+    ]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    frame = pd.concat(frames, ignore_index=True)
+
+    # Step 3: Taxa in manifest order (stable, so rows keep their order inside a taxon)
+    positions = pd.Index(order).get_indexer(frame[TAXON_COLUMN])
+    return frame.iloc[np.argsort(positions, kind='mergesort')].reset_index(drop=True)
+
+
+def read_taxon_tables(folder, columns=None):
+    """
+    Returns the concatenated tables of a per-taxon folder, either a dataset or a folder of TSV files.
+
+    Parameters:
+    - folder: Dataset folder or folder of per-taxon TSV files.
+    - columns: Columns to read. Defaults to all columns.
+
+    Returns:
+    pd.DataFrame: The rows of all taxa (without TAXON_COLUMN).
+    """
+    if is_taxon_dataset(folder):
+        return read_taxon_dataset(folder, columns=columns).drop(columns=TAXON_COLUMN)
+    return pd.concat([pd.read_csv(os.path.join(folder, filename), sep='\t', usecols=columns)
+                      for filename in os.listdir(folder) if filename.endswith(".tsv")])
+
+
+def taxon_tables(folder, taxa=None):
+    """
+    Returns the table of every taxon of a dataset, like the per-taxon TSV files.
+
+    Parameters:
+    - folder: Dataset folder.
+    - taxa: Taxa to return. Defaults to all taxa.
+
+    Returns:
+    dict: Taxon → DataFrame of its rows (empty, with the dataset columns, for taxa without rows).
+    """
+    manifest = read_dataset_manifest(folder)
+    frame = read_taxon_dataset(folder, taxa=taxa)
+    grouped = {taxon: group.drop(columns=TAXON_COLUMN).reset_index(drop=True)
+               for taxon, group in frame.groupby(TAXON_COLUMN, sort=False)}
+    empty_df = frame.drop(columns=TAXON_COLUMN).iloc[0:0]
+    taxa = list(manifest['taxa']) if taxa is None else [taxon for taxon in taxa if taxon in manifest['taxa']]
+    return {taxon: grouped.get(taxon, empty_df) for taxon in taxa}
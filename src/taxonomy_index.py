@@ -0,0 +1,279 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from http_cache import cached_get
+from lotus_store import LotusDB, load_lotus
+
+# LOTUS lineage columns, from the root down
+TAXONOMY_COLUMNS = [
+    "organism_taxonomy_01domain",
+    "organism_taxonomy_02kingdom",
+    "organism_taxonomy_03phylum",
+    "organism_taxonomy_04class",
+    "organism_taxonomy_05order",
+    "organism_taxonomy_06family",
+    "organism_taxonomy_07tribe",
+    "organism_taxonomy_08genus",
+    "organism_taxonomy_09species",
+    "organism_taxonomy_10varietas"
+]
+
+# Rank of the taxa returned by descendant queries (Wikidata Q7432, as in the P105 filter of the SPARQL query)
+SPECIES_RANK = 'species'
+WIKIDATA_RANKS = {'Q7432': 'species', 'Q34740': 'genus', 'Q35409': 'family', 'Q36602': 'order', 'Q37517': 'class',
+                  'Q38348': 'phylum', 'Q36732': 'kingdom', 'Q146481': 'domain', 'Q227936': 'tribe', 'Q767728': 'varietas'}
+
+# Bump when the layout of the persisted index changes, so persisted indexes are rebuilt
+TAXONOMY_INDEX_VERSION = 1
+
+# Separator of the lineage paths identifying the LOTUS taxa (homonyms in other lineages stay apart)
+_PATH_SEPARATOR = '\x1f'
+
+
+def taxonomy_index_path(lotusdb_path):
+    """Returns the path of the persisted taxonomy index of a LOTUS metadata CSV."""
+    return os.path.splitext(lotusdb_path)[0] + '_taxonomy.parquet'
+
+
+def _preorder_intervals(parent):
+    # Nested-set intervals of a forest given as parent indices (-1 for roots): the pre-order position
+    # of every node and the position after its last descendant, so descendants are [start, stop)
+    n_nodes = len(parent)
+    has_parent = parent >= 0
+    children = np.argsort(np.where(has_parent, parent, n_nodes), kind='stable')
+    offsets = np.zeros(n_nodes + 2, dtype=np.int64)
+    np.cumsum(np.bincount(np.where(has_parent, parent, n_nodes), minlength=n_nodes + 1), out=offsets[1:])
+
+    # Depth-first walk with an explicit stack, children pushed in reverse to keep their order
+    order = np.empty(n_nodes, dtype=np.int64)
+    visited = np.zeros(n_nodes, dtype=bool)
+    stack = list(children[offsets[n_nodes]:offsets[n_nodes + 1]][::-1])
+    position = 0
+    while stack:
+        node = stack.pop()
+        if visited[node]:
+            continue  # Cycles in a taxon dump are cut where they close
+        visited[node] = True
+        order[position] = node
+        position += 1
+        stack.extend(children[offsets[node]:offsets[node + 1]][::-1])
+
+    # Nodes only reachable through a cycle have no root, they are left out of every interval
+    order = order[:position]
+    size = np.ones(n_nodes, dtype=np.int64)
+    for node in order[::-1]:
+        if parent[node] >= 0 and visited[parent[node]]:
+            size[parent[node]] += size[node]
+    start = np.full(n_nodes, -1, dtype=np.int64)
+    start[order] = np.arange(position)
+    return start, np.where(start >= 0, start + size, -1)
+
+
+class TaxonomyIndex:
+    """
+    Local taxonomy with nested-set (Euler-tour) intervals, answering "all species under taxon X"
+    without the transitive P171* SPARQL query.
+
+    Every taxon gets the pre-order position of the depth-first walk of the taxonomy and the position
+    after its last descendant. The species under a taxon are then the species whose position falls
+    in that interval: a dictionary lookup and one binary search on the sorted species positions.
+
+    Build it from the LOTUS lineage columns (from_lotus) or from a Wikidata taxon dump
+    (from_wikidata_dump). Use get_taxonomy_index() to obtain the persisted index of a LOTUS file.
+    """
+
+    def __init__(self, nodes):
+        """
+        Parameters:
+        - nodes: DataFrame with one row per taxon: 'qcode' (may be missing), 'name', 'rank' and 'parent'
+          (row position of the parent taxon, -1 for roots). 'start'/'stop' are computed when absent.
+        """
+        nodes = nodes.reset_index(drop=True)
+        if 'start' not in nodes.columns:
+            start, stop = _preorder_intervals(nodes['parent'].to_numpy(dtype=np.int64))
+            nodes = nodes.assign(start=start, stop=stop)
+        self.nodes = nodes
+
+        # Q code and name → taxa
+        with_qcode = nodes[nodes['qcode'].notna()]
+        self._by_qcode = dict(zip(with_qcode['qcode'], with_qcode.index))
+        self._by_name = nodes.groupby('name', sort=False).indices
+
+        # Species with a Q code, sorted by pre-order position
+        species = nodes[(nodes['rank'] == SPECIES_RANK) & nodes['qcode'].notna() & (nodes['start'] >= 0)]
+        species = species.sort_values('start', kind='stable')
+        self._species_start = species['start'].to_numpy()
+        self._species = pd.DataFrame({'wikidata_Qcode': species['qcode'].to_numpy(dtype=object),
+                                      'Species': species['name'].to_numpy(dtype=object)})
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @classmethod
+    def from_lotus(cls, lotusdb_path):
+        """
+        Builds the index from the lineage columns of the LOTUS metadata.
+
+        Every distinct lineage prefix (domain, kingdom, ..., varietas; missing ranks are skipped) is a
+        taxon; an organism's 'wikidata_Qcode' is the Q code of its lowest rank.
+
+        Parameters:
+        - lotusdb_path: Path to the LOTUSDB CSV file, or a LotusDB handle.
+        """
+        organisms = load_lotus(lotusdb_path, columns=['wikidata_Qcode'] + TAXONOMY_COLUMNS)
+        organisms = organisms.dropna(subset=['wikidata_Qcode']).drop_duplicates('wikidata_Qcode')
+
+        # Step 1: One node per lineage prefix, its parent being the prefix of the nearest ranked ancestor
+        path = pd.Series('', index=organisms.index, dtype=object)
+        frames = []
+        for column in TAXONOMY_COLUMNS:
+            names = organisms[column]
+            present = names.notna() & (names.astype(str) != '')
+            child_path = path.where(~present, path + _PATH_SEPARATOR + names.astype(str))
+            frames.append(pd.DataFrame({'path': child_path[present], 'parent_path': path[present],
+                                        'name': names[present].astype(str), 'rank': column.split('_')[-1][2:]}))
+            path = child_path
+        nodes = pd.concat(frames, ignore_index=True).drop_duplicates('path').reset_index(drop=True)
+
+        # Step 2: Parent positions and the Q code of the organisms sitting on each node
+        positions = pd.Series(np.arange(len(nodes)), index=nodes['path'])
+        nodes['parent'] = nodes['parent_path'].map(positions).fillna(-1).astype(np.int64)
+        qcodes = pd.Series(organisms['wikidata_Qcode'].to_numpy(), index=path.to_numpy())
+        nodes['qcode'] = nodes['path'].map(qcodes[~qcodes.index.duplicated()])
+        return cls(nodes[['qcode', 'name', 'rank', 'parent']])
+
+    @classmethod
+    def from_wikidata_dump(cls, dump_path):
+        """
+        Builds the index from a local Wikidata taxon dump.
+
+        Parameters:
+        - dump_path: CSV/TSV with the columns 'taxon' (Q code), 'parent' (Q code of its P171 parent
+          taxon), 'rank' (P105 Q code or rank name) and 'name' (P225 taxon name). Taxa with several
+          parents keep the first one.
+        """
+        sep = '\t' if dump_path.endswith(('.tsv', '.tsv.gz')) else ','
+        dump = pd.read_csv(dump_path, sep=sep, usecols=['taxon', 'parent', 'rank', 'name'], dtype=str)
+        dump = dump.drop_duplicates('taxon').reset_index(drop=True)
+        positions = pd.Series(np.arange(len(dump)), index=dump['taxon'])
+        return cls(pd.DataFrame({
+            'qcode': dump['taxon'],
+            'name': dump['name'],
+            'rank': dump['rank'].map(lambda rank: WIKIDATA_RANKS.get(rank, rank)),
+            'parent': dump['parent'].map(positions).fillna(-1).astype(np.int64)
+        }))
+
+    def taxa(self, qcode, resolve_name=True):
+        """
+        Returns the row positions of the taxa of a Q code.
+
+        A Q code without a LOTUS organism (e.g. a family) is looked up by its taxon name (P225,
+        fetched once through the HTTP cache); homonyms in other lineages are all returned.
+        """
+        if qcode in self._by_qcode:
+            return [self._by_qcode[qcode]]
+        if not resolve_name:
+            return []
+        name = fetch_taxon_name(qcode)
+        return list(self._by_name.get(name, [])) if name is not None else []
+
+    def descendant_species(self, qcode, resolve_name=True):
+        """
+        Returns the species under a taxon (the taxon included when it is a species).
+
+        Parameters:
+        - qcode: Wikidata Q code of the taxon.
+        - resolve_name: Look the taxon name up on Wikidata when the Q code is not in the index.
+
+        Returns:
+        - pd.DataFrame: 'wikidata_Qcode' and 'Species' columns, like fetch_species_from_qcode, or None
+          when the taxon is not in the index.
+        """
+        taxa = self.taxa(qcode, resolve_name=resolve_name)
+        if not taxa:
+            return None
+        if len(taxa) > 1:
+            print(f"⚠️ {qcode} matches {len(taxa)} taxa with the same name, returning the species of all of them.")
+
+        slices = []
+        for taxon in taxa:
+            start, stop = self.nodes.at[taxon, 'start'], self.nodes.at[taxon, 'stop']
+            first, last = np.searchsorted(self._species_start, [start, stop])
+            slices.append(self._species.iloc[first:last])
+        return pd.concat(slices, ignore_index=True).drop_duplicates('wikidata_Qcode').reset_index(drop=True)
+
+    def save(self, path, signature=None):
+        """Persists the index as Parquet, with an optional signature of its sources in the metadata."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(self.nodes, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), 'yggdrasil': json.dumps(signature)})
+        pq.write_table(table, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, signature=None):
+        """Loads a persisted index, or returns None when missing or built from other sources."""
+        import pyarrow.parquet as pq
+
+        if not os.path.exists(path):
+            return None
+        table = pq.read_table(path)
+        if json.loads((table.schema.metadata or {}).get(b'yggdrasil', b'null')) != signature:
+            return None
+        return cls(table.to_pandas())
+
+
+def fetch_taxon_name(qcode):
+    """
+    Returns the taxon name (P225) of a Wikidata item, or None.
+
+    A single-item lookup, unlike the transitive P171* query it replaces.
+    """
+    query = "SELECT ?name WHERE { wd:%s wdt:P225 ?name . }" % qcode
+    headers = {"User-Agent": "Wikidata Species Fetcher/0.1 (https://www.wikidata.org/wiki/Wikidata:Data_access)"}
+    response = cached_get("https://query.wikidata.org/sparql", headers=headers, params={'query': query, 'format': 'json'})
+    if response.status_code != 200:
+        print(f"⚠️ Could not fetch the taxon name of {qcode}: HTTP status code {response.status_code}")
+        return None
+    bindings = response.json()['results']['bindings']
+    return bindings[0]['name']['value'] if bindings else None
+
+
+# Indexes shared across calls, keyed by LOTUS path and taxon dump
+_INDEXES = {}
+
+
+def get_taxonomy_index(lotusdb_path, wikidata_dump=None):
+    """
+    Returns the taxonomy index of a LOTUS file (or of a Wikidata taxon dump), built once and persisted
+    next to the CSV as <name>_taxonomy.parquet. It is rebuilt when the LOTUS file or the dump change.
+
+    Parameters:
+    - lotusdb_path: Path to the LOTUSDB CSV file.
+    - wikidata_dump: Optional Wikidata taxon dump (see TaxonomyIndex.from_wikidata_dump), used instead
+      of the LOTUS lineages.
+
+    Returns:
+    - TaxonomyIndex: The index.
+    """
+    signature = {
+        'version': TAXONOMY_INDEX_VERSION,
+        'lotus': list(LotusDB.file_signature(lotusdb_path)),
+        'dump': list((os.stat(wikidata_dump).st_mtime, os.stat(wikidata_dump).st_size)) if wikidata_dump else None
+    }
+    key = (os.path.abspath(lotusdb_path), wikidata_dump and os.path.abspath(wikidata_dump))
+    cached = _INDEXES.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    path = taxonomy_index_path(lotusdb_path) if wikidata_dump is None else os.path.splitext(wikidata_dump)[0] + '_index.parquet'
+    index = TaxonomyIndex.load(path, signature)
+    if index is None:
+        index = TaxonomyIndex.from_wikidata_dump(wikidata_dump) if wikidata_dump else TaxonomyIndex.from_lotus(lotusdb_path)
+        index.save(path, signature)
+        print(f"✅ Taxonomy index written to {path} ({len(index)} taxa)")
+    _INDEXES[key] = (signature, index)
+    return index
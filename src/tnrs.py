@@ -0,0 +1,156 @@
+import time
+import json
+import random
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from http_cache import HTTPCache, get_http_cache
+
+# OpenTree TNRS endpoint resolving taxon names to OTT IDs
+MATCH_NAMES_URL = "https://api.opentreeoflife.org/v3/tnrs/match_names"
+
+# Seconds allowed to one match_names request before it is retried
+REQUEST_TIMEOUT = 60
+
+# HTTP status codes that are retried with exponential backoff
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Asynchronous token-bucket rate limiter.
+
+    Tokens are refilled continuously at `rate` per second up to `capacity`; every request consumes one,
+    so short bursts of up to `capacity` requests are allowed while the long-run rate stays bounded.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _ott_ids_of(text):
+    # OTT ID of the first match of every name of a match_names response
+    return {
+        result['name']: result['matches'][0]['taxon']['ott_id'] if result['matches'] else None
+        for result in json.loads(text)['results']
+    }
+
+
+async def _match_batch(session, url, names, bucket, max_retries, backoff, cache):
+    # Resolve one batch of names through the HTTP cache, retrying on rate limiting and server errors.
+    # The cache key is the one cached_post(url, json={'names': names}) would use
+    key = HTTPCache.make_key('POST', url, json_body={'names': names})
+    cached = cache.get(key, url)
+    if cached is not None:
+        cache.stats['hits'] += 1
+        return _ott_ids_of(cached.text)
+    cache.stats['misses'] += 1
+    if cache.offline:
+        print(f"Offline mode: no cached OTT IDs for {len(names)} names")
+        return {}
+
+    for attempt in range(max_retries + 1):
+        await bucket.acquire()
+        try:
+            cache.stats['network'] += 1
+            async with session.post(url, json={'names': names}) as response:
+                if response.status == 200:
+                    text = await response.text()
+                    ott_ids = _ott_ids_of(text)
+                    cache.put(key, url, response.status, text)
+                    return ott_ids
+                if response.status not in RETRY_STATUSES:
+                    print(f"Error fetching OTT IDs for {len(names)} names: HTTP {response.status}")
+                    return {}
+                retry_after = response.headers.get('Retry-After')
+                status = f"HTTP {response.status}"
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # A request running past the session timeout raises asyncio.TimeoutError, not a ClientError
+            retry_after = None
+            status = str(e) or type(e).__name__
+
+        if attempt == max_retries:
+            print(f"Giving up on {len(names)} names after {max_retries + 1} attempts ({status})")
+            return {}
+
+        # Honour Retry-After when the server sends it, otherwise back off exponentially with jitter
+        delay = float(retry_after) if retry_after and retry_after.isdigit() else backoff * 2 ** attempt
+        await asyncio.sleep(delay * (1 + random.random() * 0.1))
+
+
+async def resolve_ott_ids_async(species_names, url=MATCH_NAMES_URL, batch_size=250, max_concurrency=4,
+                                requests_per_second=2.0, max_retries=5, backoff=1.0, progress=None, cache=None,
+                                timeout=REQUEST_TIMEOUT):
+    """
+    Resolves species names to OTT IDs with concurrent, batched OpenTree TNRS match_names requests.
+    Batches are looked up in the HTTP cache first, so reruns and offline mode do not call OpenTree.
+
+    Parameters:
+    - species_names: Names to resolve.
+    - url: TNRS match_names endpoint.
+    - batch_size: Number of names sent in each request.
+    - max_concurrency: Maximum number of requests in flight.
+    - requests_per_second: Sustained request rate allowed by the token bucket.
+    - max_retries: Retries per batch on HTTP 429/5xx, connection errors or timeouts.
+    - backoff: Base delay in seconds of the exponential backoff.
+    - progress: Optional callable receiving the number of names of each completed batch (e.g. tqdm.update).
+    - cache: HTTPCache to use. Defaults to the shared cache (http_cache.get_http_cache()).
+    - timeout: Total seconds allowed to each request; slower requests are retried like failed ones.
+
+    Returns:
+    - dict: The OTT ID of each name, None for names without a match or whose batch failed.
+    """
+    # Unique names, in the order they first appear
+    names = list(dict.fromkeys(name for name in species_names if isinstance(name, str)))
+    batches = [names[start:start + batch_size] for start in range(0, len(names), batch_size)]
+
+    cache = get_http_cache() if cache is None else cache
+    bucket = TokenBucket(requests_per_second)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    ott_ids = dict.fromkeys(names)
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        async def run(batch):
+            async with semaphore:
+                matched = await _match_batch(session, url, batch, bucket, max_retries, backoff, cache)
+            # TNRS echoes the submitted names, ignore anything else
+            ott_ids.update((name, ott_id) for name, ott_id in matched.items() if name in ott_ids)
+            if progress is not None:
+                progress(len(batch))
+
+        await asyncio.gather(*(run(batch) for batch in batches))
+
+    return ott_ids
+
+
+def resolve_ott_ids(species_names, **kwargs):
+    """
+    Synchronous wrapper of resolve_ott_ids_async, taking the same parameters.
+    Also works from Jupyter, where an event loop is already running.
+
+    Returns:
+    - dict: The OTT ID of each name, None for unresolved names.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(resolve_ott_ids_async(species_names, **kwargs))
+
+    # Inside a running loop (notebook): run the resolver on its own loop in a worker thread
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, resolve_ott_ids_async(species_names, **kwargs)).result()
@@ -0,0 +1,238 @@
+import os
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+from matplotlib.collections import LineCollection, PolyCollection
+from ploting import (get_species_corpus, pathway_colors, superclass_color_map, generate_shades,
+                     get_superclass_palette, EXCLUDED_PATHWAYS, EXCLUDED_SUPERCLASSES)
+from newick import ArrayTree, OTT_SUFFIX, parse_newick, read_newick
+from taxon_dataset import TAXON_COLUMN, is_taxon_dataset, read_taxon_dataset, taxon_dataset_path
+
+# Above this many leaves the leaf labels are not drawn
+MAX_LABELLED_LEAVES = 200
+
+
+def parse_ott_id(label):
+    """Returns the OTT id at the end of an OpenTree tip label, or None."""
+    match = OTT_SUFFIX.search(label or '')
+    return int(match.group(1)) if match else None
+
+
+def species_ott_ids(output_folder):
+    """
+    Returns the OTT id of each species of the 'species_data' folder.
+
+    Each TSV holds the compounds of one species, so only its first row is read. With a species_dataset
+    folder, the two columns of the dataset are read and the first row of every taxon is kept.
+
+    Returns:
+    - pd.Series: OTT id (Int64) indexed by species name.
+    """
+    columns = ['organism_taxonomy_09species', 'organism_taxonomy_ottid']
+    dataset_folder = taxon_dataset_path(output_folder, 'species')
+    if is_taxon_dataset(dataset_folder):
+        ott_ids = read_taxon_dataset(dataset_folder, columns=columns).drop_duplicates(TAXON_COLUMN)[columns]
+    else:
+        folder = os.path.join(output_folder, 'species_data')
+        frames = [
+            pd.read_csv(os.path.join(folder, filename), sep='\t', nrows=1, usecols=columns, dtype={'organism_taxonomy_09species': str})
+            for filename in os.listdir(folder) if filename.endswith(".tsv")
+        ]
+        ott_ids = pd.concat(frames, ignore_index=True)
+    ott_ids = ott_ids.dropna().drop_duplicates('organism_taxonomy_09species')
+    return ott_ids.set_index('organism_taxonomy_09species')['organism_taxonomy_ottid'].astype('float').astype('Int64')
+
+
+def species_class_counts(output_folder, key='Pathway'):
+    """
+    Counts the compounds of each species per chemical category, from the count cube of the output folder.
+
+    Parameters:
+    - output_folder: Folder containing 'species_data' (or a SpeciesCorpus).
+    - key: 'Pathway' or 'chemical_superclass'.
+
+    Returns:
+    - pd.DataFrame: One row per species, one column per category (ordered by first appearance).
+    """
+    corpus = get_species_corpus(output_folder)
+    exclude = {'Pathway': EXCLUDED_PATHWAYS} if key == 'Pathway' else {'chemical_superclass': EXCLUDED_SUPERCLASSES}
+    agg_data = corpus.recurrence('species', [key], exclude=exclude)
+    categories = [value for value in corpus.first_seen('species', key, exclude=exclude) if isinstance(value, str)]
+    counts = agg_data.pivot_table(index='species', columns=key, values='recurrence', aggfunc='sum', fill_value=0, observed=True)
+    return counts.reindex(columns=categories, fill_value=0)
+
+
+def as_array_tree(tree):
+    """Returns an ArrayTree from an ArrayTree, a Newick file path, a Newick string or an ete4 Tree."""
+    if isinstance(tree, ArrayTree):
+        return tree
+    if isinstance(tree, str):
+        return read_newick(tree) if os.path.exists(tree) else parse_newick(tree)
+    return parse_newick(tree.write(parser=1, format_root_node=True))
+
+
+def leaf_count_matrix(tree, counts, ott_ids=None):
+    """
+    Joins per-species counts onto the tree leaves.
+
+    A leaf is matched on the OTT id of its '_ottNNN' suffix, or on its name (underscores read as spaces)
+    when it has no suffix or its OTT id is unknown. The join is a hash lookup per leaf.
+
+    Parameters:
+    - tree: ArrayTree.
+    - counts: Per-species counts (species_class_counts).
+    - ott_ids: OTT id of each species (species_ott_ids), optional.
+
+    Returns:
+    - np.ndarray: Counts of every node (zero for internal nodes and unmatched leaves), shape (nodes, categories).
+    """
+    leaf_names = pd.Series(tree.names, dtype=object).str.replace(OTT_SUFFIX, '', regex=True).str.replace('_', ' ', regex=False)
+
+    rows = pd.Series(np.arange(len(counts)), index=counts.index)
+    matched = leaf_names.map(rows[~rows.index.duplicated()])
+    if ott_ids is not None:
+        ott_rows = pd.Series(rows.reindex(ott_ids.index).to_numpy(), index=ott_ids.to_numpy(dtype=np.int64, na_value=-1)).dropna()
+        ott_rows = ott_rows[ott_rows.index >= 0]  # -1 marks the leaves without an OTT id
+        matched = pd.Series(tree.ott_ids).map(ott_rows[~ott_rows.index.duplicated()]).fillna(matched)
+    matched = matched.where(tree.is_leaf).to_numpy(dtype=float)
+
+    matrix = np.zeros((len(tree), counts.shape[1]))
+    found = ~np.isnan(matched)
+    matrix[found] = counts.to_numpy(dtype=float)[matched[found].astype(np.int64)]
+    return matrix
+
+
+def clade_counts(tree, leaf_matrix):
+    """
+    Sums the leaf counts of every clade. Subtrees are contiguous in the pre-order numbering of
+    ArrayTree, so this is one prefix sum over the nodes.
+
+    Parameters:
+    - tree: ArrayTree.
+    - leaf_matrix: Counts of every node (leaf_count_matrix).
+
+    Returns:
+    - np.ndarray: Counts of the leaves under every node.
+    """
+    return tree.subtree_sums(leaf_matrix)
+
+
+def tree_layout(tree, cladogram=True):
+    """
+    Computes a rectangular layout: leaves on consecutive rows, internal nodes centred on their leaves.
+
+    Parameters:
+    - tree: ArrayTree.
+    - cladogram: Ignore the branch lengths (OpenTree synthetic trees have none).
+
+    Returns:
+    - tuple: x and y of every node.
+    """
+    # Leaves before each node in pre-order, the leaves of a subtree are the rows [first, last]
+    leaves_before = np.concatenate([[0], np.cumsum(tree.is_leaf)])
+    nodes = np.arange(len(tree))
+    first, last = leaves_before[nodes], leaves_before[nodes + tree.size] - 1
+    y = (first + last) / 2
+    x = tree.depth.astype(float) if cladogram else tree.root_distance()
+    return x, y
+
+
+def plot_tree_chemistry(tree, counts, output_file, ott_ids=None, colors=None, normalize=False, cladogram=True, dpi=150):
+    """
+    Draws the tree next to a stacked bar of the chemical categories of each leaf, as a static image.
+
+    Parameters:
+    - tree: ArrayTree.
+    - counts: Per-species counts (species_class_counts).
+    - output_file: Image path (.png, .svg or .pdf).
+    - ott_ids: OTT id of each species (species_ott_ids), optional.
+    - colors: Color of each category, defaults to the pathway colors.
+    - normalize: Draw the share of each category instead of the counts.
+    - cladogram: Ignore the branch lengths.
+    - dpi: Resolution of raster images.
+
+    Returns:
+    - np.ndarray: The clade counts of every node (clade_counts).
+    """
+    x, y = tree_layout(tree, cladogram=cladogram)
+    matrix = leaf_count_matrix(tree, counts, ott_ids=ott_ids)
+    totals = clade_counts(tree, matrix)
+
+    leaves = tree.leaves
+    n_leaves = len(leaves)
+    bars = matrix[leaves]
+    if normalize:
+        bars = bars / np.maximum(bars.sum(axis=1, keepdims=True), 1)
+
+    height = min(max(4, n_leaves * 0.15), 200)
+    # Figure object API: no pyplot state, so the panel also renders headless and in worker processes
+    fig = Figure(figsize=(14, height))
+    ax_tree, ax_bars = fig.subplots(1, 2, sharey=True, gridspec_kw={'width_ratios': [2, 3], 'wspace': 0.02})
+
+    # Step 1: Branches, one horizontal segment per node and one vertical segment per internal node
+    children = np.arange(1, len(tree))
+    up = tree.parent[children]
+    segments = np.concatenate([
+        np.stack([np.column_stack([x[up], y[children]]), np.column_stack([x[children], y[children]])], axis=1),
+        np.stack([np.column_stack([x[up], y[children]]), np.column_stack([x[up], y[up]])], axis=1)
+    ])
+    ax_tree.add_collection(LineCollection(segments, colors='black', linewidths=0.5 if n_leaves < 2000 else 0.2))
+    ax_tree.set_xlim(-0.02 * x.max(), x.max() * 1.02 + 1e-9)
+    ax_tree.axis('off')
+
+    # Step 2: Stacked bars, one collection of rectangles per category (a patch per bar does not scale to 10k+ leaves)
+    colors = colors or pathway_colors
+    left = np.zeros(n_leaves)
+    half = (0.8 if n_leaves < 2000 else 1.0) / 2
+    bottom, top = y[leaves] - half, y[leaves] + half
+    for i, category in enumerate(counts.columns):
+        right = left + bars[:, i]
+        drawn = bars[:, i] > 0
+        rectangles = np.stack([np.column_stack([left, bottom]), np.column_stack([right, bottom]),
+                               np.column_stack([right, top]), np.column_stack([left, top])], axis=1)[drawn]
+        ax_bars.add_collection(PolyCollection(rectangles, facecolors=colors.get(category, '#D3D3D3'), linewidths=0, label=category))
+        left = right
+    ax_bars.set_xlim(0, max(left.max(), 1e-9) * 1.02)
+
+    ax_bars.set_ylim(-1, n_leaves)
+    ax_bars.invert_yaxis()
+    ax_bars.set_xlabel('Share of compounds' if normalize else 'Number of compounds')
+    if n_leaves <= MAX_LABELLED_LEAVES:
+        ax_bars.yaxis.tick_right()
+        ax_bars.set_yticks(y[leaves])
+        ax_bars.set_yticklabels([OTT_SUFFIX.sub('', tree.names[leaf]).replace('_', ' ') for leaf in leaves], fontsize=6)
+    else:
+        ax_bars.set_yticks([])
+    ax_bars.legend(loc='upper left', bbox_to_anchor=(1.0 if n_leaves > MAX_LABELLED_LEAVES else 1.25, 1), fontsize=8, frameon=False)
+
+    fig.savefig(output_file, dpi=dpi, bbox_inches='tight')
+    print(f"✅ Tree chemistry panel saved to {output_file} ({n_leaves} leaves, {int((matrix[leaves].sum(axis=1) > 0).sum())} with compounds)")
+    return totals
+
+
+def tree_chemistry_panel(tree, output_folder, output_file, key='Pathway', normalize=False, cladogram=True):
+    """
+    Joins the per-species chemistry of an output folder onto a tree and renders the static panel.
+
+    Parameters:
+    - tree: ArrayTree, Newick file path (e.g. 'Celastraceae.tre'), Newick string or ete4 Tree.
+    - output_folder: Folder containing 'species_data'.
+    - output_file: Image path.
+    - key: 'Pathway' or 'chemical_superclass'.
+    - normalize: Draw the share of each category instead of the counts.
+    - cladogram: Ignore the branch lengths.
+
+    Returns:
+    - pd.DataFrame: Clade counts of every named node (one column per category).
+    """
+    counts = species_class_counts(output_folder, key=key)
+    colors = None
+    if key == 'chemical_superclass':
+        colors = superclass_color_map(pd.Series(counts.columns), generate_shades, palette=get_superclass_palette())
+
+    tree = as_array_tree(tree)
+    totals = plot_tree_chemistry(tree, counts, output_file, ott_ids=species_ott_ids(output_folder),
+                                 colors=colors, normalize=normalize, cladogram=cladogram)
+    clades = pd.DataFrame(totals, columns=counts.columns)
+    clades.insert(0, 'node', tree.names)
+    return clades[clades['node'] != '']
@@ -92,12 +92,27 @@ t.explore(
     keep_server=True)
 
 
+### celastraceae tree with the chemistry of species_data (static figure, no server)
+
+from newick import read_newick
+from tree_chemistry import tree_chemistry_panel
+
+output_folder = '/mnt/c/Users/quirosgu/Desktop/Celastraceae/results'  # Folder containing 'species_data'
+
+t = read_newick('Celastraceae.tre')  # Array-backed tree, t.to_ete4() when the ete4 explorer is needed
+
+# Leaves are joined on their _ottNNN suffix, clade totals are prefix sums over the pre-order nodes
+clade_counts = tree_chemistry_panel(t, output_folder, 'Celastraceae_pathways.png')
+clade_counts.to_csv('Celastraceae_clade_counts.tsv', sep='\t', index=False)
+
+
 
 ##### test recovery from a list of sp ######
 
 import csv
 import requests
 import time
+from http_cache import cached_get, cached_post
 
 input_path = '/mnt/c/Users/quirosgu/Desktop/Inmuno/Clean_collection_taxonomical_data.csv'
 species_header = 'query_otol_species'
@@ -107,8 +122,9 @@ REQUESTS_PER_MINUTE = 10
 REQUEST_INTERVAL = 60.0 / REQUESTS_PER_MINUTE  # time between requests in seconds
 
 def get_ott_id(species_name):
-    time.sleep(REQUEST_INTERVAL)  # Wait before making the request
-    response = requests.get(f"https://api.opentreeoflife.org/v3/tnrs/match_names", json={'names': [species_name]})
+    response = cached_get(f"https://api.opentreeoflife.org/v3/tnrs/match_names", json={'names': [species_name]})
+    if not response.from_cache:
+        time.sleep(REQUEST_INTERVAL)  # Rate limit only the requests that reached the API
     if response.status_code == 200:
         results = response.json()
         return results['results'][0]['matches'][0]['taxon']['ott_id'] if results['results'][0]['matches'] else None
@@ -117,8 +133,9 @@ def get_ott_id(species_name):
         return None
 
 def get_newick_tree(ott_ids):
-    time.sleep(REQUEST_INTERVAL)  # Wait before making the request
-    response = requests.post("https://api.opentreeoflife.org/v3/tree_of_life/induced_subtree", json={'ott_ids': ott_ids})
+    response = cached_post("https://api.opentreeoflife.org/v3/tree_of_life/induced_subtree", json={'ott_ids': ott_ids})
+    if not response.from_cache:
+        time.sleep(REQUEST_INTERVAL)  # Rate limit only the requests that reached the API
     if response.status_code == 200:
         return response.json()['newick']
     else:
@@ -218,6 +235,8 @@ if __name__ == "__main__":
 import csv
 import requests
 import time
+from http_cache import cached_get, cached_post
+from tnrs import resolve_ott_ids
 import random
 from ete4 import Tree
 from ete4.smartview import TreeLayout, RectFace, TextFace, ScaleFace, TreeStyle
@@ -237,9 +256,10 @@ def get_ott_id(species_name):
     Returns:
         int: The OTT ID of the species, or None if not found or in case of an error.
     """
-    time.sleep(REQUEST_INTERVAL)
     try:
-        response = requests.post("https://api.opentreeoflife.org/v3/tnrs/match_names", json={'names': [species_name]})
+        response = cached_post("https://api.opentreeoflife.org/v3/tnrs/match_names", json={'names': [species_name]})
+        if not response.from_cache:
+            time.sleep(REQUEST_INTERVAL)  # Rate limit only the requests that reached the API
         if response.status_code == 200:
             results = response.json()
             print(f"Response for {species_name}: {results}")  # Debugging: Print the response
@@ -260,9 +280,10 @@ def get_newick_tree(ott_ids):
     Returns:
         str: The Newick tree string, or None in case of an error.
     """
-    time.sleep(REQUEST_INTERVAL)
     try:
-        response = requests.post("https://api.opentreeoflife.org/v3/tree_of_life/induced_subtree", json={'ott_ids': ott_ids})
+        response = cached_post("https://api.opentreeoflife.org/v3/tree_of_life/induced_subtree", json={'ott_ids': ott_ids})
+        if not response.from_cache:
+            time.sleep(REQUEST_INTERVAL)  # Rate limit only the requests that reached the API
         if response.status_code == 200:
             return response.json()['newick']
         else:
@@ -293,12 +314,9 @@ def main():
     # Initialize the progress bar
     pbar = tqdm(total=len(species_list), desc="Processing species", unit="species")
 
-    ott_ids = []
-    for species in species_list:
-        ott_id = get_ott_id(species)
-        if ott_id:
-            ott_ids.append(ott_id)
-        pbar.update(1)  # Update the progress bar for each species processed
+    # Resolve the names in concurrent TNRS batches, updating the progress bar per batch
+    resolved = resolve_ott_ids(species_list, requests_per_second=REQUESTS_PER_MINUTE / 60.0, progress=pbar.update)
+    ott_ids = [ott_id for ott_id in resolved.values() if ott_id]
 
     pbar.close()  # Close the progress bar
 
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The modules live flat in src/, as in the notebooks
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC)
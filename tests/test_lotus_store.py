@@ -0,0 +1,87 @@
+import os
+import sys
+import subprocess
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import SRC
+from lotus_store import load_lotus
+from fetch_and_process import LOTUS_COLUMNS, hash_taxon_rows
+
+QCODES = ['Q1', 'Q7']
+
+# Extra peak memory allowed to the chunked reader on the 200k-row file (a whole-file read takes ~260 MB)
+CHUNKED_MEMORY_CEILING_MB = 48
+
+
+@pytest.fixture(scope='module')
+def mixed_csv(tmp_path_factory):
+    # LOTUS-like rows whose gbifid column holds numbers in its first chunks and text further down
+    n = 20000
+    frame = pd.DataFrame({column: [f'{column}_{i % 97}' for i in range(n)] for column in LOTUS_COLUMNS})
+    frame['wikidata_Qcode'] = [f'Q{i % 300}' for i in range(n)]
+    frame['organism_taxonomy_08genus'] = [f'G{i % 40}' for i in range(n)]
+    frame['organism_taxonomy_gbifid'] = [str(486746 + i) for i in range(n)]
+    frame.loc[18000, 'organism_taxonomy_gbifid'] = 'not-a-number'
+    frame['structure_cid'] = np.arange(n)
+    frame['structure_exact_mass'] = np.arange(n) * 0.5
+    frame['organism_taxonomy_ottid'] = [i if i != 15000 else None for i in range(n)]
+    frame['organism_taxonomy_10varietas'] = None
+    path = tmp_path_factory.mktemp('lotus') / 'mixed.csv'
+    frame.to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.fixture(scope='module')
+def large_csv(tmp_path_factory):
+    n = 200000
+    rng = np.random.default_rng(0)
+    rows = pd.Series(np.arange(n))
+    frame = pd.DataFrame({
+        'wikidata_Qcode': 'Q' + (rows % 5000).astype(str),
+        'organism_taxonomy_08genus': 'G' + (rows % 500).astype(str),
+        'structure_inchikey': 'IK' + rows.astype(str).str.zfill(25)
+    })
+    for k in range(8):
+        frame[f'text{k}'] = 'value_' + pd.Series(rng.integers(0, 10 ** 9, n)).astype(str) + '_padding_text'
+    path = tmp_path_factory.mktemp('lotus') / 'large.csv'
+    frame.to_csv(path, index=False)
+    return str(path)
+
+
+def test_chunked_read_matches_full_read(mixed_csv):
+    full = load_lotus(mixed_csv, qcodes=QCODES)
+    chunked = load_lotus(mixed_csv, qcodes=QCODES, chunksize=5000)
+    assert (full.dtypes == chunked.dtypes).all()
+    pd.testing.assert_frame_equal(full, chunked)
+    assert chunked['organism_taxonomy_gbifid'].iloc[0] == '486747'
+
+
+def test_input_hashes_do_not_depend_on_column_types(mixed_csv):
+    full = load_lotus(mixed_csv, columns=LOTUS_COLUMNS, qcodes=QCODES)
+    chunked = load_lotus(mixed_csv, columns=LOTUS_COLUMNS, qcodes=QCODES, chunksize=5000)
+    as_text = full.astype(str).where(full.notna())
+    hashes = hash_taxon_rows(full, 'wikidata_Qcode', QCODES)
+    assert hash_taxon_rows(chunked, 'wikidata_Qcode', QCODES) == hashes
+    assert hash_taxon_rows(as_text, 'wikidata_Qcode', QCODES) == hashes
+
+
+def _peak_rss_mb(csv_path, mode):
+    # Peak resident memory of a fresh interpreter loading the rows of two Q codes
+    script = (
+        "import sys, resource\n"
+        f"sys.path.insert(0, {SRC!r})\n"
+        "from lotus_store import load_lotus\n"
+        f"if {mode!r} == 'chunked':\n"
+        f"    load_lotus({csv_path!r}, qcodes={QCODES!r}, chunksize=5000)\n"
+        "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)\n"
+    )
+    return float(subprocess.run([sys.executable, '-c', script], check=True, capture_output=True, text=True).stdout)
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='ru_maxrss is reported in KB on Linux only')
+def test_chunked_read_memory_ceiling(large_csv):
+    baseline = _peak_rss_mb(large_csv, 'imports')
+    chunked = _peak_rss_mb(large_csv, 'chunked')
+    assert os.path.getsize(large_csv) / 1024 ** 2 > CHUNKED_MEMORY_CEILING_MB
+    assert chunked - baseline < CHUNKED_MEMORY_CEILING_MB
@@ -0,0 +1,96 @@
+import os
+import re
+import csv
+import io
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import SRC
+from http_cache import HTTPCache, cached_post, set_http_cache
+
+# Names known to the stub endpoint: every even species and a name that needs escaping
+KNOWN = {f"Species {i}": f"http://www.wikidata.org/entity/Q{1000 + i}" for i in range(0, 1600, 2)}
+KNOWN['Odd "quoted" \\ name'] = 'http://www.wikidata.org/entity/Q7'
+
+
+class StubSparqlHandler(BaseHTTPRequestHandler):
+    # Answers VALUES ?name queries in CSV like the Wikidata Query Service, counting the requests
+    requests = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        query = urllib.parse.parse_qs(body)['query'][0]
+        names = [re.sub(r'\\(.)', r'\1', name) for name in re.findall(r'"((?:[^"\\]|\\.)*)"@en', query)]
+        self.requests.append(names)
+
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(['name', 'species'])
+        for name in names:
+            if name in KNOWN:
+                writer.writerow([name, KNOWN[name]])
+        data = out.getvalue().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def sparql_endpoint():
+    StubSparqlHandler.requests = []
+    server = HTTPServer(('127.0.0.1', 0), StubSparqlHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/sparql", StubSparqlHandler.requests
+    server.shutdown()
+
+
+@pytest.fixture
+def http_cache(tmp_path):
+    cache = HTTPCache(str(tmp_path / 'http_cache.sqlite'))
+    set_http_cache(cache)
+    yield cache
+    set_http_cache(None)
+    cache.close()
+
+
+@pytest.fixture
+def notebook():
+    # data_and_visualization.py is a dump of notebook cells that rely on the notebook globals
+    namespace = dict(pd=pd, np=np, os=os, StringIO=io.StringIO, cached_post=cached_post,
+                     time=type('NoSleep', (), {'sleep': staticmethod(lambda seconds: None)}),
+                     species_header='ATTRIBUTE_Species')
+    with open(os.path.join(SRC, 'data_and_visualization.py')) as handle:
+        exec(handle.read(), namespace)
+    return namespace
+
+
+def test_process_csv_file_batches_names(tmp_path, sparql_endpoint, http_cache, notebook):
+    endpoint_url, requests = sparql_endpoint
+    names = [f"Species {i}" for i in range(1600)] + ['Odd "quoted" \\ name', np.nan, 'Species 2']
+    input_file = tmp_path / 'collection.csv'
+    pd.DataFrame({'ATTRIBUTE_Species': names}).to_csv(input_file, index=False)
+    output_folder = tmp_path / 'out'
+    output_folder.mkdir()
+
+    notebook['process_csv_file'](str(input_file), str(output_folder), batch_size=200, endpoint_url=endpoint_url)
+
+    # 1,601 distinct names in batches of 200, each name sent once
+    assert len(requests) == 9
+    assert sum(len(batch) for batch in requests) == 1601
+
+    out = pd.read_csv(output_folder / 'collection.csv')
+    expected = [KNOWN.get(name, 'Not Found') if isinstance(name, str) else 'Not Found' for name in names]
+    assert list(out['wikidata_Qcode_hyperlink']) == expected
+    assert list(out['wikidata_Qcode']) == [value.rsplit('/', 1)[-1] for value in expected]
+
+    # A repeat run is served from the HTTP cache
+    notebook['process_csv_file'](str(input_file), str(output_folder), batch_size=200, endpoint_url=endpoint_url)
+    assert len(requests) == 9
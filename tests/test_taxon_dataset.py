@@ -0,0 +1,73 @@
+import os
+import pandas as pd
+import pytest
+from fetch_and_process import LOTUS_COLUMNS, export_taxon_tsv, process_species_data, recover_LOTUS_data_sp
+from ploting import SpeciesCorpus
+from taxon_dataset import read_dataset_manifest, read_taxon_dataset, taxon_dataset_path, taxon_tables
+
+# Q codes of the LOTUS rows; Q999 is a species without any LOTUS row
+QCODES = [f'Q{i}' for i in range(50)]
+
+
+@pytest.fixture
+def lotus_csv(tmp_path):
+    # Three compounds per species, with the columns read by recover_LOTUS_data and process_species_data
+    n = 3 * len(QCODES)
+    frame = pd.DataFrame({column: [f'{column}_{i % 7}' for i in range(n)] for column in LOTUS_COLUMNS})
+    frame['wikidata_Qcode'] = [QCODES[i % len(QCODES)] for i in range(n)]
+    frame['structure_inchikey'] = [f'IK{i:025d}' for i in range(n)]
+    frame['structure_taxonomy_npclassifier_01pathway'] = 'Alkaloids'
+    frame['Reported_comp_Species'] = 3
+    frame['Reported_comp_Genus'] = 9
+    path = tmp_path / 'lotus.csv'
+    frame.to_csv(path, index=False)
+    return str(path)
+
+
+def _run(tmp_path, lotus_csv, qcodes):
+    input_folder = tmp_path / 'input'
+    input_folder.mkdir(exist_ok=True)
+    pd.DataFrame({'wikidata_Qcode': qcodes, 'Genus': 'G'}).to_csv(input_folder / 'species.csv', index=False)
+    output_folder = str(tmp_path / 'out')
+    recover_LOTUS_data_sp(str(input_folder / 'species.csv'), lotus_csv, output_folder, layout='dataset')
+    process_species_data(str(input_folder), output_folder, lotus_csv)
+    return output_folder
+
+
+def test_rerun_adding_a_species_without_rows(tmp_path, lotus_csv):
+    output_folder = _run(tmp_path, lotus_csv, QCODES)
+    output_folder = _run(tmp_path, lotus_csv, QCODES + ['Q999'])
+    dataset = taxon_dataset_path(output_folder)
+
+    manifest = read_dataset_manifest(dataset)
+    assert manifest['taxa']['Q999'] == {'file': None, 'rows': 0, 'input_hash': manifest['taxa']['Q999']['input_hash'],
+                                        'spec_version': manifest['taxa']['Q0']['spec_version']}
+    assert len(manifest['parts']) == 1
+    assert len(read_taxon_dataset(dataset)) == 3 * len(QCODES)
+    assert len(taxon_tables(dataset, ['Q999'])['Q999']) == 0
+
+    full_results = pd.read_csv(os.path.join(output_folder, 'Full_results.csv'))
+    assert full_results['predicted_superclass'].notna().sum() == 3 * len(QCODES)
+    assert len(SpeciesCorpus(output_folder).load('species')) == 3 * len(QCODES)
+
+    entries = export_taxon_tsv(output_folder)
+    assert entries['Q999']['rows'] == 0
+    assert sorted(os.listdir(os.path.join(output_folder, 'species_data'))) == sorted(
+        [f'{qcode}.tsv' for qcode in QCODES + ['Q999']] + ['manifest.json'])
+
+    # A third run finds every species unchanged, the one without rows included
+    _run(tmp_path, lotus_csv, QCODES + ['Q999'])
+    assert read_dataset_manifest(dataset) == manifest
+
+
+def test_first_run_without_rows(tmp_path, lotus_csv):
+    output_folder = _run(tmp_path, lotus_csv, ['Q998', 'Q999'])
+    dataset = taxon_dataset_path(output_folder)
+
+    manifest = read_dataset_manifest(dataset)
+    assert manifest['parts'] == {}
+    assert [entry['rows'] for entry in manifest['taxa'].values()] == [0, 0]
+    assert read_taxon_dataset(dataset).empty
+    assert [len(table) for table in taxon_tables(dataset).values()] == [0, 0]
+    assert SpeciesCorpus(output_folder).load('species').empty
+    assert os.path.exists(os.path.join(output_folder, 'Full_results.csv'))
@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import pytest
+from aiohttp import web
+from http_cache import HTTPCache
+from tnrs import resolve_ott_ids
+
+
+@pytest.fixture
+def tnrs_endpoint():
+    # Stub of the OpenTree match_names endpoint: 'Species i' matches OTT i unless i is a multiple of 3,
+    # the first request is rate limited and batches holding a 'Slow' name answer after one second
+    requests = []
+
+    async def match_names(request):
+        names = (await request.json())['names']
+        requests.append(names)
+        if any(name.startswith('Slow') for name in names):
+            await asyncio.sleep(1)
+        if len(requests) == 1:
+            return web.Response(status=429, headers={'Retry-After': '0'})
+        results = [{'name': name, 'matches': [{'taxon': {'ott_id': int(name.split()[-1])}}] if int(name.split()[-1]) % 3 else []}
+                   for name in names]
+        return web.json_response({'results': results})
+
+    loop = asyncio.new_event_loop()
+    app = web.Application()
+    app.router.add_post('/v3/tnrs/match_names', match_names)
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{port}/v3/tnrs/match_names", requests
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+
+
+def test_resolve_ott_ids_goes_through_the_http_cache(tmp_path, tnrs_endpoint):
+    url, requests = tnrs_endpoint
+    names = [f"Species {i}" for i in range(1, 1001)] + ['Species 1', None]
+    expected = {f"Species {i}": i if i % 3 else None for i in range(1, 1001)}
+    cache_path = str(tmp_path / 'http_cache.sqlite')
+    options = dict(url=url, batch_size=100, requests_per_second=100, backoff=0.01)
+
+    # First run: 10 batches plus the rate-limited retry, every 200 response is cached
+    cache = HTTPCache(cache_path)
+    assert resolve_ott_ids(names, cache=cache, **options) == expected
+    assert len(requests) == 11
+    assert cache.stats['misses'] == 10
+
+    # Rerun: served from the cache
+    assert resolve_ott_ids(names, cache=cache, **options) == expected
+    assert len(requests) == 11
+    assert cache.stats['hits'] == 10
+    cache.close()
+
+    # Offline mode: cached batches are served, the others are left unresolved without any request
+    offline = HTTPCache(cache_path, offline=True)
+    assert resolve_ott_ids(names, cache=offline, **options) == expected
+    resolved = resolve_ott_ids(['Species 1001'], cache=offline, **options)
+    assert resolved == {'Species 1001': None}
+    assert len(requests) == 11
+    offline.close()
+
+
+def test_resolve_ott_ids_from_a_running_loop(tmp_path, tnrs_endpoint):
+    # In notebooks the resolver runs on a worker thread, which must be able to use the cache
+    url, requests = tnrs_endpoint
+    cache = HTTPCache(str(tmp_path / 'http_cache.sqlite'))
+
+    async def notebook_cell():
+        return resolve_ott_ids(['Species 2', 'Species 3'], cache=cache, url=url, requests_per_second=100, backoff=0.01)
+
+    assert asyncio.run(notebook_cell()) == {'Species 2': 2, 'Species 3': None}
+    assert cache.stats['network'] == 2
+    cache.close()
+
+
+def test_resolve_ott_ids_retries_timeouts(tmp_path, tnrs_endpoint):
+    # A batch slower than the timeout is retried, then given up, without losing the other batches
+    url, requests = tnrs_endpoint
+    cache = HTTPCache(str(tmp_path / 'http_cache.sqlite'))
+    names = ['Slow 1', 'Slow 2'] + [f"Species {i}" for i in range(1, 7)]
+    resolved = resolve_ott_ids(names, cache=cache, url=url, batch_size=2, requests_per_second=100,
+                               max_retries=1, backoff=0.01, timeout=0.3)
+    assert resolved == {'Slow 1': None, 'Slow 2': None, **{f"Species {i}": i if i % 3 else None for i in range(1, 7)}}
+    assert sum(batch == ['Slow 1', 'Slow 2'] for batch in requests) == 2
+    cache.close()